@@ -40,3 +40,16 @@ def dir_path(path):
         raise argparse.ArgumentTypeError(
             f"Invalid argument ({path}), not a directory path or directory does not exist."
         )
+
+
+def positive_int(value):
+    try:
+        res = int(value)
+    except ValueError:
+        res = 0
+    if res > 0:
+        return res
+    else:
+        raise argparse.ArgumentTypeError(
+            f"Invalid argument ({value}), not a positive integer."
+        )
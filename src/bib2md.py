@@ -21,14 +21,27 @@ import subprocess
 import tempfile
 import argparse
 import sys
-from argparse_types import file_path
+import re
+import concurrent.futures
+from argparse_types import file_path, positive_int
+from bib_parser import load_bibliography, normalized_doi, sort_bibliography
+from bib_render import parse_latex, plain_text, render_bibliography
+import kb_profile
+from kb_cache import (
+    CACHE_DIR_NAME,
+    RenderCache,
+    default_cache_dir,
+    hash_file,
+    hash_json,
+)
 
 """
 This script creates the publications markdown page from the publications.bib bibliography
 file (in biblatex format). It uses the pandoc tool to do the conversion. Note that all publications
 found in the publications.bib file are listed. The order of the entries in that file does not
-matter, we use the bibtexparser package to sort them in reverse chronological order and in
-secondary alphabetical order using the first author's last name.
+matter, they are sorted in reverse chronological order and in secondary alphabetical order using
+the first author's last name. Entries with a missing year or author and duplicate citation keys
+are reported as errors, duplicate DOIs are reported as warnings (see bib_parser.py).
 
 The formatting of the references is determined by a citation style language (csl) file provided
 as part of the input.
@@ -41,29 +54,69 @@ We use a "custom" style based on the ieee.csl:
 2. List and quick access to corresponding author emails.
 3. Display keywords for convenient searching.
 
+Running pandoc on the whole bibliography is slow, so the rendered references are cached (.ibex_cache
+directory next to the bib file), keyed by the content of the bibliography entry. Only new or
+modified entries are rendered by pandoc and the cached references are combined in the sorted
+order, renumbered. The cache is discarded when the csl file or the pandoc version change. The line
+wrapping of a reference depends on the number of digits in its citation number, so entries are
+rendered at a citation number with the same number of digits as their final one (preceded by
+placeholder entries if needed). Each rendered reference is checked against the entry it should have
+been rendered from, its title and DOI. If pandoc's output does not match the entries (e.g. a csl
+file which sorts the bibliography), the whole bibliography is rendered without the cache. The
+result is the same as rendering the whole bibliography.
+Reading a large bib file is also slow, so the parsed entries are cached in the same directory
+(see bib_parser.py).
+
+For a large bibliography, the entries that need to be rendered can be split into consecutive chunks
+which are rendered by concurrent pandoc processes (--jobs).
+
+pandoc is the reference engine. The references can also be rendered without pandoc using a built-in
+renderer, bib_render.py (--engine=python), which reproduces the ibex.csl formatting for the entry
+types we use (article, inproceedings, misc/dataset and online). It does not read the csl file and
+does not use the render cache.
+
 This script is run automatically when modifications to the publications.bib file are merged
 into the main branch.
 """
 
+pandoc_md_preamble = '---\nnocite: "@*"\n---\n# Publications\n Publications are listed in reverse chronological order.'  # noqa E501
+
+# Increment when the rendering of the references changes, the cache is discarded
+RENDER_FORMAT_VERSION = 1
 
-def bibfile2md(bib_file, citation_style_language_file, output_file):
+_citation_number = re.compile(r"\\\[(\d+)\\\]")
+_word = re.compile(r"\w+")
+_doi = re.compile(r"\b10\.\d{4,9}/")
+
+
+def read_bibliography(bib_file, cache_dir=None):
     """
-    Use pandoc to convert a bibtex/biblatex file to a markdown list of references.
-    The reference format is determined by the citation style language file. A wide
-    variety of style files are available from the zotero site https://www.zotero.org/styles.
+    Read the bibliography file and return its entries sorted in reverse chronological order
+    and secondary order using author alphabetical order (see bib_parser.py).
     """
-    pandoc_md_preamble = '---\nnocite: "@*"\n---\n# Publications\n Publications are listed in reverse chronological order.'  # noqa E501
-    # Read the bibliography file, sort it and write to temp file which is then used
-    # as input for pandoc which converts it to a markdown file.
-    with open(bib_file) as biblatex_file:
-        bib_database = bibtexparser.load(biblatex_file)
-        # sort in reverse chronological order and secondary order using author alphabetical order
-        bib_database.entries = sorted(
-            bib_database.entries, key=lambda d: (-int(d["year"]), d["author"])
-        )
+    with kb_profile.phase("load bibliography"):
+        entries = load_bibliography(bib_file, cache_dir)
+    with kb_profile.phase("sort bibliography"):
+        return sort_bibliography(entries)
+
+
+def pandoc_version():
+    return subprocess.run(
+        ["pandoc", "--version"], check=True, capture_output=True, text=True
+    ).stdout.splitlines()[0]
+
+
+def pandoc_render(entries, citation_style_language_file):
+    """
+    Use pandoc to convert the bibliography entries to a markdown list of references, in
+    the given order. Returns the markdown text.
+    """
+    bib_database = bibtexparser.bibdatabase.BibDatabase()
+    bib_database.entries = entries
     writer = bibtexparser.bwriter.BibTexWriter()
-    # don't sort entries (writer has sorting functionality but not what we need, as above)
+    # don't sort entries (writer has sorting functionality but not what we need)
     writer.order_entries_by = None
+    # Write the entries to a temp file which is then used as input for pandoc
     with tempfile.TemporaryDirectory() as tmpdirname:
         sorted_bib_filepath = tmpdirname + "/sorted.bib"
         with open(sorted_bib_filepath, "w") as fp:
@@ -71,6 +124,7 @@ def bibfile2md(bib_file, citation_style_language_file, output_file):
         pandoc_md_filepath = tmpdirname + "/pandoc_publications_in.md"
         with open(pandoc_md_filepath, "w") as fp:
             fp.write(pandoc_md_preamble)
+        output_filepath = tmpdirname + "/publications.md"
 
         args = [
             "pandoc",
@@ -83,9 +137,196 @@ def bibfile2md(bib_file, citation_style_language_file, output_file):
             pandoc_md_filepath,
             f"--bibliography={sorted_bib_filepath}",
             "-o",
-            output_file,
+            output_filepath,
         ]
         subprocess.check_call(args)
+        with open(output_filepath, encoding="utf-8", newline="") as fp:
+            return fp.read()
+
+
+def reference_words(text):
+    # markdown escapes and letter case do not change the words of the reference
+    return " " + " ".join(_word.findall(text.replace("\\", "").lower())) + " "
+
+
+def reference_matches(reference, entry):
+    """
+    Check that the markdown reference was rendered from the bibliography entry, the
+    reference contains the words of the entry's title, in order, and the entry's DOI
+    if the reference lists a DOI.
+    """
+    title_words = reference_words(plain_text(parse_latex(entry.get("title", ""))))
+    if not title_words.strip() or title_words not in reference_words(reference):
+        return False
+    doi = normalized_doi(entry.get("doi", ""))
+    text = reference.replace("\\", "").lower()
+    return not doi or not _doi.search(text) or doi in text
+
+
+def split_references(md_text, entries):
+    """
+    Split the pandoc markdown output into the text preceding the references and the
+    references, each reference is a paragraph which starts with its citation number and
+    was rendered from the corresponding entry (see reference_matches). Returns None if
+    the text does not have this structure.
+    """
+    if not md_text.endswith("\n"):
+        return None
+    paragraphs = md_text[:-1].split("\n\n")
+    header_count = len(paragraphs) - len(entries)
+    if header_count < 0:
+        return None
+    references = paragraphs[header_count:]
+    for citation_number, (reference, entry) in enumerate(
+        zip(references, entries), start=1
+    ):
+        match = _citation_number.search(reference)
+        if (
+            not match
+            or int(match.group(1)) != citation_number
+            or not reference_matches(reference, entry)
+        ):
+            return None
+    return "\n\n".join(paragraphs[:header_count]), references
+
+
+def placeholder_entry(citation_number):
+    return {
+        "ENTRYTYPE": "misc",
+        "ID": f"bib2md_placeholder_{citation_number}",
+        "title": "Placeholder",
+    }
+
+
+def render_references(entries, indexes, citation_style_language_file):
+    """
+    Use pandoc to render the entries with the given indexes (in ascending order) of the
+    sorted bibliography. Each entry is rendered at a citation number with the same number
+    of digits as its final citation number, index+1, so that the line wrapping is the same.
+    Returns the text preceding the references and the list of references, None if the
+    pandoc output does not have the expected structure (see split_references).
+    """
+    render_entries = []
+    render_indexes = []
+    for i in indexes:
+        while len(str(len(render_entries) + 1)) < len(str(i + 1)):
+            render_entries.append(placeholder_entry(len(render_entries) + 1))
+        render_indexes.append(len(render_entries))
+        render_entries.append(entries[i])
+    rendered = split_references(
+        pandoc_render(render_entries, citation_style_language_file),
+        render_entries,
+    )
+    if rendered is None:
+        return None
+    return rendered[0], [rendered[1][render_index] for render_index in render_indexes]
+
+
+def entry_key(entry, citation_number):
+    # whitespace in the field values does not change the rendered reference
+    normalized_entry = {key: " ".join(value.split()) for key, value in entry.items()}
+    return hash_json([normalized_entry, len(str(citation_number))])
+
+
+def bibfile2md(
+    bib_file,
+    citation_style_language_file,
+    output_file,
+    cache_dir=None,
+    jobs=1,
+    engine="pandoc",
+):
+    """
+    Use pandoc to convert a bibtex/biblatex file to a markdown list of references.
+    The reference format is determined by the citation style language file. A wide
+    variety of style files are available from the zotero site https://www.zotero.org/styles.
+    If a cache_dir is given, only the entries which are not in the render cache are
+    converted by pandoc (see kb_cache.RenderCache). The entries are split into up to
+    jobs consecutive chunks which are converted by concurrent pandoc processes.
+    If the engine is "python", the entries are converted by the built-in renderer
+    (see bib_render.py), the csl file and jobs are not used and only the parsed entries
+    are cached.
+    """
+    entries = read_bibliography(bib_file, cache_dir)
+    if engine == "python":
+        with kb_profile.phase("render references"):
+            md_text = render_bibliography(entries)
+        with kb_profile.phase("write markdown"), open(
+            output_file, "w", encoding="utf-8", newline=""
+        ) as fp:
+            fp.write(md_text)
+        return
+    cache = RenderCache(
+        cache_dir,
+        "bib2md",
+        [
+            RENDER_FORMAT_VERSION,
+            pandoc_version(),
+            hash_file(citation_style_language_file),
+        ],
+    )
+    keys = [
+        entry_key(entry, citation_number)
+        for citation_number, entry in enumerate(entries, start=1)
+    ]
+    references = [cache.get(key) for key in keys]
+    header = cache.get("header")
+    missing = [i for i, reference in enumerate(references) if reference is None]
+    if missing or header is None:
+        with kb_profile.phase("render references"):
+            chunk_count = min(jobs, len(missing))
+            if chunk_count > 1:
+                chunk_size = -(-len(missing) // chunk_count)
+                bounds = list(range(0, len(missing), chunk_size)) + [len(missing)]
+                chunks = [
+                    missing[start:end] for start, end in zip(bounds[:-1], bounds[1:])
+                ]
+                # the work is done by the pandoc processes, threads only wait for them
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(chunks)
+                ) as executor:
+                    results = list(
+                        executor.map(
+                            lambda chunk: render_references(
+                                entries, chunk, citation_style_language_file
+                            ),
+                            chunks,
+                        )
+                    )
+            else:
+                chunks = [missing]
+                results = [
+                    render_references(entries, missing, citation_style_language_file)
+                ]
+            if any(rendered is None for rendered in results):
+                # unexpected pandoc output, convert the whole bibliography without the cache
+                md_text = pandoc_render(entries, citation_style_language_file)
+                with open(output_file, "w", encoding="utf-8", newline="") as fp:
+                    fp.write(md_text)
+                return
+            header = results[0][0]
+            cache.set("header", header)
+            for chunk, (_, chunk_references) in zip(chunks, results):
+                for i, reference in zip(chunk, chunk_references):
+                    references[i] = reference
+                    cache.set(keys[i], reference)
+
+    with kb_profile.phase("write markdown"), open(
+        output_file, "w", encoding="utf-8", newline=""
+    ) as fp:
+        fp.write(header)
+        for citation_number, reference in enumerate(references, start=1):
+            fp.write(
+                "\n\n"
+                + _citation_number.sub(
+                    lambda _: f"\\[{citation_number}\\]", reference, count=1
+                )
+            )
+        fp.write("\n")
+    try:
+        cache.save()
+    except OSError as e:
+        print(f"Warning: failed to save render cache ({e}).", file=sys.stderr)
 
 
 def main(argv=None):
@@ -104,10 +345,36 @@ def main(argv=None):
         + "(donwload and view style files from zotero site https://www.zotero.org/styles)",
     )
     parser.add_argument("output_file", type=str, help="markdown output file name")
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"parse and render all entries, do not use or update the parse and render caches ({CACHE_DIR_NAME} directory next to the bib_file)",  # noqa E501
+    )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="number of concurrent pandoc processes used to render the references",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pandoc", "python"],
+        default="pandoc",
+        help="render the references using pandoc (reference engine) or the built-in python renderer",  # noqa E501
+    )
+    kb_profile.add_profile_arguments(parser)
     args = parser.parse_args(argv)
 
     try:
-        bibfile2md(args.bib_file, args.csl_file, args.output_file)
+        with kb_profile.profiling(args, "bib2md"):
+            bibfile2md(
+                args.bib_file,
+                args.csl_file,
+                args.output_file,
+                None if args.no_cache else default_cache_dir(args.bib_file),
+                args.jobs,
+                args.engine,
+            )
     except Exception as e:
         print(
             f"{e}",
@@ -0,0 +1,450 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import collections
+import re
+import pathlib
+import argparse
+import sys
+from kb_cache import ParseCache, default_cache_dir, hash_bytes, hash_json
+import kb_profile
+
+"""
+Fast parser for the publications.bib bibliography file (biblatex format), used instead of
+bibtexparser.load which is slow on large files.
+
+The file is split into per entry records lazily (iter_bib_records), a record is the text of a
+single @type{key, ...} declaration, found by matching its braces, without parsing the fields.
+Each record is then parsed into a dictionary with the same content as the one created by
+bibtexparser (lowercase field names, ENTRYTYPE and ID keys), so the entries can be written
+using the bibtexparser writer. String definitions (@string) and the common month strings are
+supported, @comment and @preamble declarations are ignored. Unlike bibtexparser, which silently
+skips malformed entries, format errors are reported using a BibFormatError which includes the
+line (one based) of the problem.
+
+The parsed entries are cached (.ibex_cache directory next to the bib file, see kb_cache.ParseCache)
+keyed by the hash of the file content, and each entry is keyed by the hash of its record text so
+that only the modified entries are parsed after an edit.
+
+Sorting the entries (sort_bibliography) validates them in the same pass: a missing or non
+numeric year, a missing author and duplicate citation keys are reported per entry key using a
+BibliographyError, duplicate DOIs are reported as warnings.
+
+The script can also be used to check bib files.
+"""
+
+BibRecord = collections.namedtuple("BibRecord", ["entry_type", "key", "line", "text"])
+
+# Increment when the parsed entry format changes, the cache is discarded
+PARSE_FORMAT_VERSION = 1
+
+# Predefined month strings, same as bibtexparser
+COMMON_STRINGS = {
+    "jan": "January",
+    "feb": "February",
+    "mar": "March",
+    "apr": "April",
+    "may": "May",
+    "jun": "June",
+    "jul": "July",
+    "aug": "August",
+    "sep": "September",
+    "oct": "October",
+    "nov": "November",
+    "dec": "December",
+}
+
+_ENTRY_START = re.compile(r"^[ \t]*@", re.MULTILINE)
+_ENTRY_HEADER = re.compile(r"@\s*([A-Za-z]+)\s*([{(])")
+_DELIMITERS = re.compile(r"[{}()]")
+_BRACES = re.compile(r"[{}]")
+_WHITESPACE = re.compile(r"\s*")
+_FIELD_NAME = re.compile(r"[A-Za-z0-9_\-().+]+")
+_STRING_NAME = re.compile(r"[A-Za-z0-9_\-:]+")
+_INTEGER = re.compile(r"\d+(?=\s*(,|$))")
+_QUOTED_TEXT = re.compile(r'[^"{}]*')
+_DOI_PREFIX = re.compile(r"^(https?://(dx\.)?doi\.org/|doi:)", re.IGNORECASE)
+
+
+class BibFormatError(ValueError):
+    def __init__(self, message, line, file_path=None):
+        self.message = message
+        self.line = line
+        self.file_path = file_path
+        super().__init__(str(self))
+
+    def __str__(self):
+        location = f"line {self.line}"
+        if self.file_path is not None:
+            location = f"{self.file_path}, {location}"
+        return f"{location}: {self.message}"
+
+
+class BibliographyError(ValueError):
+    """
+    Problems found in the bibliography entries, one message per problem.
+    """
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("\n".join(problems))
+
+
+def iter_bib_records(text):
+    """
+    Lazily split the bib file content into records, the declarations starting with a '@'
+    at the beginning of a line (after optional whitespace). @comment declarations are
+    skipped, text outside of declarations is a comment. Yields BibRecord tuples, the key
+    is None for @string and @preamble declarations.
+    """
+    line = 1
+    line_start = 0
+    position = 0
+    while True:
+        match = _ENTRY_START.search(text, position)
+        if not match:
+            return
+        start = match.end() - 1
+        line += text.count("\n", line_start, start)
+        line_start = start
+        header = _ENTRY_HEADER.match(text, start)
+        if not header or header.group(1).lower() == "comment":
+            # not a declaration, ignored up to the next line starting with a '@'
+            position = start + 1
+            continue
+        opening = header.group(2)
+        closing = "}" if opening == "{" else ")"
+        depth = 0
+        end = None
+        for delimiter in _DELIMITERS.finditer(text, header.end()):
+            c = delimiter.group(0)
+            if depth == 0 and c == closing:
+                end = delimiter.end()
+                break
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+                if depth < 0:
+                    break
+        if end is None:
+            raise BibFormatError(
+                f"'@{header.group(1)}' declaration is not closed, unbalanced braces",
+                line,
+            )
+        entry_type = header.group(1).lower()
+        key = None
+        if entry_type not in ["string", "preamble"]:
+            key = text[header.end() : end].split(",", 1)[0].strip()  # noqa E203
+        yield BibRecord(entry_type, key, line, text[start:end])
+        position = end
+
+
+def _strip_after_new_lines(value):
+    # same as bibtexparser, whitespace at the start of continuation lines is removed
+    lines = value.splitlines()
+    if len(lines) > 1:
+        lines = [lines[0]] + [line.lstrip() for line in lines[1:]]
+    return "\n".join(lines)
+
+
+def _skip_whitespace(text, position):
+    return _WHITESPACE.match(text, position).end()
+
+
+def _group_end(text, position, line):
+    """
+    Position following the braced group starting at text[position] == "{".
+    """
+    depth = 0
+    for brace in _BRACES.finditer(text, position):
+        depth += 1 if brace.group(0) == "{" else -1
+        if depth == 0:
+            return brace.end()
+    raise BibFormatError("unbalanced braces in field value", line)
+
+
+def _parse_value(text, position, strings, line, strip_lines):
+    """
+    Parse a field value: an integer or a '#' separated concatenation of braced values,
+    quoted values and string names. Returns the value and the position following it.
+    """
+    position = _skip_whitespace(text, position)
+    match = _INTEGER.match(text, position)
+    if match:
+        return match.group(0), match.end()
+    parts = []
+    while True:
+        position = _skip_whitespace(text, position)
+        c = text[position : position + 1]  # noqa E203
+        if c == "{":
+            end = _group_end(text, position, line)
+            value = text[position + 1 : end - 1]  # noqa E203
+        elif c == '"':
+            # quotes in a quoted value are in braces
+            end = position + 1
+            while True:
+                end = _QUOTED_TEXT.match(text, end).end()
+                c = text[end : end + 1]  # noqa E203
+                if c == '"':
+                    break
+                if c != "{":
+                    raise BibFormatError("quoted field value is not closed", line)
+                end = _group_end(text, end, line)
+            value = text[position + 1 : end]  # noqa E203
+            end += 1
+        else:
+            match = _STRING_NAME.match(text, position)
+            if not match:
+                raise BibFormatError("expected a field value", line)
+            name = match.group(0).lower()
+            if name not in strings:
+                raise BibFormatError(f"undefined string '{match.group(0)}'", line)
+            end = match.end()
+            value = None
+            parts.append(strings[name])
+        if value is not None:
+            parts.append(_strip_after_new_lines(value) if strip_lines else value)
+        position = _skip_whitespace(text, end)
+        if text[position : position + 1] != "#":  # noqa E203
+            break
+        position += 1
+    value = "".join(parts)
+    return "" if value == "{}" and len(parts) == 1 else value, position
+
+
+def parse_bib_record(record, strings):
+    """
+    Parse a bib record into an entry dictionary, same as created by bibtexparser. The
+    strings dictionary contains the string definitions (lowercase names) and is updated
+    by @string records. Returns None for @string and @preamble records.
+    """
+    text = record.text
+    header = _ENTRY_HEADER.match(text)
+    body = text[: len(text) - 1]
+    if record.entry_type == "preamble":
+        return None
+    if record.entry_type == "string":
+        position = _skip_whitespace(body, header.end())
+        match = _STRING_NAME.match(body, position)
+        if not match:
+            raise BibFormatError("expected a string name", record.line)
+        position = _skip_whitespace(body, match.end())
+        if body[position : position + 1] != "=":  # noqa E203
+            raise BibFormatError("expected '=' after the string name", record.line)
+        value, position = _parse_value(body, position + 1, strings, record.line, False)
+        if _skip_whitespace(body, position) != len(body):
+            raise BibFormatError("unexpected text after the string value", record.line)
+        strings[match.group(0).lower()] = value
+        return None
+
+    if not record.key or any(c.isspace() for c in record.key):
+        raise BibFormatError(
+            f"invalid citation key '{record.key}' (empty or containing whitespace)",
+            record.line,
+        )
+    position = body.find(",", header.end())
+    if position < 0:
+        raise BibFormatError(f"entry '{record.key}' has no fields", record.line)
+    position += 1
+    fields = []
+    while True:
+        position = _skip_whitespace(body, position)
+        if position == len(body):
+            break
+        match = _FIELD_NAME.match(body, position)
+        if not match:
+            raise BibFormatError(
+                f"entry '{record.key}', expected a field name", record.line
+            )
+        position = _skip_whitespace(body, match.end())
+        if body[position : position + 1] != "=":  # noqa E203
+            raise BibFormatError(
+                f"entry '{record.key}', expected '=' after field '{match.group(0)}'",
+                record.line,
+            )
+        value, position = _parse_value(body, position + 1, strings, record.line, True)
+        fields.append((match.group(0).lower(), value))
+        position = _skip_whitespace(body, position)
+        if position == len(body):
+            break
+        if body[position] != ",":
+            raise BibFormatError(
+                f"entry '{record.key}', expected ',' after field '{match.group(0)}'",
+                record.line,
+            )
+        position += 1
+    # same field order as bibtexparser, for repeated fields the first value is used
+    entry = {name: value for name, value in reversed(fields)}
+    entry["ENTRYTYPE"] = record.entry_type
+    entry["ID"] = record.key
+    return entry
+
+
+def _parse_records(text, cache):
+    """
+    Parse the bib file content, returns the entries and their cache keys.
+    """
+    if text.startswith("\ufeff"):
+        text = text[1:]
+    strings = dict(COMMON_STRINGS)
+    has_string_definitions = False
+    entries = []
+    entry_keys = []
+    for record in iter_bib_records(text):
+        if record.entry_type in ["string", "preamble"]:
+            parse_bib_record(record, strings)
+            has_string_definitions = True
+            continue
+        # the parsed entry depends on the strings defined before the record
+        key = hash_json([record.text, strings if has_string_definitions else None])
+        entry = cache.get(key)
+        if entry is None:
+            entry = parse_bib_record(record, strings)
+            cache.set(key, entry)
+        entries.append(entry)
+        entry_keys.append(key)
+    return entries, entry_keys
+
+
+def parse_bib_text(text, file_path=None):
+    """
+    Parse the content of a bib file. Returns the list of entries in file order, raises
+    a BibFormatError if the content does not match the expected format.
+    """
+    try:
+        return _parse_records(text, ParseCache(None, "bib_parser", None))[0]
+    except BibFormatError as e:
+        e.file_path = file_path
+        raise
+
+
+def load_bibliography(bib_file, cache_dir=None):
+    """
+    Read and parse the bib file (see parse_bib_text). With a cache_dir, the parsed
+    entries are cached, keyed by the hash of the file content and by the hash of
+    their record text.
+    """
+    with open(bib_file, "rb") as fp:
+        data = fp.read()
+    cache = ParseCache(cache_dir, "bib_parser", PARSE_FORMAT_VERSION)
+    file_hash = hash_bytes(data)
+    entry_keys = cache.get(file_hash)
+    entries = [cache.get(key) for key in entry_keys] if entry_keys else None
+    if entries is None or None in entries:
+        try:
+            with kb_profile.phase("parse entries"):
+                entries, entry_keys = _parse_records(data.decode("utf-8"), cache)
+        except BibFormatError as e:
+            e.file_path = bib_file
+            raise
+        cache.set(file_hash, entry_keys)
+    try:
+        cache.save()
+    except OSError as e:
+        print(f"Warning: failed to save parse cache ({e}).", file=sys.stderr)
+    return entries
+
+
+def normalized_doi(doi):
+    return _DOI_PREFIX.sub("", doi.strip()).lower()
+
+
+def sort_bibliography(entries):
+    """
+    Sort the entries in reverse chronological order and secondary order using author
+    alphabetical order. The sort keys are computed and validated in a single pass, a
+    BibliographyError lists all the entries with a missing or non numeric year or a
+    missing author, and the duplicate citation keys. Entries with the same DOI (e.g.
+    a preprint and the published paper) are allowed, they are reported as warnings.
+    """
+    problems = []
+    sort_keys = []
+    citation_keys = set()
+    dois = {}
+    for entry in entries:
+        citation_key = entry["ID"]
+        if citation_key in citation_keys:
+            problems.append(f"duplicate citation key '{citation_key}'")
+        citation_keys.add(citation_key)
+        year = entry.get("year", "").strip()
+        author = entry.get("author", "")
+        if not year:
+            problems.append(f"entry '{citation_key}': missing year")
+        elif not year.isdigit():
+            problems.append(f"entry '{citation_key}': year '{year}' is not a number")
+        if not author.strip():
+            problems.append(f"entry '{citation_key}': missing author")
+        doi = normalized_doi(entry.get("doi", ""))
+        if doi:
+            if doi in dois:
+                print(
+                    f"Warning: entry '{citation_key}' has the same DOI as entry '{dois[doi]}' ({doi}).",  # noqa E501
+                    file=sys.stderr,
+                )
+            else:
+                dois[doi] = citation_key
+        sort_keys.append((-int(year) if year.isdigit() else 0, author))
+    if problems:
+        raise BibliographyError(problems)
+    order = sorted(range(len(entries)), key=sort_keys.__getitem__)
+    return [entries[i] for i in order]
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Check the format and content of bib files."
+    )
+    parser.add_argument(
+        "bib_files",
+        type=pathlib.Path,
+        nargs="+",
+        help="bibliography files in bibtex/biblatex format",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="parse all entries, do not use or update the parse cache",
+    )
+    kb_profile.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    res = 0
+    with kb_profile.profiling(args, "bib_parser"):
+        for bib_file in args.bib_files:
+            try:
+                with kb_profile.phase("load bibliography"):
+                    entries = load_bibliography(
+                        bib_file, None if args.no_cache else default_cache_dir(bib_file)
+                    )
+                with kb_profile.phase("sort bibliography"):
+                    sort_bibliography(entries)
+            except (OSError, UnicodeDecodeError, BibFormatError) as e:
+                print(f"{e}", file=sys.stderr)
+                res = 1
+            except BibliographyError as e:
+                for problem in e.problems:
+                    print(f"{bib_file}: {problem}", file=sys.stderr)
+                res = 1
+    return res
+
+
+if __name__ == "__main__":
+    sys.exit(main())
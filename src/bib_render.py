@@ -0,0 +1,628 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import re
+import unicodedata
+
+"""
+Pure Python renderer for the publications page, used by bib2md instead of pandoc (--engine=python).
+It reproduces the markdown created by pandoc (markdown_strict output, pandoc-citeproc) with the
+ibex.csl style, for the entry types we use:
+1. article - rendered as a CSL article-journal.
+2. inproceedings - rendered as a CSL paper-conference.
+3. misc, dataset - rendered using the generic CSL format.
+4. online - rendered as a CSL webpage.
+
+As in the ibex.csl style, all authors are listed, the note (corresponding authors) and keywords are
+displayed on a separate line after the reference. Titles are converted to sentence case, text in
+braces is protected, and the LaTeX commands commonly found in bib files are supported: accents,
+dashes and quotes, \\href, \\url, \\emph, \\textit and \\textbf. Lines are wrapped at 72 columns.
+
+Fields which are not used by the entry types listed above (e.g. edition, pubstate) are ignored,
+pandoc remains the reference engine for the formatting.
+"""
+
+# Rendered text preceding the references
+HEADER = (
+    "Publications\n============\n\n"
+    "Publications are listed in reverse chronological order."
+)
+LINE_WIDTH = 72
+
+_ACCENTS = {
+    "'": "́",
+    "`": "̀",
+    "^": "̂",
+    '"': "̈",
+    "~": "̃",
+    "=": "̄",
+    ".": "̇",
+    "u": "̆",
+    "v": "̌",
+    "H": "̋",
+    "c": "̧",
+    "k": "̨",
+    "r": "̊",
+}
+_SYMBOLS = {
+    "ss": "ß",
+    "o": "ø",
+    "O": "Ø",
+    "l": "ł",
+    "L": "Ł",
+    "ae": "æ",
+    "AE": "Æ",
+    "oe": "œ",
+    "OE": "Œ",
+    "aa": "å",
+    "AA": "Å",
+    "i": "ı",
+    "textendash": "–",
+    "textemdash": "—",
+    "textbackslash": "\\",
+}
+_EMPHASIS_COMMANDS = {"emph": "*", "textit": "*", "textbf": "**"}
+_MONTHS = [
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "may",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "oct",
+    "nov",
+    "dec",
+]
+# short month names of the en-US CSL locale
+_SHORT_MONTHS = [
+    "Jan.",
+    "Feb.",
+    "Mar.",
+    "Apr.",
+    "May",
+    "June",
+    "July",
+    "Aug.",
+    "Sep.",
+    "Oct.",
+    "Nov.",
+    "Dec.",
+]
+_MARKDOWN_ESCAPES = {
+    "\\": "\\\\",
+    "`": "\\`",
+    "*": "\\*",
+    "_": "\\_",
+    "[": "\\[",
+    "]": "\\]",
+    "#": "\\#",
+    "<": "&lt;",
+    ">": "&gt;",
+}
+
+
+# Inline nodes of a parsed field value are lists, so that the text can be modified in place:
+# ["text", text, protected], ["emph", nodes, marker], ["link", nodes, url]
+
+
+def _read_group(value, i):
+    """
+    Read the braced group starting at value[i] == "{". Returns the group content and the
+    index following the group.
+    """
+    depth = 0
+    for j in range(i, len(value)):
+        if value[j] == "{":
+            depth += 1
+        elif value[j] == "}":
+            depth -= 1
+            if depth == 0:
+                return value[i + 1 : j], j + 1  # noqa E203
+    return value[i + 1 :], len(value)  # noqa E203
+
+
+def _read_argument(value, i):
+    """
+    Read a command argument, a braced group, a command or a single character, skipping
+    whitespace.
+    """
+    while i < len(value) and value[i].isspace():
+        i += 1
+    if i < len(value) and value[i] == "{":
+        return _read_group(value, i)
+    match = re.match(r"\\[A-Za-z]+|.?", value[i:])
+    return match.group(0), i + len(match.group(0))
+
+
+def parse_latex(value, protected=False):
+    """
+    Parse a bib field value into a list of inline nodes.
+    """
+    nodes = []
+
+    def add_text(text, text_protected=protected):
+        if nodes and nodes[-1][0] == "text" and nodes[-1][2] == text_protected:
+            nodes[-1][1] += text
+        else:
+            nodes.append(["text", text, text_protected])
+
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == "{":
+            content, i = _read_group(value, i)
+            # braces around a command (e.g. an accent) do not protect the text case
+            for node in parse_latex(content, protected or not content.startswith("\\")):
+                if node[0] == "text":
+                    add_text(node[1], node[2])
+                else:
+                    nodes.append(node)
+        elif c == "}":
+            i += 1
+        elif c == "\\":
+            match = re.match(r"[A-Za-z]+|.", value[i + 1 :])  # noqa E203
+            command = match.group(0) if match else ""
+            i += 1 + len(command)
+            if command in _ACCENTS and (
+                len(command) > 1 or not command.isalpha() or i < len(value)
+            ):
+                argument, i = _read_argument(value, i)
+                # dotless i used in accents, e.g. \'{\i}
+                argument = plain_text(parse_latex(argument)).replace("ı", "i", 1)
+                add_text(
+                    unicodedata.normalize("NFC", argument[:1] + _ACCENTS[command])
+                    + argument[1:]
+                )
+            elif command in _SYMBOLS:
+                add_text(_SYMBOLS[command])
+                if command.isalpha() and value[i : i + 2] == "{}":  # noqa E203
+                    i += 2
+                elif command.isalpha() and value[i : i + 1] == " ":  # noqa E203
+                    i += 1
+            elif command == "href":
+                url, i = _read_argument(value, i)
+                text, i = _read_argument(value, i)
+                nodes.append(["link", parse_latex(text, protected), url])
+            elif command == "url":
+                url, i = _read_argument(value, i)
+                nodes.append(["link", [["text", url, True]], url])
+            elif command in _EMPHASIS_COMMANDS:
+                text, i = _read_argument(value, i)
+                nodes.append(
+                    ["emph", parse_latex(text, protected), _EMPHASIS_COMMANDS[command]]
+                )
+            elif not command.isalpha():
+                # escaped character, e.g. \& or \%
+                add_text(command)
+            # other commands (e.g. \textsc) are dropped, their arguments are kept
+        elif c == "~":
+            add_text(" ")
+            i += 1
+        elif c == "-":
+            if value.startswith("---", i):
+                add_text("—")
+                i += 3
+            elif value.startswith("--", i):
+                add_text("–")
+                i += 2
+            else:
+                add_text("-")
+                i += 1
+        elif c == "`":
+            double = value.startswith("``", i)
+            add_text("“" if double else "‘")
+            i += 2 if double else 1
+        elif c == "'":
+            double = value.startswith("''", i)
+            add_text("”" if double else "’")
+            i += 2 if double else 1
+        elif c == "$":
+            i += 1
+        elif c.isspace():
+            add_text(" ")
+            while i < len(value) and value[i].isspace():
+                i += 1
+        else:
+            add_text(c)
+            i += 1
+    return nodes
+
+
+def _text_nodes(nodes):
+    for node in nodes:
+        if node[0] == "text":
+            yield node
+        else:
+            yield from _text_nodes(node[1])
+
+
+def plain_text(nodes):
+    return "".join(node[1] for node in _text_nodes(nodes))
+
+
+def sentence_case(nodes):
+    """
+    Convert the text of the nodes to sentence case in place, as done by pandoc for
+    English titles. Capitalized words are converted to lowercase, except the first
+    word of a sentence. The first letter of a sentence is capitalized. Words with
+    other uppercase letters (e.g. DNA, McDonald) and protected text are not changed.
+    """
+    text_nodes = list(_text_nodes(nodes))
+    text = "".join(node[1] for node in text_nodes)
+    protected = [node[2] for node in text_nodes for _ in node[1]]
+    chars = list(text)
+    words = list(re.finditer(r"[^\W_]+", text))
+    for k, word in enumerate(words):
+        if any(protected[word.start() : word.end()]):  # noqa E203
+            continue
+        separator = text[words[k - 1].end() : word.start()] if k else ""  # noqa E203
+        sentence_start = k == 0 or (
+            " " in separator and separator.rstrip()[-1:] in [".", "?", "!", ":"]
+        )
+        w = word.group(0)
+        capitalized = w[0].isupper() and (
+            len(w) == 1 or (w[1:].isalpha() and w[1:].islower())
+        )
+        if capitalized and (not sentence_start or k == len(words) - 1 > 0):
+            chars[word.start()] = w[0].lower()
+        elif sentence_start and w[0].islower():
+            chars[word.start()] = w[0].upper()
+    text = "".join(chars)
+    start = 0
+    for node in text_nodes:
+        end = start + len(node[1])
+        node[1] = text[start:end]
+        start = end
+    return nodes
+
+
+def escape_markdown(text):
+    return "".join(_MARKDOWN_ESCAPES.get(c, c) for c in text)
+
+
+def to_markdown(nodes):
+    md = ""
+    for node in nodes:
+        if node[0] == "text":
+            md += escape_markdown(node[1])
+        elif node[0] == "emph":
+            md += node[2] + to_markdown(node[1]) + node[2]
+        elif plain_text(node[1]) == node[2]:
+            md += f"<{node[2]}>"
+        else:
+            md += f"[{to_markdown(node[1])}]({node[2]})"
+    return md
+
+
+def field_markdown(entry, *field_names, title=False):
+    """
+    Markdown of the first non empty field from the given field names, converted to
+    sentence case for titles.
+    """
+    for field_name in field_names:
+        value = entry.get(field_name, "").strip()
+        if value:
+            nodes = parse_latex(value)
+            return to_markdown(sentence_case(nodes) if title else nodes)
+    return ""
+
+
+def _split_top_level(value, separator):
+    """
+    Split the value on the separator regular expression, ignoring separators in braces.
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for match in re.finditer(r"[{}]|" + separator, value):
+        if match.group(0) == "{":
+            depth += 1
+        elif match.group(0) == "}":
+            depth -= 1
+        elif depth == 0:
+            parts.append(value[start : match.start()])  # noqa E203
+            start = match.end()
+    parts.append(value[start:])
+    return [part.strip() for part in parts]
+
+
+def _initials(given_words):
+    initials = []
+    for word in given_words:
+        parts = [part for part in word.split("-") if part]
+        initials.append("-".join(part[0] + "." for part in parts))
+    return " ".join(initials)
+
+
+def format_name(name):
+    """
+    Format a bib name ("von Last, Jr, First" or "First von Last") with initialized given
+    names, e.g. "N. van Doremalen". A name in braces is used as is.
+    """
+    if (
+        name.startswith("{")
+        and name.endswith("}")
+        and len(_split_top_level(name, r"\s+")) == 1
+    ):
+        return to_markdown(parse_latex(name[1:-1]))
+    parts = _split_top_level(name, ",")
+    if len(parts) == 1:
+        words = _split_top_level(parts[0], r"\s+")
+        lowercase = [k for k, w in enumerate(words[:-1]) if w[:1].islower()]
+        if lowercase:
+            given, last = words[: lowercase[0]], words[lowercase[0] :]  # noqa E203
+        else:
+            given, last = words[:-1], words[-1:]
+        suffix = ""
+    else:
+        last = _split_top_level(parts[0], r"\s+")
+        suffix = parts[1] if len(parts) == 3 else ""
+        given = _split_top_level(parts[-1], r"\s+") if parts[-1] else []
+    family = plain_text(parse_latex(" ".join(last)))
+    initials = _initials(plain_text(parse_latex(" ".join(given))).split())
+    formatted = " ".join(part for part in [initials, family] if part)
+    if suffix:
+        formatted += " " + plain_text(parse_latex(suffix))
+    return escape_markdown(formatted)
+
+
+def format_names(value):
+    names = [
+        format_name(name)
+        for name in _split_top_level(" ".join(value.split()), r"\s+and\s+")
+        if name
+    ]
+    if len(names) < 3:
+        return " and ".join(names)
+    return ", ".join(names[:-1]) + ", and " + names[-1]
+
+
+def _date(entry, field_name):
+    """
+    Year, month and day of a date field (e.g. date, urldate) in the YYYY-MM-DD
+    format, month and day are None if they are missing.
+    """
+    match = re.match(
+        r"(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?", entry.get(field_name, "").strip()
+    )
+    if not match:
+        return None
+    year, month, day = match.groups()
+    return year, int(month) if month else None, int(day) if day else None
+
+
+def issued_date(entry):
+    date = _date(entry, "date")
+    if date:
+        return date
+    year = entry.get("year", "").strip()
+    if not year:
+        return None
+    month = entry.get("month", "").strip().lower()
+    if month.isdigit():
+        month = int(month)
+    elif month[:3] in _MONTHS:
+        month = _MONTHS.index(month[:3]) + 1
+    else:
+        month = None
+    return year, month if month and 1 <= month <= 12 else None, None
+
+
+def format_date(date, text_form=False):
+    """
+    Date formatted as "Mon. YYYY" or, text_form, as "Mon. DD, YYYY" (parts which
+    are missing are omitted).
+    """
+    if not date:
+        return ""
+    year, month, day = date
+    parts = []
+    if month:
+        parts.append(_SHORT_MONTHS[month - 1])
+        if day and text_form:
+            parts.append(f"{day:02d},")
+    parts.append(year)
+    return " ".join(parts)
+
+
+def format_pages(entry):
+    pages = field_markdown(entry, "pages").replace("-", "–")
+    if not pages:
+        return ""
+    label = "pp." if re.search(r"[–,&]", pages) else "p."
+    return f"{label} {pages}"
+
+
+def format_locators(entry):
+    locators = []
+    volume = entry.get("volume", "").strip()
+    if volume:
+        locators.append(f"vol. {escape_markdown(volume)}")
+    issue = join_parts([entry.get(f, "").strip() for f in ["number", "issue"]])
+    if issue:
+        locators.append(f"no. {escape_markdown(issue)}")
+    return ", ".join(locators)
+
+
+def format_access(entry, entry_type):
+    doi = entry.get("doi", "").strip()
+    doi = re.sub(r"^https?://(dx\.)?doi\.org/", "", doi)
+    url = entry.get("url", "").strip()
+    url_link = f"<{url}>" if url else ""
+    accessed = format_date(_date(entry, "urldate"), text_form=True)
+    if entry_type == "webpage":
+        if not url:
+            return ""
+        return f" {url_link} (accessed {accessed})." if accessed else f" {url_link}"
+    if doi:
+        return f" doi: [{escape_markdown(doi)}](https://doi.org/{doi})."
+    if url:
+        accessed_group = f" Accessed: {accessed}. \\[Online\\]." if accessed else ""
+        return f"{accessed_group} Available: {url_link}"
+    return ""
+
+
+def join_parts(parts, delimiter=", ", suffix=""):
+    parts = [part for part in parts if part]
+    return delimiter.join(parts) + suffix if parts else ""
+
+
+def format_reference(entry, citation_number):
+    """
+    Markdown of a single bibliography entry, before line wrapping. The line break before
+    the note and keywords is represented by a newline.
+    """
+    entry_type = {
+        "article": "article-journal",
+        "inproceedings": "paper-conference",
+        "online": "webpage",
+    }.get(entry["ENTRYTYPE"].lower(), "generic")
+    title = field_markdown(entry, "title", title=True)
+    title = f"“{title}”" if title else ""
+    issued = issued_date(entry)
+    access = format_access(entry, entry_type)
+
+    if entry_type == "article-journal":
+        journal = field_markdown(entry, "shortjournal", "journaltitle", "journal")
+        body = join_parts(
+            [
+                title,
+                f"*{journal}*" if journal else "",
+                format_locators(entry),
+                format_pages(entry),
+                format_date(issued),
+            ]
+        )
+        body = f"{body}{',' if access else '.'}{access}"
+    elif entry_type == "paper-conference":
+        container = field_markdown(entry, "booktitle", title=True)
+        place = field_markdown(entry, "venue")
+        if any(
+            entry.get(f, "").strip() for f in ["editor", "issue", "pages", "volume"]
+        ):
+            event = join_parts([f"in *{container}*" if container else "", place])
+        else:
+            event_title = field_markdown(entry, "eventtitle", title=True)
+            event = join_parts(
+                [f"presented at the {event_title}" if event_title else "", place]
+            )
+        body = join_parts(
+            [
+                title,
+                event,
+                format_date(issued),
+                format_locators(entry),
+                format_pages(entry),
+            ],
+            suffix=".",
+        )
+        body += access
+    elif entry_type == "webpage":
+        container = field_markdown(entry, "journaltitle", "journal")
+        body = join_parts(
+            [title, f"*{container}*" if container else "", format_date(issued, True)],
+            suffix=".",
+        )
+        body += access
+    else:
+        container = field_markdown(entry, "journaltitle", "journal", "booktitle")
+        publisher = join_parts(
+            [
+                field_markdown(entry, "publisher", "organization", "howpublished"),
+                field_markdown(entry, "location", "address"),
+            ]
+        )
+        body = join_parts(
+            [
+                join_parts(
+                    [
+                        title,
+                        f"*{container}*" if container else "",
+                        format_locators(entry),
+                    ],
+                    suffix=".",
+                ),
+                join_parts(
+                    [publisher, format_pages(entry), format_date(issued, True)],
+                    suffix=".",
+                ),
+            ],
+            delimiter=" ",
+        )
+        body += access
+    # punctuation following a quoted title is placed inside the quotes
+    body = body.replace("”,", ",”").replace("”.", ".”")
+
+    notes = []
+    if entry_type != "webpage":
+        notes = [field_markdown(entry, "note")]
+        keywords = field_markdown(entry, "keywords")
+        if keywords:
+            notes.append(f"Keywords: *{keywords}*")
+    notes = join_parts(notes)
+    authors = format_names(entry.get("author", "") or entry.get("editor", ""))
+    reference = (
+        f"\\[{citation_number}\\] " + (f"{authors}, " if authors else "") + body.strip()
+    )
+    if notes:
+        reference += f"\n\\[{notes}\\]"
+    return reference
+
+
+def wrap(text, width=LINE_WIDTH):
+    """
+    Wrap the text at the given width, breaking lines at spaces. Newlines in the text
+    are markdown hard line breaks, the two trailing spaces of a hard line break are
+    part of the line width.
+    """
+    lines = []
+    hard_lines = text.split("\n")
+    for k, hard_line in enumerate(hard_lines):
+        # non-breaking spaces do not split words
+        words = [word for word in hard_line.split(" ") if word]
+        if k < len(hard_lines) - 1:
+            words[-1] += "  "
+        line = ""
+        for word in words:
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def render_references(entries):
+    """
+    Markdown of the bibliography entries, in the given order, each reference is a
+    paragraph which starts with its citation number.
+    """
+    return [
+        wrap(format_reference(entry, i)) for i, entry in enumerate(entries, start=1)
+    ]
+
+
+def render_bibliography(entries):
+    """
+    Markdown of the publications page for the bibliography entries, in the given order.
+    """
+    return "\n\n".join([HEADER] + render_references(entries)) + "\n"
@@ -21,7 +21,13 @@ import numpy as np
 import pathlib
 import argparse
 import sys
-from argparse_types import file_path, dir_path
+import itertools
+from argparse_types import file_path, dir_path, positive_int
+from kb_schema import read_roadmap
+from kb_cache import WriteManifest, CACHE_DIR_NAME, default_cache_dir
+from md_table import dataframe_to_markdown
+from kb_parallel import process_map
+import kb_profile
 
 """
 This utility script facilitates batch creation of supporting material files from a comma-separated-value
@@ -33,6 +39,9 @@ template based file generation is best done using a dedicated tool such as jinja
 As our use case is very simple, string formatting is sufficient and we avoid dependency on an additional tool. 
 
 The supporting material files are created with the expected names in the specific directory: target_conjugate/orcid.md.
+The rows are grouped by target, conjugate and ORCID, each group is a file. When importing many rows, the files can be
+rendered by multiple processes (--jobs). Files are only written if their content changed, so re-importing the same
+rows does not modify existing files. Use --dry_run to see which files would be created or updated.
 
 As we are creating multiple supporting files, they share the same reasoning section. This shared text is provided as one
 of the inputs, the "shared_reasoning_file". The file contents are either plain text or they can be markdown.
@@ -50,50 +59,27 @@ bleaching method for high-content imaging of diverse tissues",
 """
 
 
-def create_md_files(
-    target_conjugate, all_df, template_str, reasoning_str, supporting_material_root_dir
-):
-    # target_conjugate.fillna(
-    #     "", inplace=True
-    # )  # if a dye the conjugate is NaN and we replace with empty string
-    tc_rows = all_df[
-        (all_df[target_conjugate.index[0]] == target_conjugate[0])
-        & (all_df[target_conjugate.index[1]] == target_conjugate[1])
-    ]
-    orcids = [
-        orcid
-        for orcid in pd.concat(
-            [tc_rows["Agree"], tc_rows["Disagree"]]
-        ).drop_duplicates()
-        if orcid != ""
-    ]
-    data_path = supporting_material_root_dir / pathlib.Path(
-        target_conjugate[0] + "_" + target_conjugate[1]
-    )
-    data_path.mkdir(parents=True, exist_ok=True)
-    result_file_paths = []
-
-    for orcid in orcids:
-        configurations_table = tc_rows[
-            (tc_rows["Agree"] == orcid) | (tc_rows["Disagree"] == orcid)
-        ]
-        # replace orcid with +
-        configurations_table[configurations_table == orcid] = (
+def render_md_file(configurations_table, orcid, template_str, reasoning_str):
+    """
+    Render the content of a single supporting material file, the configurations_table
+    contains the rows of a target_conjugate pair that have the given orcid in their Agree
+    or Disagree column.
+    """
+    # replace orcid with +
+    configurations_table = configurations_table.copy()
+    for col_name in ["Agree", "Disagree"]:
+        configurations_table.loc[configurations_table[col_name] == orcid, col_name] = (
             "[+](#reason1)" if reasoning_str else "+"
         )
-        data_dict = {}
-        data_dict["configurations_table"] = configurations_table.fillna("").to_markdown(
-            index=False
-        )
-        data_dict["reasoning"] = (
-            '<a name="reason1"></a>\n' + reasoning_str if reasoning_str else ""
-        )
-        data_dict["orcid"] = orcid
-        file_path = data_path / pathlib.Path(orcid + ".md")
-        with open(file_path, "w") as fp:
-            fp.write(template_str.format(**data_dict))
-        result_file_paths.append(file_path)
-    return result_file_paths
+    data_dict = {}
+    data_dict["configurations_table"] = dataframe_to_markdown(
+        configurations_table.fillna("")
+    )
+    data_dict["reasoning"] = (
+        '<a name="reason1"></a>\n' + reasoning_str if reasoning_str else ""
+    )
+    data_dict["orcid"] = orcid
+    return template_str.format(**data_dict)
 
 
 def single_orcid(x):
@@ -109,24 +95,38 @@ def csv_2_supporting(
     supporting_material_root_dir,
     supporting_template_file,
     shared_reasoning_file=None,
+    jobs=1,
+    cache_dir=None,
+    dry_run=False,
 ):
+    """
+    Create the supporting material files. Files are only written if their content
+    changed, the manifest of generated files is kept in the cache_dir (see
+    kb_cache.WriteManifest). The number of created, updated and unchanged files is
+    printed, in a dry run the files that would be written are also listed and nothing
+    is written. Returns a series with the file paths, indexed by the first row of the
+    file's target_conjugate pair.
+    """
     orcid_column_names = ["Agree", "Disagree"]
     # Read the dataframe and keep entries that are "NA", don't convert to nan
-    df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
+    with kb_profile.phase("read csv"):
+        df = read_roadmap(csv_file)
 
     # Check that there is only one ORCID per row.
-    single_orcid_rows = df[orcid_column_names].apply(single_orcid, axis=1)
+    with kb_profile.phase("single ORCID check"):
+        single_orcid_rows = df[orcid_column_names].apply(single_orcid, axis=1)
     if not single_orcid_rows.all():
         raise ValueError(
             f"Invalid file {csv_file}, following rows contain more than one ORCID:\n{list(single_orcid_rows[single_orcid_rows==False].index)}"  # noqa E501
         )
 
     # Check that dataframe does not contain preceding or trailing whitespace in entries
-    df_stripped_whitespace = df.applymap(lambda x: x.strip(), na_action="ignore")
-    diff_entries = np.where(
-        (df != df_stripped_whitespace)
-        & ~(df.isnull() & df_stripped_whitespace.isnull())
-    )
+    with kb_profile.phase("whitespace check"):
+        df_stripped_whitespace = df.applymap(lambda x: x.strip(), na_action="ignore")
+        diff_entries = np.where(
+            (df != df_stripped_whitespace)
+            & ~(df.isnull() & df_stripped_whitespace.isnull())
+        )
     if diff_entries[0].size > 0:
         raise ValueError(
             "Dataframe entries contain preceding or trailing whitespace, please remove [row, col, value]:\n"
@@ -146,15 +146,70 @@ def csv_2_supporting(
     with open(supporting_template_file) as fp:
         template_str = fp.read()
 
-    unique_target_conjugate = df[
-        ["Target Name / Protein Biomarker", "Conjugate"]
-    ].drop_duplicates()
-    return unique_target_conjugate.apply(
-        lambda x: create_md_files(
-            x, df, template_str, shared_reasoning_str, supporting_material_root_dir
-        ),
-        axis=1,
-    ).explode()  # explode takes series of lists and returns series of entries
+    with kb_profile.phase("group files"):
+        target_conjugate_column_names = ["Target Name / Protein Biomarker", "Conjugate"]
+        # Each row contains a single ORCID, in the Agree or the Disagree column
+        in_disagree = df["Agree"].str.strip() == ""
+        orcids = df["Agree"].where(~in_disagree, df["Disagree"]).rename("orcid")
+        # The files of each target_conjugate pair are listed in the order in which the pair
+        # first appears. Within a pair, the ORCIDs from the Agree column come first, followed
+        # by those that only appear in the Disagree column, each in order of appearance.
+        target_conjugate_numbers = (
+            df.groupby(target_conjugate_column_names, sort=False).ngroup().to_numpy()
+        )
+        orcid_ranks = in_disagree.to_numpy() * len(df) + np.arange(len(df))
+        groups = sorted(
+            df.groupby(
+                target_conjugate_column_names + [orcids], sort=False
+            ).indices.items(),
+            key=lambda item: (
+                target_conjugate_numbers[item[1][0]],
+                orcid_ranks[item[1]].min(),
+            ),
+        )
+
+        tasks = []
+        result_index = []
+        first_rows = {}
+        for (target, conjugate, orcid), row_positions in groups:
+            data_path = supporting_material_root_dir / pathlib.Path(
+                target + "_" + conjugate
+            )
+            if (target, conjugate) not in first_rows:
+                first_rows[(target, conjugate)] = df.index[row_positions[0]]
+            tasks.append(
+                (data_path / pathlib.Path(orcid + ".md"), df.iloc[row_positions], orcid)
+            )
+            result_index.append(first_rows[(target, conjugate)])
+
+    with kb_profile.phase("render and write files"):
+        task_args = (
+            [task[1] for task in tasks],
+            [task[2] for task in tasks],
+            itertools.repeat(template_str),
+            itertools.repeat(shared_reasoning_str),
+        )
+        contents = process_map(render_md_file, len(tasks), jobs, *task_args)
+
+        result_file_paths = [task[0] for task in tasks]
+        manifest = WriteManifest(cache_dir, "csv_2_supporting")
+        status_counts = {"created": 0, "updated": 0, "unchanged": 0}
+        for md_file_path, content in zip(result_file_paths, contents):
+            status = manifest.write(md_file_path, content, dry_run)
+            status_counts[status] += 1
+            if dry_run and status != "unchanged":
+                print(f"{'create' if status == 'created' else 'update'} {md_file_path}")
+    if not dry_run:
+        try:
+            with kb_profile.phase("save manifest"):
+                manifest.save()
+        except OSError as e:
+            print(f"Warning: failed to save manifest ({e}).", file=sys.stderr)
+    print(
+        f"Supporting material files: {status_counts['created']} created, {status_counts['updated']} updated, {status_counts['unchanged']} unchanged"  # noqa E501
+        + (" (dry run, no files were written)." if dry_run else ".")
+    )
+    return pd.Series(result_file_paths, index=result_index, dtype=object)
 
 
 def main(argv=None):
@@ -167,15 +222,38 @@ def main(argv=None):
     parser.add_argument("supporting_template_file", type=file_path)
     parser.add_argument("supporting_material_root_dir", type=dir_path)
     parser.add_argument("--shared_reasoning_file", type=file_path, nargs="?")
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="number of processes used to render the supporting material files",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="list the files that would be created or updated, without writing them",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"do not use or update the manifest of generated files ({CACHE_DIR_NAME} directory next to the supporting_material_root_dir)",  # noqa E501
+    )
+    kb_profile.add_profile_arguments(parser)
     args = parser.parse_args(argv)
 
     try:
-        csv_2_supporting(
-            args.csv_file,
-            args.supporting_material_root_dir,
-            args.supporting_template_file,
-            args.shared_reasoning_file,
-        )
+        with kb_profile.profiling(args, "csv_2_supporting"):
+            csv_2_supporting(
+                args.csv_file,
+                args.supporting_material_root_dir,
+                args.supporting_template_file,
+                args.shared_reasoning_file,
+                args.jobs,
+                None
+                if args.no_cache
+                else default_cache_dir(args.supporting_material_root_dir),
+                args.dry_run,
+            )
     except Exception as e:
         print(
             f"{e}",
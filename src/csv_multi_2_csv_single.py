@@ -17,10 +17,16 @@
 # =========================================================================
 
 import pandas as pd
+import numpy as np
 import argparse
 import sys
+import csv
+import os
+import pathlib
 from argparse_types import file_path
+from kb_schema import load_schema, read_roadmap
 import traceback
+import kb_profile
 
 """
 This utility script converts a csv file containing multiple entries per row to
@@ -30,6 +36,10 @@ for the expert to write, it is harder for the newcomer and other experts to foll
 interpret. With a single entry per row the data can be easily read by all in an
 unambiguous manner.
 
+The conversion is either done on the whole file using pandas, or in a streaming mode (--stream) where
+each row is read, converted and written before the next row is read. The streaming mode is intended
+for very large files, its memory use does not depend on the file size.
+
 Example:
 
 Original, multiple entries per row:
@@ -45,85 +55,180 @@ Resulting, single entry per row:
 """
 
 
+# The number of entries in a row is the number of entries in this column
+ENTRY_COUNT_COLUMN_NAME = "Method"
+
+
 def entry2list(entry):
-    if pd.isna(entry) or entry.strip() == "":
-        return [" "]
+    if entry.strip() == "":
+        return [""]
     else:
         res_list = [v.strip() for v in entry.split(";") if v.strip() != ""]
         return res_list
 
 
-def single_2_multi(row):
-    # Indexes of columns that can contain multiple entries. The separator
-    # character between entries is semicolon (see entry2list).
-    indexes_2_list = [
-        "Application",
-        "Method",
-        "Tissue Preservation",
-        "Tissue",
-        "Antigen Retrieval Conditions",
-        "Dye Inactivation Conditions",
+def split_entries(column):
+    """
+    Split a column of semicolon separated entries (see entry2list). Each unique value is
+    only split once. Returns the entries of all the unique values as a flat array, and
+    the offset into the array and number of entries for each row.
+    """
+    codes, uniques = pd.factorize(column.astype(object).fillna(""))
+    unique_entries = [entry2list(value) for value in uniques]
+    unique_entry_nums = np.array([len(e) for e in unique_entries], dtype=np.int64)
+    unique_entry_offsets = np.cumsum(unique_entry_nums) - unique_entry_nums
+    entries = np.array(
+        [entry for value_entries in unique_entries for entry in value_entries],
+        dtype=object,
+    )
+    return entries, unique_entry_offsets[codes], unique_entry_nums[codes]
+
+
+def strip_entries(column):
+    """
+    Remove preceding and trailing whitespace from all entries in the column, each unique
+    value is only stripped once.
+    """
+    codes, uniques = pd.factorize(column.astype(object).fillna(""))
+    return np.array([value.strip() for value in uniques], dtype=object)[codes]
+
+
+def csv_multi_2_csv_single(csv_file, schema=None):
+    """
+    Convert the multiple entries per row csv file to a dataframe with a single entry per
+    row. The columns that may contain multiple entries are listed in the JSON configuration
+    (see kb_schema). The number of entries in a row is given by the ENTRY_COUNT_COLUMN_NAME
+    column, the entries of the other multiple entry columns are repeated if they contain
+    fewer entries, accommodating situations where only a single value is entered even if
+    there should be multiple values. The resulting dataframe is indexed by the input row.
+    """
+    if schema is None:
+        schema = load_schema()
+    # Read the dataframe and keep entries that are "NA", don't convert to nan
+    with kb_profile.phase("read csv"):
+        df = read_roadmap(csv_file, schema)
+    multi_entry_column_names = [
+        col_name for col_name in schema.multi_entry_column_names if col_name in df
     ]
-    for i in indexes_2_list:
-        row[i] = entry2list(row[i])
-
-    # For the "Application", "Tissue Preservation", "Tissue", "Antigen Retrieval Conditions" and
-    # "Dye Inactivation Conditions" accommodate situations where only a single value is entered
-    # even if there should be multiple values.
-    entry_num = len(row["Method"])
-    if len(row["Application"]) != entry_num:
-        row["Application"] = row["Application"] * entry_num
-    if len(row["Tissue Preservation"]) != entry_num:
-        row["Tissue Preservation"] = row["Tissue Preservation"] * entry_num
-    if len(row["Tissue"]) != entry_num:
-        row["Tissue"] = row["Tissue"] * entry_num
-    if len(row["Antigen Retrieval Conditions"]) != entry_num:
-        row["Antigen Retrieval Conditions"] = (
-            row["Antigen Retrieval Conditions"] * entry_num
-        )
-    if len(row["Dye Inactivation Conditions"]) != entry_num:
-        row["Dye Inactivation Conditions"] = (
-            row["Dye Inactivation Conditions"] * entry_num
+    with kb_profile.phase("split entries"):
+        split_columns = {
+            col_name: split_entries(df[col_name])
+            for col_name in multi_entry_column_names
+        }
+
+    with kb_profile.phase("expand rows"):
+        # Separate each row containing multiple entries to multiple rows containing a single
+        # entry, the i'th row created from a source row uses the i'th entry of each multiple
+        # entry column, modulo the number of entries in the column.
+        entry_nums = split_columns[ENTRY_COUNT_COLUMN_NAME][2]
+        row_positions = np.repeat(np.arange(len(df)), entry_nums)
+        entry_indexes = np.arange(len(row_positions)) - np.repeat(
+            np.cumsum(entry_nums) - entry_nums, entry_nums
         )
+        # Every created row needs an entry from each of the multiple entry columns
+        problems = []
+        for col_name, (_, _, column_entry_nums) in split_columns.items():
+            no_entries = column_entry_nums[row_positions] == 0
+            problems.extend(
+                (row + 2, col_name) for row in np.unique(row_positions[no_entries])
+            )
+        if problems:
+            raise ValueError(
+                f"Invalid file {csv_file}, following entries only contain separators [line, column]:\n"
+                + "\n".join(
+                    [f"{line}, {col_name}" for line, col_name in sorted(problems)]
+                )
+            )
+        result = {}
+        for col_name in df.columns:
+            if col_name in split_columns:
+                entries, entry_offsets, column_entry_nums = split_columns[col_name]
+                result[col_name] = entries[
+                    entry_offsets[row_positions]
+                    + entry_indexes % column_entry_nums[row_positions]
+                ]
+            else:
+                # remove preceding and trailing whitespace
+                result[col_name] = strip_entries(df[col_name])[row_positions]
+        return pd.DataFrame(result, index=df.index[row_positions])
 
-    expand_list = []
-    # separate single row containing multiple entries to multiple rows containing a single entry.
-    # also remove preceding and trailing whitespace
-    for i in range(entry_num):
-        expand_list.append(
-            [
-                row["UniProt Accession Number"].strip(),
-                row["Target Name / Protein Biomarker"].strip(),
-                row["Antibody Name"].strip(),
-                row["Host Organism and Isotype"].strip(),
-                row["Clonality"].strip(),
-                row["Vendor"].strip(),
-                row["Catalog Number"].strip(),
-                row["Conjugate"].strip(),
-                row["RRID"].strip(),
-                row["Application"][i].strip(),
-                row["Method"][i].strip(),
-                row["Tissue Preservation"][i].strip(),
-                row["Tissue"][i].strip(),
-                row["Detergent"].strip(),
-                row["Antigen Retrieval Conditions"][i].strip(),
-                row["Dye Inactivation Conditions"][i].strip(),
-                row["Result"].strip(),
-                row["Agree"].strip(),
-                row["Disagree"].strip(),
-            ]
+
+def expand_row(row, header, multi_entry_indexes, entry_count_index):
+    """
+    Separate a row containing multiple entries, a list of strings, to a list of rows
+    containing a single entry (same semantics as csv_multi_2_csv_single). Raises a
+    ValueError if multiple entry columns only contain separators.
+    """
+    row = [value.strip() for value in row]
+    entry_lists = {i: entry2list(row[i]) for i in multi_entry_indexes}
+    entry_num = len(entry_lists[entry_count_index])
+    no_entries = [i for i, entries in entry_lists.items() if not entries]
+    if entry_num and no_entries:
+        raise ValueError(
+            "entries only contain separators in column(s) "
+            + ", ".join([header[i] for i in no_entries])
         )
-    return pd.DataFrame(expand_list, columns=row.index)
+    expanded_rows = []
+    for j in range(entry_num):
+        for i, entries in entry_lists.items():
+            row[i] = entries[j % len(entries)]
+        expanded_rows.append(list(row))
+    return expanded_rows
 
 
-def csv_multi_2_csv_single(csv_file):
-    # Read the dataframe and keep entries that are "NA", don't convert to nan
-    df = pd.read_csv(csv_file, dtype=str, keep_default_na=False)
-    res = df.apply(
-        lambda x: single_2_multi(x),
-        axis=1,
+def csv_multi_2_csv_single_stream(csv_file, single_entry_csv_file, schema=None):
+    """
+    Streaming version of csv_multi_2_csv_single, each row is read, expanded and written
+    to the single_entry_csv_file before the next row is read, so memory use does not
+    depend on the file size. The output is written to a temporary file which replaces
+    the single_entry_csv_file once all rows were written, if a row is invalid a
+    ValueError with the row's line number in the csv_file is raised and the
+    single_entry_csv_file is not modified.
+    """
+    if schema is None:
+        schema = load_schema()
+    single_entry_csv_file = pathlib.Path(single_entry_csv_file)
+    tmp_file_path = single_entry_csv_file.with_name(
+        single_entry_csv_file.name + f".{os.getpid()}.tmp"
     )
-    return pd.concat(res.to_list())
+    try:
+        # same encoding and line terminator as pandas read_csv and to_csv
+        with open(csv_file, newline="", encoding="utf-8-sig") as in_fp, open(
+            tmp_file_path, "w", newline="", encoding="utf-8"
+        ) as out_fp:
+            reader = csv.reader(in_fp)
+            writer = csv.writer(out_fp, lineterminator=os.linesep)
+            header = next(reader, [])
+            if ENTRY_COUNT_COLUMN_NAME not in header:
+                raise ValueError(
+                    f"Invalid file {csv_file}, missing column {ENTRY_COUNT_COLUMN_NAME}"
+                )
+            multi_entry_indexes = [
+                i
+                for i, col_name in enumerate(header)
+                if col_name in schema.multi_entry_column_names
+            ]
+            entry_count_index = header.index(ENTRY_COUNT_COLUMN_NAME)
+            writer.writerow(header)
+            # first line of the current row, rows may span multiple lines
+            line = reader.line_num + 1
+            for row in reader:
+                if row:
+                    if len(row) != len(header):
+                        raise ValueError(
+                            f"Invalid file {csv_file}, line {line}: expected {len(header)} fields, found {len(row)}"  # noqa E501
+                        )
+                    try:
+                        expanded_rows = expand_row(
+                            row, header, multi_entry_indexes, entry_count_index
+                        )
+                    except ValueError as e:
+                        raise ValueError(f"Invalid file {csv_file}, line {line}: {e}")
+                    writer.writerows(expanded_rows)
+                line = reader.line_num + 1
+        os.replace(tmp_file_path, single_entry_csv_file)
+    finally:
+        tmp_file_path.unlink(missing_ok=True)
 
 
 def main(argv=None):
@@ -132,11 +237,24 @@ def main(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("multi_entry_csv_file", type=file_path)
     parser.add_argument("single_entry_csv_file", type=str)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="convert one row at a time, memory use does not depend on the file size",
+    )
+    kb_profile.add_profile_arguments(parser)
     args = parser.parse_args(argv)
 
     try:
-        df = csv_multi_2_csv_single(args.multi_entry_csv_file)
-        df.to_csv(args.single_entry_csv_file, index=False)
+        with kb_profile.profiling(args, "csv_multi_2_csv_single"):
+            if args.stream:
+                csv_multi_2_csv_single_stream(
+                    args.multi_entry_csv_file, args.single_entry_csv_file
+                )
+            else:
+                df = csv_multi_2_csv_single(args.multi_entry_csv_file)
+                with kb_profile.phase("write csv"):
+                    df.to_csv(args.single_entry_csv_file, index=False)
     except Exception:
         print(traceback.format_exc(), file=sys.stderr)
         return 1
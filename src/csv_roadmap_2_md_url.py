@@ -16,10 +16,27 @@
 #
 # =========================================================================
 
-import pandas as pd
 import argparse
 import sys
+import os
+import re
+import pathlib
+import collections
+import urllib.parse
+import numpy as np
+import pandas as pd
+from md_table import write_dataframe, dataframe_to_markdown
 from argparse_types import file_path, dir_path
+from kb_snapshot import load_roadmap
+from kb_schema import ORCID_COLUMN_NAMES, explode_orcids
+import kb_profile
+from kb_cache import (
+    CACHE_DIR_NAME,
+    WriteManifest,
+    default_cache_dir,
+    hash_bytes,
+    hash_json,
+)
 
 """
 This script converts the IBEX knowledge-base roadmap.csv file to markdown and
@@ -36,6 +53,15 @@ contributors edit.
 The resulting markdown file "roadmap.md" is written to the parent directory of the supporting
 material.
 
+For a large knowledge-base, a single page is slow to build and to load. The roadmap can be split
+into multiple pages (--shard_by), one page per target or per value of another column, written to
+the "roadmap" directory next to "roadmap.md". In this mode "roadmap.md" is an index page linking
+to the other pages. Only pages whose roadmap rows changed are regenerated.
+
+By default the table columns are padded to a fixed width, which is readable as plain text.
+For a large knowledge-base, the unpadded table (--unpadded) is smaller and faster to write,
+it is rendered the same way by GitHub/Jekyll.
+
 This script is run automatically when modifications to the roadmap.csv file are merged
 into the main branch (see .github/workflows/csv2md.yml).
 """
@@ -44,40 +70,213 @@ md_header = (
     "<!-- Do NOT edit this file. It is automatically generated from roadmap.csv -->\n\n"
 )
 
+# Column used to split the roadmap into pages when no column is specified
+DEFAULT_SHARD_COLUMN_NAME = "Target Name / Protein Biomarker"
+# Increment when the format of the roadmap pages changes, all pages are regenerated
+ROADMAP_PAGE_FORMAT_VERSION = 2
+
+
+def quote_path_segments(values):
+    """
+    Percent-encode the values for use as URL path segments, all characters other
+    than letters, digits and "_.-~" are encoded. Each unique value is encoded once.
+    Returns a numpy array of the encoded values.
+    """
+    codes, uniques = pd.factorize(values)
+    return np.array(
+        [urllib.parse.quote(value, safe="") for value in uniques], dtype=object
+    )[codes]
 
-def data_2_urls_str(data, supporting_material_root_dir):
-    urls_str = ""
-    # First entry in the data corresponds to the "Agree" or "Disagree" column and can
-    # be a space.
-    if data[0].strip() != "":
-        txt = [v.strip() for v in data[0].split(";") if v.strip() != ""]
-        for v in txt[0:-1]:
-            urls_str += (
-                f"[{v}]({supporting_material_root_dir}/{data[1]}_{data[2]}/{v}.md), "
-            )
-        urls_str += f"[{txt[-1]}]({supporting_material_root_dir}/{data[1]}_{data[2]}/{txt[-1]}.md)"
-        # Encode space as %20 in the url
-        urls_str = urls_str.replace(" ", "%20")
-    return urls_str
+
+def add_supporting_material_links(df, supporting_material_root_dir):
+    """
+    Replace the ORCIDs in the Agree and Disagree columns with links to the supporting
+    material files, the links are relative to the given supporting_material_root_dir.
+    The ORCID columns are exploded, a link is created per ORCID and the links are joined
+    back per row, separated by ", ".
+    """
+    if df.empty:
+        return df
+    root = urllib.parse.quote(
+        pathlib.PurePath(supporting_material_root_dir).as_posix(), safe="/:"
+    )
+    target_conjugate = quote_path_segments(
+        (
+            df["Target Name / Protein Biomarker"].astype(str)
+            + "_"
+            + df["Conjugate"].astype(str)
+        ).to_numpy()
+    )
+    for col_name in ORCID_COLUMN_NAMES:
+        # index the ORCIDs by row position, the ORCIDs of a row are consecutive
+        orcids = explode_orcids(df[col_name].astype(str).reset_index(drop=True))
+        positions = orcids.index.to_numpy(dtype=np.intp)
+        links = (
+            "["
+            + orcids
+            + "]("
+            + root
+            + "/"
+            + target_conjugate[positions]
+            + "/"
+            + quote_path_segments(orcids.to_numpy())
+            + ".md)"
+        ).tolist()
+        starts = np.flatnonzero(np.diff(positions, prepend=-1))
+        ends = np.append(starts[1:], len(positions))
+        row_links = np.full(len(df), "", dtype=object)
+        row_links[positions[starts]] = [
+            ", ".join(links[start:end]) for start, end in zip(starts, ends)
+        ]
+        df[col_name] = row_links
+    return df
 
 
-def csv_2_md_with_url(csv_file_path, supporting_material_root_dir):
+def csv_2_md_with_url(
+    csv_file_path,
+    supporting_material_root_dir,
+    cache_dir=None,
+    shard_by=None,
+    padded=True,
+    roadmap=None,
+    link_root_dir=None,
+):
     """
     Convert the IBEX knowledge-base csv file to markdown and add links to the supporting
-    material files. Output is written to a file named markdown.md in the parent directory
-    of the supporting_material_root_dir.
+    material files. Output is written to a file named roadmap.md in the parent directory
+    of the supporting_material_root_dir. If a cache_dir is given the roadmap is loaded
+    from its snapshot when it is up to date (see kb_snapshot). If shard_by is given, the
+    roadmap is split into pages (see csv_2_md_shards). If padded is False, the table
+    columns are not padded to a fixed width (see md_table). If the roadmap dataframe was
+    already loaded (see kb_snapshot.load_roadmap) it is given as the roadmap, it is not
+    modified and the csv file is not read. The links to the supporting material files
+    start with the link_root_dir, by default the supporting_material_root_dir as given.
+    """
+    df = roadmap
+    if df is None:
+        # Read the dataframe and keep entries that are "NA", don't convert to nan
+        with kb_profile.phase("read roadmap"):
+            df, _ = load_roadmap(csv_file_path, cache_dir=cache_dir)
+    if shard_by:
+        return csv_2_md_shards(
+            df, supporting_material_root_dir, shard_by, cache_dir, padded
+        )
+    # the links replace the ORCIDs, a given roadmap is not modified
+    with kb_profile.phase("add links"):
+        df = add_supporting_material_links(
+            df if roadmap is None else df.copy(),
+            supporting_material_root_dir if link_root_dir is None else link_root_dir,
+        )
+    with kb_profile.phase("write markdown"), open(
+        supporting_material_root_dir.parent / "roadmap.md", "w"
+    ) as fp:
+        fp.write(md_header)
+        write_dataframe(fp, df, padded)
+
+
+def shard_file_names(values):
     """
-    # Read the dataframe and keep entries that are "NA", don't convert to nan
-    df = pd.read_csv(csv_file_path, dtype=str, keep_default_na=False)
-    if not df.empty:
-        df["Agree"] = df[
-            ["Agree", "Target Name / Protein Biomarker", "Conjugate"]
-        ].apply(lambda x: data_2_urls_str(x, supporting_material_root_dir), axis=1)
-        df["Disagree"] = df[
-            ["Disagree", "Target Name / Protein Biomarker", "Conjugate"]
-        ].apply(lambda x: data_2_urls_str(x, supporting_material_root_dir), axis=1)
-    with open(supporting_material_root_dir.parent / "roadmap.md", "w") as fp:
-        fp.write(md_header + df.to_markdown(index=False))
+    File names of the roadmap pages, derived from the shard values. Characters that are
+    not letters, digits, '.' or '-' are replaced with '_'. If names collide, ignoring case,
+    a hash of the value is appended to them.
+    """
+    names = {
+        value: re.sub(r"[^\w.-]+", "_", value).strip("_") or "_" for value in values
+    }
+    name_counts = collections.Counter(name.casefold() for name in names.values())
+    return {
+        value: (
+            name
+            if name_counts[name.casefold()] == 1
+            else f"{name}-{hash_bytes(value.encode('utf-8'))[:8]}"
+        )
+        + ".md"
+        for value, name in names.items()
+    }
+
+
+def csv_2_md_shards(
+    df, supporting_material_root_dir, shard_by, cache_dir=None, padded=True
+):
+    """
+    Write the roadmap as multiple markdown pages, one page per unique value of the shard_by
+    column, in a directory named roadmap in the parent directory of the
+    supporting_material_root_dir. The roadmap.md file is an index page, listing the
+    number of roadmap rows in each page and linking to it.
+    If a cache_dir is given, a page is only generated if its rows changed since it was
+    written (see kb_cache.WriteManifest), pages are always only written if their content
+    changed. Pages whose value no longer appears in the roadmap are removed.
+    """
+    if shard_by not in df.columns:
+        raise ValueError(f"Unknown shard column ({shard_by}).")
+    index_file_path = supporting_material_root_dir.parent / "roadmap.md"
+    shard_dir = supporting_material_root_dir.parent / "roadmap"
+    # links from the pages to the supporting material files
+    supporting_material_link_root = pathlib.PurePath(
+        os.path.relpath(supporting_material_root_dir, shard_dir)
+    ).as_posix()
+    manifest = WriteManifest(cache_dir, "csv_roadmap_2_md_url")
+    status_counts = {"created": 0, "updated": 0, "unchanged": 0, "removed": 0}
+
+    groups = df.groupby(df[shard_by].astype(str), sort=False).indices
+    shard_values = sorted(groups, key=lambda value: (value.casefold(), value))
+    file_names = shard_file_names(shard_values)
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    with kb_profile.phase("write pages"):
+        for value in shard_values:
+            row_positions = groups[value]
+            shard_file_path = shard_dir / file_names[value]
+            source_hash = hash_json(
+                [
+                    ROADMAP_PAGE_FORMAT_VERSION,
+                    padded,
+                    list(df.columns),
+                    supporting_material_link_root,
+                    hash_bytes(row_hashes[row_positions].tobytes()),
+                ]
+            )
+            if manifest.is_current(shard_file_path, source_hash):
+                status_counts["unchanged"] += 1
+                continue
+            shard_df = add_supporting_material_links(
+                df.iloc[row_positions].copy(), supporting_material_link_root
+            )
+            status = manifest.write(
+                shard_file_path,
+                md_header + f"# {value}\n\n" + dataframe_to_markdown(shard_df, padded),
+                source_hash=source_hash,
+            )
+            status_counts[status] += 1
+
+    # remove pages of values that are no longer in the roadmap
+    for shard_file_path in sorted(shard_dir.glob("*.md")):
+        if shard_file_path.name not in file_names.values():
+            with open(shard_file_path, encoding="utf-8") as fp:
+                generated = fp.readline() == md_header.splitlines(keepends=True)[0]
+            if generated:
+                shard_file_path.unlink()
+                status_counts["removed"] += 1
+
+    index_df = pd.DataFrame(
+        {
+            shard_by: [
+                f"[{value}](roadmap/{urllib.parse.quote(file_names[value])})"
+                for value in shard_values
+            ],
+            "Configurations": [len(groups[value]) for value in shard_values],
+        }
+    )
+    status = manifest.write(
+        index_file_path, md_header + dataframe_to_markdown(index_df, padded)
+    )
+    status_counts[status] += 1
+    try:
+        manifest.save()
+    except OSError as e:
+        print(f"Warning: failed to save manifest ({e}).", file=sys.stderr)
+    print(
+        f"Roadmap pages: {status_counts['created']} created, {status_counts['updated']} updated, {status_counts['unchanged']} unchanged, {status_counts['removed']} removed."  # noqa E501
+    )
 
 
 def main(argv=None):
@@ -88,10 +287,34 @@ def main(argv=None):
     )
     parser.add_argument("csv_file", type=file_path)
     parser.add_argument("supporting_material_root_dir", type=dir_path)
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"do not use or update the roadmap snapshot ({CACHE_DIR_NAME} directory next to the csv_file)",
+    )
+    parser.add_argument(
+        "--shard_by",
+        nargs="?",
+        const=DEFAULT_SHARD_COLUMN_NAME,
+        help=f"write one page per value of the given column and an index page (default column: {DEFAULT_SHARD_COLUMN_NAME})",  # noqa E501
+    )
+    parser.add_argument(
+        "--unpadded",
+        action="store_true",
+        help="do not pad the table columns to a fixed width, smaller and faster to write",
+    )
+    kb_profile.add_profile_arguments(parser)
     args = parser.parse_args(argv)
 
     try:
-        csv_2_md_with_url(args.csv_file, args.supporting_material_root_dir)
+        with kb_profile.profiling(args, "csv_roadmap_2_md_url"):
+            csv_2_md_with_url(
+                args.csv_file,
+                args.supporting_material_root_dir,
+                None if args.no_cache else default_cache_dir(args.csv_file),
+                args.shard_by,
+                not args.unpadded,
+            )
     except Exception as e:
         print(
             f"{e}",
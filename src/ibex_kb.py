@@ -0,0 +1,243 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import argparse
+import collections
+import pathlib
+import sys
+from argparse_types import dir_path, positive_int
+from kb_cache import CACHE_DIR_NAME, default_cache_dir
+from kb_schema import DEFAULT_CONFIG_FILE, load_schema
+from kb_snapshot import load_roadmap
+from validate_data import validate_data
+from csv_roadmap_2_md_url import DEFAULT_SHARD_COLUMN_NAME, csv_2_md_with_url
+from bib2md import bibfile2md
+import kb_profile
+
+"""
+Single entry point for building the IBEX knowledge-base, replaces running validate_data.py,
+csv_roadmap_2_md_url.py and bib2md.py one after the other, each one in a new Python interpreter
+which imports pandas and reads the roadmap.csv file again.
+
+The build command loads the knowledge-base once, the roadmap dataframe and its exploded ORCID
+columns (see kb_snapshot), and runs the stages on this in-memory model:
+1. validate - validate the roadmap and supporting material (see validate_data.py).
+2. roadmap - create the roadmap markdown page(s) (see csv_roadmap_2_md_url.py).
+3. publications - create the publications markdown page (see bib2md.py).
+
+All stages run by default, a subset is selected with --stages. The roadmap pages are only
+created from a valid knowledge-base, when the validate stage fails the roadmap stage is skipped.
+The publications stage does not depend on the roadmap and always runs. The exit status is 0 only
+if all the selected stages succeeded.
+
+The files are located using the repository layout, relative to the knowledge-base root directory:
+roadmap.csv, .zenodo.json, publications.bib, docs/supporting_material and docs/publications.md.
+As in the data2md.yml workflow, the roadmap links to the supporting material files are relative to
+the root directory.
+"""
+
+KnowledgeBase = collections.namedtuple(
+    "KnowledgeBase", ["root_dir", "schema", "roadmap", "orcids"]
+)
+
+STAGES = ["validate", "roadmap", "publications"]
+
+ROADMAP_FILE_NAME = "roadmap.csv"
+ZENODO_FILE_NAME = ".zenodo.json"
+BIBLIOGRAPHY_FILE_NAME = "publications.bib"
+SUPPORTING_MATERIAL_DIR = pathlib.Path("docs") / "supporting_material"
+PUBLICATIONS_FILE = pathlib.Path("docs") / "publications.md"
+CSL_FILE = pathlib.Path(__file__).parent / "ibex.csl"
+DEFAULT_ROOT_DIR = pathlib.Path(__file__).absolute().parent.parent
+
+
+def load_knowledge_base(root_dir, json_config_file=DEFAULT_CONFIG_FILE, cache_dir=None):
+    """
+    Load the knowledge-base schema and roadmap, the roadmap is loaded from its snapshot
+    in the cache_dir when it is up to date (see kb_snapshot.load_roadmap).
+    """
+    schema = load_schema(json_config_file)
+    df, orcids = load_roadmap(root_dir / ROADMAP_FILE_NAME, schema, cache_dir)
+    return KnowledgeBase(root_dir, schema, df, orcids)
+
+
+def build(
+    root_dir,
+    stages=STAGES,
+    jobs=1,
+    cache_dir=None,
+    since=None,
+    shard_by=None,
+    padded=True,
+    engine="pandoc",
+    json_config_file=DEFAULT_CONFIG_FILE,
+):
+    """
+    Run the selected build stages on the knowledge-base in the root_dir. The roadmap is
+    loaded once and shared by the stages. Each stage reports its own problems, the
+    result of each stage ("ok", "failed" or "skipped") is printed. Returns 0 if all
+    the selected stages succeeded, otherwise 1.
+    """
+    results = {}
+    kb = None
+    if "validate" in stages or "roadmap" in stages:
+        try:
+            with kb_profile.phase("load knowledge-base"):
+                kb = load_knowledge_base(root_dir, json_config_file, cache_dir)
+        except Exception as e:
+            print(f"Failed to load the knowledge-base: {e}.", file=sys.stderr)
+
+    if "validate" in stages:
+        with kb_profile.phase("validate"):
+            if kb is None:
+                results["validate"] = "failed"
+            else:
+                results["validate"] = (
+                    "failed"
+                    if validate_data(
+                        json_config_file,
+                        root_dir / ROADMAP_FILE_NAME,
+                        root_dir / SUPPORTING_MATERIAL_DIR,
+                        root_dir / ZENODO_FILE_NAME,
+                        jobs,
+                        cache_dir,
+                        since,
+                        roadmap=(kb.roadmap, kb.orcids),
+                    )
+                    else "ok"
+                )
+
+    if "roadmap" in stages:
+        with kb_profile.phase("roadmap"):
+            if kb is None:
+                results["roadmap"] = "failed"
+            elif results.get("validate") == "failed":
+                results["roadmap"] = "skipped"
+            else:
+                try:
+                    csv_2_md_with_url(
+                        root_dir / ROADMAP_FILE_NAME,
+                        root_dir / SUPPORTING_MATERIAL_DIR,
+                        cache_dir,
+                        shard_by,
+                        padded,
+                        roadmap=kb.roadmap,
+                        link_root_dir=SUPPORTING_MATERIAL_DIR,
+                    )
+                    results["roadmap"] = "ok"
+                except Exception as e:
+                    print(f"{e}", file=sys.stderr)
+                    results["roadmap"] = "failed"
+
+    if "publications" in stages:
+        with kb_profile.phase("publications"):
+            try:
+                bibfile2md(
+                    root_dir / BIBLIOGRAPHY_FILE_NAME,
+                    CSL_FILE,
+                    root_dir / PUBLICATIONS_FILE,
+                    cache_dir,
+                    jobs,
+                    engine,
+                )
+                results["publications"] = "ok"
+            except Exception as e:
+                print(f"{e}", file=sys.stderr)
+                results["publications"] = "failed"
+
+    for stage, result in results.items():
+        print(f"{stage}: {result}")
+    return 0 if all(result == "ok" for result in results.values()) else 1
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="IBEX knowledge-base tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser(
+        "build",
+        help="validate the knowledge-base and create the roadmap and publications markdown files",
+    )
+    build_parser.add_argument(
+        "root_dir",
+        type=dir_path,
+        nargs="?",
+        default=DEFAULT_ROOT_DIR,
+        help="knowledge-base root directory, containing the roadmap.csv file (default: repository root)",
+    )
+    build_parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="stages to run, always in the order validate, roadmap, publications (default: all stages)",
+    )
+    build_parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="number of processes used to validate the supporting material files and render the references",
+    )
+    build_parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"do not use or update the caches ({CACHE_DIR_NAME} directory in the root_dir)",
+    )
+    build_parser.add_argument(
+        "--since",
+        type=str,
+        help="git reference (e.g. origin/main), only validate the supporting material affected by changes since then",
+    )
+    build_parser.add_argument(
+        "--shard_by",
+        nargs="?",
+        const=DEFAULT_SHARD_COLUMN_NAME,
+        help=f"write one roadmap page per value of the given column and an index page (default column: {DEFAULT_SHARD_COLUMN_NAME})",  # noqa E501
+    )
+    build_parser.add_argument(
+        "--unpadded",
+        action="store_true",
+        help="do not pad the roadmap table columns to a fixed width",
+    )
+    build_parser.add_argument(
+        "--engine",
+        choices=["pandoc", "python"],
+        default="pandoc",
+        help="render the references using pandoc (reference engine) or the built-in python renderer",
+    )
+    kb_profile.add_profile_arguments(build_parser)
+    args = parser.parse_args(argv)
+
+    with kb_profile.profiling(args, "ibex_kb"):
+        return build(
+            args.root_dir,
+            [stage for stage in STAGES if stage in args.stages],
+            args.jobs,
+            None
+            if args.no_cache
+            else default_cache_dir(args.root_dir / ROADMAP_FILE_NAME),
+            args.since,
+            args.shard_by,
+            not args.unpadded,
+            args.engine,
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from argparse_types import file_path, positive_int
+from kb_schema import DEFAULT_CONFIG_FILE
+from validate_data import validate_data
+from csv_2_supporting import csv_2_supporting
+from csv_multi_2_csv_single import csv_multi_2_csv_single
+from csv_roadmap_2_md_url import csv_2_md_with_url
+from bib2md import bibfile2md
+from ibex_kb import (
+    BIBLIOGRAPHY_FILE_NAME,
+    CSL_FILE,
+    ROADMAP_FILE_NAME,
+    SUPPORTING_MATERIAL_DIR,
+    ZENODO_FILE_NAME,
+)
+from kb_synthetic import (
+    MULTI_ENTRY_ROADMAP_FILE_NAME,
+    size_at_scale,
+    synthetic_knowledge_base,
+)
+
+"""
+This utility script measures how the knowledge-base scripts scale. For each of the given scales
+a synthetic knowledge-base is created (see kb_synthetic.py) and the following are run on it:
+1. validate_data - validate the roadmap and supporting material (validate_data.py).
+2. csv_2_supporting - create the supporting material files from the roadmap (csv_2_supporting.py).
+3. csv_multi_2_csv_single - convert the multiple entries per row roadmap (csv_multi_2_csv_single.py).
+4. csv_roadmap_2_md_url - create the roadmap markdown page (csv_roadmap_2_md_url.py).
+5. bibfile2md - create the publications markdown page (bib2md.py).
+
+Each benchmark is run without the caches, the time is the minimum over the repeats. The peak
+memory is measured in an additional run using tracemalloc, it includes the memory allocated by
+Python and numpy in this process, not the memory used by worker processes (--jobs) or pandoc.
+
+The results are written to a JSON report which includes the git commit and the Python and pandas
+versions. Reports created on different commits are compared with --baseline, which prints the
+ratio between the current and baseline results, a ratio greater than one is a regression.
+
+Example, measure the default 1x, 10x, 100x and 1000x scales, where 1x is roughly the size of the
+knowledge-base at the time of writing, and compare to a previous report:
+
+python kb_benchmark.py benchmark.json --baseline benchmark_main.json
+"""
+
+# Increment when the report structure changes
+REPORT_FORMAT_VERSION = 1
+
+BENCHMARKS = [
+    "validate_data",
+    "csv_2_supporting",
+    "csv_multi_2_csv_single",
+    "csv_roadmap_2_md_url",
+    "bibfile2md",
+]
+
+
+def benchmark_task(name, root_dir, jobs, engine):
+    """
+    Function which runs the named benchmark on the knowledge-base in the root_dir. Its
+    argument is an empty directory for the output files, it returns True on success.
+    """
+    roadmap_csv = root_dir / ROADMAP_FILE_NAME
+    supporting_material_root_dir = root_dir / SUPPORTING_MATERIAL_DIR
+
+    def run_validate_data(output_dir):
+        return (
+            validate_data(
+                DEFAULT_CONFIG_FILE,
+                roadmap_csv,
+                supporting_material_root_dir,
+                root_dir / ZENODO_FILE_NAME,
+                jobs,
+            )
+            == 0
+        )
+
+    def run_csv_2_supporting(output_dir):
+        csv_2_supporting(
+            roadmap_csv,
+            output_dir,
+            pathlib.Path(__file__).parent / "supporting_template.md",
+            jobs=jobs,
+        )
+        return True
+
+    def run_csv_multi_2_csv_single(output_dir):
+        csv_multi_2_csv_single(root_dir / MULTI_ENTRY_ROADMAP_FILE_NAME)
+        return True
+
+    def run_csv_roadmap_2_md_url(output_dir):
+        # the roadmap.md is written next to the supporting material directory
+        csv_2_md_with_url(roadmap_csv, supporting_material_root_dir)
+        return True
+
+    def run_bibfile2md(output_dir):
+        bibfile2md(
+            root_dir / BIBLIOGRAPHY_FILE_NAME,
+            CSL_FILE,
+            output_dir / "publications.md",
+            jobs=jobs,
+            engine=engine,
+        )
+        return True
+
+    tasks = {
+        "validate_data": run_validate_data,
+        "csv_2_supporting": run_csv_2_supporting,
+        "csv_multi_2_csv_single": run_csv_multi_2_csv_single,
+        "csv_roadmap_2_md_url": run_csv_roadmap_2_md_url,
+        "bibfile2md": run_bibfile2md,
+    }
+    if name in tasks:
+        return tasks[name]
+    raise ValueError(f"Unknown benchmark ({name}).")
+
+
+def run_task(task, work_dir):
+    try:
+        return task(pathlib.Path(tempfile.mkdtemp(dir=work_dir)))
+    except Exception:
+        return False
+
+
+def measure(task, work_dir, repeat=1, memory=True):
+    """
+    Run the task repeat times and return the minimal time in seconds, the peak memory in
+    bytes (None if memory is False) and whether all the runs succeeded, a task which
+    raises an exception failed. The output of the task is discarded.
+    """
+    times = []
+    succeeded = True
+    peak_bytes = None
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            succeeded &= run_task(task, work_dir)
+            times.append(time.perf_counter() - start)
+        if memory:
+            tracemalloc.start()
+            try:
+                succeeded &= run_task(task, work_dir)
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return min(times), peak_bytes, succeeded
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=pathlib.Path(__file__).parent,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(
+    scales=[1, 10, 100, 1000],
+    benchmarks=BENCHMARKS,
+    jobs=1,
+    engine="python",
+    repeat=1,
+    memory=True,
+    seed=0,
+):
+    """
+    Run the benchmarks on a synthetic knowledge-base at each of the scales. Returns the
+    report dictionary, the result of each benchmark is also printed as it completes.
+    """
+    report = {
+        "format_version": REPORT_FORMAT_VERSION,
+        "commit": git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec="seconds"
+        ),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "jobs": jobs,
+        "engine": engine,
+        "repeat": repeat,
+        "seed": seed,
+        "scales": [],
+    }
+    for scale in scales:
+        size = size_at_scale(scale)
+        with tempfile.TemporaryDirectory() as tmp_dir_name:
+            root_dir = pathlib.Path(tmp_dir_name) / "kb"
+            rows = synthetic_knowledge_base(root_dir, size, seed)
+            results = {}
+            for name in benchmarks:
+                seconds, peak_bytes, succeeded = measure(
+                    benchmark_task(name, root_dir, jobs, engine),
+                    pathlib.Path(tmp_dir_name),
+                    repeat,
+                    memory,
+                )
+                results[name] = {
+                    "seconds": seconds,
+                    "peak_bytes": peak_bytes,
+                    "succeeded": succeeded,
+                }
+                print(
+                    f"{scale}x {name}: {seconds:.3f}s"
+                    + (
+                        ""
+                        if peak_bytes is None
+                        else f", {peak_bytes / 2**20:.1f}MB peak"
+                    )
+                    + ("" if succeeded else ", failed")
+                )
+        report["scales"].append(
+            {"scale": scale, "size": size._asdict(), "rows": rows, "results": results}
+        )
+    return report
+
+
+def compare_reports(report, baseline):
+    """
+    Ratio between the current and baseline results of the benchmarks that appear in both
+    reports. Returns a list of (scale, benchmark, seconds ratio, peak memory ratio), the
+    memory ratio is None if it was not measured in one of the reports.
+    """
+    baseline_results = {
+        entry["scale"]: entry["results"] for entry in baseline["scales"]
+    }
+    ratios = []
+    for entry in report["scales"]:
+        for name, result in entry["results"].items():
+            baseline_result = baseline_results.get(entry["scale"], {}).get(name)
+            if baseline_result is None:
+                continue
+            memory_ratio = None
+            if result["peak_bytes"] and baseline_result["peak_bytes"]:
+                memory_ratio = result["peak_bytes"] / baseline_result["peak_bytes"]
+            ratios.append(
+                (
+                    entry["scale"],
+                    name,
+                    result["seconds"] / baseline_result["seconds"],
+                    memory_ratio,
+                )
+            )
+    return ratios
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Measure how the knowledge-base scripts scale, using synthetic knowledge-bases."
+    )
+    parser.add_argument("report_file", type=str, help="JSON report output file name")
+    parser.add_argument(
+        "--scales",
+        type=positive_int,
+        nargs="+",
+        default=[1, 10, 100, 1000],
+        help="knowledge-base sizes relative to the knowledge-base at the time of writing (default: 1 10 100 1000)",  # noqa E501
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="benchmarks to run (default: all benchmarks)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="number of processes used by the scripts that support it",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pandoc", "python"],
+        default="python",
+        help="engine used by bib2md to render the references (default: python)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=positive_int,
+        default=1,
+        help="number of timed runs of each benchmark, the minimal time is reported",
+    )
+    parser.add_argument(
+        "--no_memory",
+        action="store_true",
+        help="do not measure the peak memory, saves the additional run of each benchmark",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the synthetic knowledge-base"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=file_path,
+        help="JSON report of a previous run, the results are compared to it",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as fp:
+                baseline = json.load(fp)
+        report = benchmark(
+            sorted(set(args.scales)),
+            [name for name in BENCHMARKS if name in args.benchmarks],
+            args.jobs,
+            args.engine,
+            args.repeat,
+            not args.no_memory,
+            args.seed,
+        )
+        with open(args.report_file, "w") as fp:
+            json.dump(report, fp, indent=4)
+            fp.write("\n")
+    except Exception as e:
+        print(f"{e}", file=sys.stderr)
+        return 1
+    if baseline is not None:
+        print(f"Comparison to baseline (commit {baseline.get('commit')}):")
+        for scale, name, time_ratio, memory_ratio in compare_reports(report, baseline):
+            print(
+                f"{scale}x {name}: time x{time_ratio:.2f}"
+                + ("" if memory_ratio is None else f", peak memory x{memory_ratio:.2f}")
+            )
+    return (
+        0
+        if all(
+            result["succeeded"]
+            for entry in report["scales"]
+            for result in entry["results"].values()
+        )
+        else 1
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
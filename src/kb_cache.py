@@ -0,0 +1,347 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import hashlib
+import json
+import os
+import pathlib
+
+"""
+Persistent on-disk cache used by the knowledge-base scripts to avoid repeating work
+when the inputs did not change. The cache is stored in a directory named ".ibex_cache",
+by default located next to the roadmap file, and can be deleted at any time.
+
+The validation cache contains:
+ 1. File content hashes, keyed by path and validated using the file's modification time and size,
+    so that unchanged files are not read.
+ 2. Parsed supporting material configuration tables, keyed by the file content hash.
+ 3. Results of validating a supporting material file against its slice of the roadmap, keyed by a
+    hash of the file content and the roadmap rows.
+
+Scripts that generate files record them in a manifest (see WriteManifest), so that files whose
+content did not change are not rewritten.
+
+Scripts that render text fragments using an external tool (e.g. the bibliography entries rendered
+by pandoc) store the fragments in a render cache (see RenderCache), keyed by a hash of the data
+they were rendered from. Similarly, data parsed from large input files (e.g. the bibliography
+entries) is stored in a parse cache (see ParseCache), keyed by a hash of the text it was parsed from.
+
+All entries are tied to a salt which the caller computes from the inputs that affect the
+validation (e.g. the JSON configuration and the .zenodo.json files). When the salt changes
+the cache is discarded.
+"""
+
+CACHE_DIR_NAME = ".ibex_cache"
+# Increment when the cache content format changes
+CACHE_FORMAT_VERSION = 4
+
+
+def default_cache_dir(path):
+    """
+    Default cache directory, located in the same directory as the given file.
+    """
+    return pathlib.Path(path).parent / CACHE_DIR_NAME
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path):
+    with open(file_path, "rb") as fp:
+        return hash_bytes(fp.read())
+
+
+def hash_json(obj):
+    """
+    Hash of a JSON serializable object, tuples are serialized as lists.
+    """
+    return hash_bytes(
+        json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    )
+
+
+def write_atomic(file_path, content):
+    """
+    Write the text or bytes content to a temporary file and rename it, readers never
+    see a partially written file.
+    """
+    file_path = pathlib.Path(file_path)
+    tmp_file_path = file_path.with_name(file_path.name + f".{os.getpid()}.tmp")
+    if isinstance(content, bytes):
+        with open(tmp_file_path, "wb") as fp:
+            fp.write(content)
+    else:
+        with open(tmp_file_path, "w", encoding="utf-8") as fp:
+            fp.write(content)
+    os.replace(tmp_file_path, file_path)
+
+
+class WriteManifest:
+    """
+    Manifest of the files generated by a script, the content hash of each file together
+    with its modification time and size. Generated content is only written if it differs
+    from the file's content. When the file did not change since it was recorded in the
+    manifest, the comparison uses the recorded hash and the file is not read. Without a
+    cache_dir, the comparison always reads the file and the manifest is not saved.
+
+    A file can also be recorded with the hash of the data it was generated from (source_hash),
+    so that callers can skip generating the content when the data did not change (see is_current).
+    """
+
+    def __init__(self, cache_dir, name):
+        self.cache_file_path = (
+            pathlib.Path(cache_dir) / f"{name}_manifest.json" if cache_dir else None
+        )
+        self._files = {}
+        if self.cache_file_path:
+            try:
+                with open(self.cache_file_path, encoding="utf-8") as fp:
+                    content = json.load(fp)
+                if content["version"] == CACHE_FORMAT_VERSION:
+                    self._files = content["files"]
+            except (OSError, ValueError, KeyError):
+                # missing or corrupt manifest, start from scratch
+                pass
+
+    def is_current(self, file_path, source_hash):
+        """
+        True if the file was generated from data with the given source_hash and did
+        not change since.
+        """
+        entry = self._files.get(str(file_path))
+        if not entry or entry[3] != source_hash:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size
+
+    def write(self, file_path, content, dry_run=False, source_hash=None):
+        """
+        Write the text content to the file if it changed, missing directories are
+        created. Returns "created", "updated" or "unchanged". In a dry run the status
+        is computed but nothing is written.
+        """
+        data = content.encode("utf-8")
+        content_hash = hash_bytes(data)
+        key = str(file_path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None:
+            status = "created"
+        else:
+            entry = self._files.get(key)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                file_hash = entry[2]
+            else:
+                file_hash = hash_file(file_path)
+            status = "unchanged" if file_hash == content_hash else "updated"
+        if dry_run:
+            return status
+        if status != "unchanged":
+            pathlib.Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(file_path, data)
+            stat = os.stat(file_path)
+        self._files[key] = [stat.st_mtime_ns, stat.st_size, content_hash, source_hash]
+        return status
+
+    def save(self):
+        if not self.cache_file_path:
+            return
+        self.cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        # drop entries of files that were deleted
+        files = {
+            key: entry for key, entry in self._files.items() if os.path.exists(key)
+        }
+        write_atomic(
+            self.cache_file_path,
+            json.dumps(
+                {"version": CACHE_FORMAT_VERSION, "files": files}, ensure_ascii=False
+            ),
+        )
+
+
+class ValidationCache:
+    """
+    Cache for the supporting material validation. Entries which are not used during a
+    run are dropped when the cache is saved, so the cache size follows the size of
+    the knowledge-base. Without a cache_dir, the cache is only kept in memory.
+    """
+
+    file_name = "validate_data.json"
+
+    def __init__(self, cache_dir, salt):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir else None
+        self.cache_file_path = self.cache_dir / self.file_name if cache_dir else None
+        self.salt = hash_json([CACHE_FORMAT_VERSION, salt])
+        self._files = {}
+        self._tables = {}
+        self._groups = {}
+        if self.cache_file_path:
+            try:
+                with open(self.cache_file_path, encoding="utf-8") as fp:
+                    content = json.load(fp)
+                if content["salt"] == self.salt:
+                    self._files = content["files"]
+                    self._tables = content["tables"]
+                    self._groups = content["groups"]
+            except (OSError, ValueError, KeyError):
+                # missing or corrupt cache, start from scratch
+                pass
+        self._used_files = {}
+        self._used_tables = {}
+        self._used_groups = {}
+
+    def file_hash(self, file_path):
+        """
+        Content hash of the given file or None if the file does not exist. The file
+        is only read if its modification time or size changed since it was cached.
+        """
+        key = str(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        entry = self._files.get(key)
+        if not entry or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            entry = [stat.st_mtime_ns, stat.st_size, hash_file(file_path)]
+        self._used_files[key] = entry
+        return entry[2]
+
+    def group_key(self, md_file_path, file_hash, *roadmap_data):
+        return hash_json([str(md_file_path), file_hash, *roadmap_data])
+
+    def get_table(self, file_hash):
+        table = self._tables.get(file_hash)
+        if table is not None:
+            self._used_tables[file_hash] = table
+        return table
+
+    def set_table(self, file_hash, table):
+        self._used_tables[file_hash] = table
+
+    def has_group(self, key):
+        return key in self._groups
+
+    def get_group(self, key):
+        result = self._groups[key]
+        self._used_groups[key] = result
+        return result
+
+    def set_group(self, key, result):
+        self._used_groups[key] = result
+
+    def renew(self):
+        """
+        Start a new run with the entries used during the previous run, as if the cache
+        was saved and loaded again. Used by long running processes which keep the cache
+        in memory between runs (see validate_server.py).
+        """
+        self._files = self._used_files
+        self._tables = self._used_tables
+        self._groups = self._used_groups
+        self._used_files = {}
+        self._used_tables = {}
+        self._used_groups = {}
+
+    def save(self):
+        if not self.cache_file_path:
+            return
+        self.cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            self.cache_file_path,
+            json.dumps(
+                {
+                    "salt": self.salt,
+                    "files": self._used_files,
+                    "tables": self._used_tables,
+                    "groups": self._used_groups,
+                },
+                ensure_ascii=False,
+            ),
+        )
+
+
+class RenderCache:
+    """
+    Cache of rendered text fragments, keyed by a hash of the data each fragment was
+    rendered from. As with the ValidationCache, all entries are tied to a salt (e.g.
+    the rendering tool version and style files) and entries which are not used during
+    a run are dropped when the cache is saved. Without a cache_dir, the cache is only
+    kept in memory.
+    """
+
+    file_suffix = "render"
+
+    def __init__(self, cache_dir, name, salt):
+        self.cache_file_path = (
+            pathlib.Path(cache_dir) / f"{name}_{self.file_suffix}.json"
+            if cache_dir
+            else None
+        )
+        self.salt = hash_json([CACHE_FORMAT_VERSION, salt])
+        self._fragments = {}
+        if self.cache_file_path:
+            try:
+                with open(self.cache_file_path, encoding="utf-8") as fp:
+                    content = json.load(fp)
+                if content["salt"] == self.salt:
+                    self._fragments = content["fragments"]
+            except (OSError, ValueError, KeyError):
+                # missing or corrupt cache, start from scratch
+                pass
+        self._used_fragments = {}
+
+    def get(self, key):
+        """
+        Cached fragment for the given key or None if it is not in the cache.
+        """
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self._used_fragments[key] = fragment
+        return fragment
+
+    def set(self, key, fragment):
+        self._fragments[key] = fragment
+        self._used_fragments[key] = fragment
+
+    def save(self):
+        if not self.cache_file_path:
+            return
+        self.cache_file_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(
+            self.cache_file_path,
+            json.dumps(
+                {"salt": self.salt, "fragments": self._used_fragments},
+                ensure_ascii=False,
+            ),
+        )
+
+
+class ParseCache(RenderCache):
+    """
+    Cache of data parsed from input files (e.g. bibliography entries), keyed by a hash
+    of the text each item was parsed from. The items are JSON serializable objects,
+    otherwise the same as the RenderCache.
+    """
+
+    file_suffix = "parse"
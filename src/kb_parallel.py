@@ -0,0 +1,40 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import concurrent.futures
+
+"""
+Process pool helper shared by the scripts that handle many supporting material files
+concurrently (--jobs).
+"""
+
+
+def process_map(fn, task_count, jobs, *iterables):
+    """
+    Apply fn to the items of the iterables, task_count of them, using jobs processes. With
+    a single job or task the items are processed lazily in this process, as map does.
+    Otherwise the results are returned as a list in the order of the items.
+    """
+    if jobs <= 1 or task_count <= 1:
+        return map(fn, *iterables)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Send the items to the workers in chunks, about four per worker, reduces the
+        # inter process communication overhead when there are many small tasks.
+        return list(
+            executor.map(fn, *iterables, chunksize=max(1, task_count // (4 * jobs)))
+        )
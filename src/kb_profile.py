@@ -0,0 +1,289 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import collections
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from md_table import markdown_table
+
+"""
+Per-phase profiling of the knowledge-base scripts, enabled with the --profile option which is
+shared by all the scripts (see add_profile_arguments and profiling).
+
+The work done by a script is divided into named phases, e.g. reading the roadmap or checking the
+entries for whitespace, marked in the code with the phase context manager:
+
+with kb_profile.phase("whitespace check"):
+    ...
+
+When profiling is not enabled a phase does nothing. Otherwise, the wall time, CPU time and peak
+traced memory (tracemalloc) of each phase are recorded. Phases are nested, a phase is identified
+by its path, the names of the enclosing phases and its own name separated by "/", the outermost
+phase is the script. Phases with the same path, e.g. parsing each of the supporting material
+files, are summed in the summary table, their peak memory is the maximum.
+
+The summary table is printed to stderr when the script ends. The phases can also be written to a
+file (--profile_output) in one of two formats (--profile_format):
+1. json - the summary, the phase totals, with the script name and Python version.
+2. trace - Chrome trace event format, each phase occurrence is an event. View the file in a
+   trace viewer such as https://ui.perfetto.dev or chrome://tracing.
+
+Notes:
+1. The CPU time is that of the script's process, it does not include the time of worker
+   processes (--jobs) or external tools (pandoc). Phases run in worker processes are not recorded.
+2. The peak traced memory is the peak of the memory allocated by Python and numpy since profiling
+   started, not the memory used by the phase alone. Tracing memory slows down the script, the
+   times are only comparable to those of other profiled runs.
+"""
+
+# Increment when the structure of the json output changes
+PROFILE_FORMAT_VERSION = 1
+
+PROFILE_FORMATS = ["json", "trace"]
+
+# A completed phase, times are in seconds, start is relative to the start of profiling
+PhaseRecord = collections.namedtuple(
+    "PhaseRecord", ["path", "name", "start", "wall", "cpu", "peak_bytes"]
+)
+
+# The active profiler, None when profiling is not enabled
+_profiler = None
+
+
+class Profiler:
+    """
+    Records the phases, in order of completion. The peak traced memory of a phase is
+    tracked across nested phases, tracemalloc's peak is reset when a phase starts and the
+    peak before the reset is retained by the enclosing phases.
+    """
+
+    def __init__(self):
+        self.records = []
+        # The enclosing phases, [path, peak_bytes] lists
+        self._stack = []
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _peak(self):
+        return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        path = self._stack[-1][0] + "/" + name if self._stack else name
+        if self._stack:
+            self._stack[-1][1] = max(self._stack[-1][1], self._peak())
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        frame = [path, 0]
+        self._stack.append(frame)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            self._stack.pop()
+            peak_bytes = max(frame[1], self._peak())
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak_bytes)
+            self.records.append(
+                PhaseRecord(path, name, start - self._start, wall, cpu, peak_bytes)
+            )
+
+    def summary(self):
+        """
+        Phase totals, a list of (path, calls, wall, cpu, peak_bytes) tuples in the order in
+        which the phases started.
+        """
+        totals = {}
+        for record in sorted(self.records, key=lambda record: record.start):
+            calls, wall, cpu, peak_bytes = totals.get(record.path, (0, 0.0, 0.0, 0))
+            totals[record.path] = (
+                calls + 1,
+                wall + record.wall,
+                cpu + record.cpu,
+                max(peak_bytes, record.peak_bytes),
+            )
+        return [(path, *total) for path, total in totals.items()]
+
+    def summary_table(self):
+        return markdown_table(
+            ["Phase", "Calls", "Wall (s)", "CPU (s)", "Peak memory (MB)"],
+            [
+                [path, calls, f"{wall:.3f}", f"{cpu:.3f}", f"{peak_bytes / 2**20:.1f}"]
+                for path, calls, wall, cpu, peak_bytes in self.summary()
+            ],
+        )
+
+    def to_json(self, script):
+        return {
+            "format_version": PROFILE_FORMAT_VERSION,
+            "script": script,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(
+                timespec="seconds"
+            ),
+            "python": platform.python_version(),
+            "phases": [
+                {
+                    "path": path,
+                    "calls": calls,
+                    "wall_seconds": wall,
+                    "cpu_seconds": cpu,
+                    "peak_bytes": peak_bytes,
+                }
+                for path, calls, wall, cpu, peak_bytes in self.summary()
+            ],
+        }
+
+    def to_trace(self):
+        """
+        The phases in Chrome trace event format, complete ("X") events with times in
+        microseconds.
+        """
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": record.name,
+                    "cat": "phase",
+                    "ph": "X",
+                    "ts": record.start * 1e6,
+                    "dur": record.wall * 1e6,
+                    "pid": pid,
+                    "tid": 1,
+                    "args": {
+                        "path": record.path,
+                        "cpu_seconds": record.cpu,
+                        "peak_bytes": record.peak_bytes,
+                    },
+                }
+                for record in sorted(self.records, key=lambda record: record.start)
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+def _disable_in_child():
+    # Worker processes created by fork inherit the profiler, their phases would not be
+    # reported and tracing memory slows them down.
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_disable_in_child)
+
+
+def phase(name):
+    """
+    Context manager marking a named phase of the work, does nothing when profiling is
+    not enabled.
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.phase(name)
+
+
+_end = object()
+
+
+def phases(name, iterable):
+    """
+    Iterate over the iterable, each step is a named phase. Used for lazy iterables whose
+    items are produced when they are needed, e.g. the chunks of a file.
+    """
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            item = next(iterator, _end)
+        if item is _end:
+            return
+        yield item
+
+
+def add_profile_arguments(parser):
+    """
+    Add the profiling options to the argparse parser of a script.
+    """
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="record the wall time, CPU time and peak traced memory of each processing phase and print a summary table to stderr",  # noqa E501
+    )
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        help="write the profiled phases to this file, implies --profile",
+    )
+    parser.add_argument(
+        "--profile_format",
+        choices=PROFILE_FORMATS,
+        default="json",
+        help="format of the profile_output file, json summary or Chrome trace events (default: json)",
+    )
+
+
+@contextlib.contextmanager
+def profiling(args, script):
+    """
+    Profile the work done in the context if requested by the parsed command line arguments
+    (see add_profile_arguments). The whole context is the outermost phase, named after the
+    script. When the context exits the summary table is printed and the profile_output file
+    is written.
+    """
+    global _profiler
+    if not (args.profile or args.profile_output) or _profiler is not None:
+        yield
+        return
+    _profiler = profiler = Profiler()
+    try:
+        with profiler.phase(script):
+            yield
+    finally:
+        _profiler = None
+        profiler.stop()
+        print(profiler.summary_table(), file=sys.stderr)
+        if args.profile_output:
+            try:
+                with open(args.profile_output, "w") as fp:
+                    json.dump(
+                        profiler.to_trace()
+                        if args.profile_format == "trace"
+                        else profiler.to_json(script),
+                        fp,
+                        indent=4,
+                    )
+                    fp.write("\n")
+            except OSError as e:
+                print(f"Warning: failed to write profile ({e}).", file=sys.stderr)
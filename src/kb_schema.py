@@ -0,0 +1,242 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import collections
+import csv
+import dataclasses
+import functools
+import itertools
+import json
+import pathlib
+import warnings
+from kb_cache import hash_json
+
+"""
+The knowledge-base schema, compiled from the JSON configuration file (validate_data_config.json)
+and shared by all the scripts that read the roadmap.csv file or files with the same structure.
+
+The JSON configuration defines the list of expected column names, which columns are required to
+contain data, which optionally contain data and what are the valid values for specific columns.
+It also lists the columns which may contain multiple semicolon separated entries in the compact,
+multiple entries per row, format (see csv_multi_2_csv_single).
+Columns with a list of valid values are enumerated columns, they are read as pandas categorical
+columns. Repeated strings are stored once, and checking that the values are valid is done on the
+categories and not on every row.
+
+pandas is imported by the functions that use it and not when the module is imported, so that
+scripts which only load the schema (e.g. validate_data.py --engine=stdlib) do not import it.
+"""
+
+DEFAULT_CONFIG_FILE = pathlib.Path(__file__).parent / "validate_data_config.json"
+
+# Configuration entries which are not enumerated columns
+_COLUMN_LIST_KEYS = [
+    "data_required_column_names",
+    "data_optional_column_names",
+    "multi_entry_column_names",
+]
+
+# Columns listing the ORCIDs of the contributors agreeing/disagreeing with a configuration
+ORCID_COLUMN_NAMES = ["Agree", "Disagree"]
+
+
+@dataclasses.dataclass(frozen=True)
+class Schema:
+    required_column_names: frozenset
+    optional_column_names: frozenset
+    # Enumerated column name -> tuple of valid values
+    expected_values: dict
+    # Columns that may contain multiple entries in the multiple entries per row format
+    multi_entry_column_names: tuple = ()
+
+    @property
+    def column_names(self):
+        return self.required_column_names.union(self.optional_column_names)
+
+    @functools.cached_property
+    def fingerprint(self):
+        """
+        Hash of the schema content, identifies data derived using this schema.
+        """
+        return hash_json(
+            [
+                sorted(self.required_column_names),
+                sorted(self.optional_column_names),
+                self.expected_values,
+                self.multi_entry_column_names,
+            ]
+        )
+
+    @functools.cached_property
+    def categorical_dtypes(self):
+        """
+        Categorical dtypes whose categories are the valid values of the enumerated
+        columns. Converting a column to its dtype maps invalid values to nan.
+        """
+        import pandas as pd
+
+        return {
+            col_name: pd.CategoricalDtype(categories=values)
+            for col_name, values in self.expected_values.items()
+        }
+
+    @property
+    def read_dtypes(self):
+        """
+        The dtype argument for pandas.read_csv, enumerated columns are categorical
+        and all other columns are strings. The categories are inferred from the
+        file so that invalid values are retained and can be reported.
+        """
+        return collections.defaultdict(
+            lambda: str, {col_name: "category" for col_name in self.expected_values}
+        )
+
+
+def load_schema(json_config_file=DEFAULT_CONFIG_FILE):
+    """
+    Compile the JSON configuration file into a Schema.
+    """
+    with open(json_config_file) as fp:
+        # The configuration dictionary contains the list of columns that must contain
+        # data and those that may not contain data. All other elements in the dictionary
+        # correspond to column names and expected/valid data entry values for those columns.
+        configuration_dict = json.load(fp)
+    required_column_names = frozenset(configuration_dict["data_required_column_names"])
+    optional_column_names = frozenset(configuration_dict["data_optional_column_names"])
+    if required_column_names.intersection(optional_column_names):
+        raise ValueError(
+            f"Problem with JSON configuration file ({json_config_file}), {required_column_names.intersection(optional_column_names)} appear in both required and optional data columns."  # noqa E501
+        )
+    expected_values = {
+        # remove duplicate values, categories must be unique
+        k: tuple(dict.fromkeys(val))
+        for k, val in configuration_dict.items()
+        if k not in _COLUMN_LIST_KEYS
+    }
+    multi_entry_column_names = tuple(
+        configuration_dict.get("multi_entry_column_names", [])
+    )
+    return Schema(
+        required_column_names,
+        optional_column_names,
+        expected_values,
+        multi_entry_column_names,
+    )
+
+
+def _long_row_error(column_count, line, field_count):
+    """
+    ValueError for a csv row with more entries than the header, the same error
+    pandas.read_csv raises for long rows after the first data row.
+    """
+    return ValueError(
+        f"Error tokenizing data. C error: Expected {column_count} fields in line {line}, saw {field_count}\n"  # noqa E501
+    )
+
+
+def _check_row_lengths(rows, column_count, row_count=None):
+    """
+    Raise a ValueError for the first of the next row_count non blank rows (all the
+    rows if None) of the csv.reader rows with more entries than column_count.
+    """
+    for row in itertools.islice(filter(None, rows), row_count):
+        if len(row) > column_count:
+            raise _long_row_error(column_count, rows.line_num, len(row))
+
+
+def _checked_chunks(csv_file, chunks):
+    """
+    Iterate over the chunks of the pandas.read_csv reader. The rows of each chunk are
+    also read with the csv module and checked for extra entries, pandas drops the extra
+    entries of a long row when it is the first row of a chunk and does not report it.
+    """
+    import pandas as pd
+
+    with chunks, open(csv_file, encoding="utf-8-sig", newline="") as fp:
+        rows = csv.reader(fp)
+        column_count = len(next(filter(None, rows), []))
+        while True:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", pd.errors.ParserWarning)
+                try:
+                    df = next(chunks, None)
+                except (pd.errors.ParserWarning, pd.errors.ParserError):
+                    # report the first long row, which may precede the one pandas reports
+                    _check_row_lengths(rows, column_count)
+                    raise
+            if df is None:
+                return
+            _check_row_lengths(rows, column_count, len(df))
+            yield df
+
+
+def read_roadmap(csv_file, schema=None, **kwargs):
+    """
+    Read a roadmap csv file, or a file with the same structure, using the schema
+    dtypes. Entries that are "NA" are kept, they are not converted to nan. Additional
+    keyword arguments are passed to pandas.read_csv (e.g. chunksize).
+    The first column is never used as the index, rows with more entries than the header
+    raise a ValueError with their line number, also when the first data row or the first
+    row of a chunk is long.
+    """
+    import pandas as pd
+
+    if schema is None:
+        schema = load_schema()
+    with warnings.catch_warnings():
+        # with index_col=False pandas drops the extra entries of a long first data row
+        # and warns, instead of using the first column as the index
+        warnings.simplefilter("error", pd.errors.ParserWarning)
+        try:
+            data = pd.read_csv(
+                csv_file,
+                dtype=schema.read_dtypes,
+                keep_default_na=False,
+                index_col=False,
+                **kwargs,
+            )
+        except pd.errors.ParserWarning:
+            with open(csv_file, encoding="utf-8-sig", newline="") as fp:
+                rows = csv.reader(fp)
+                _check_row_lengths(rows, len(next(filter(None, rows), [])))
+            raise
+    if kwargs.get("chunksize"):
+        return _checked_chunks(csv_file, data)
+    return data
+
+
+def explode_orcids(column):
+    """
+    Split a column of semicolon separated ORCIDs into a series with one ORCID
+    per entry, indexed by the row the ORCID came from. Leading and trailing
+    whitespace is removed and empty entries are dropped.
+    """
+    orcids = column.fillna("").str.split(";").explode().str.strip()
+    return orcids[orcids != ""]
+
+
+def roadmap_orcids(df):
+    """
+    Exploded ORCID columns of the roadmap (see explode_orcids), a dictionary whose
+    keys are the column names and values are the exploded columns.
+    """
+    return {
+        col_name: explode_orcids(df[col_name])
+        for col_name in ORCID_COLUMN_NAMES
+        if col_name in df.columns
+    }
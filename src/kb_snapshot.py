@@ -0,0 +1,193 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import json
+import os
+import pathlib
+from kb_cache import hash_file
+from kb_schema import load_schema, read_roadmap, roadmap_orcids
+
+"""
+Binary snapshot of the knowledge-base roadmap. Parsing the roadmap.csv text file is the
+first step of every script, the snapshot stores the parsed roadmap, with its categorical
+columns (see kb_schema) and the exploded ORCID columns, as numpy arrays in a single .npz
+file.
+
+A snapshot is tagged with the hash of the csv file it was created from and the schema
+fingerprint, stored as JSON in the snapshot. When loading the roadmap, the JSON tag is
+read and checked first, and a current snapshot is used, otherwise the csv file is parsed
+and the snapshot is rebuilt. Snapshots are stored in the cache directory (see kb_cache)
+and can be deleted at any time. The cache directory is inside the repository, so the
+snapshot only contains plain arrays (strings, category codes and row indexes) and is
+loaded without pickle, a snapshot file cannot execute code when it is loaded.
+"""
+
+# Increment when the snapshot content format changes
+SNAPSHOT_FORMAT_VERSION = 2
+
+
+def snapshot_file_path(csv_file, cache_dir):
+    return pathlib.Path(cache_dir) / (pathlib.Path(csv_file).name + ".snapshot.npz")
+
+
+def _string_array(values):
+    import numpy as np
+
+    return np.array(list(values), dtype=str)
+
+
+def _object_values(array):
+    """
+    Strings of a numpy unicode array as an object array of python str, the dtype
+    pandas.read_csv uses for string columns.
+    """
+    import numpy as np
+
+    values = np.empty(len(array), dtype=object)
+    values[:] = array.tolist()
+    return values
+
+
+def write_snapshot(snapshot_path, tag, df, orcids):
+    """
+    Write the roadmap dataframe and its exploded ORCID columns to the snapshot file,
+    the tag (a JSON serializable dictionary) is stored with the column names and
+    types. Categorical columns are stored as their codes and categories, all other
+    columns as strings.
+    """
+    import numpy as np
+    import pandas as pd
+
+    arrays = {}
+    columns = []
+    for i, col_name in enumerate(df.columns):
+        column = df[col_name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            columns.append([col_name, "category"])
+            arrays[f"codes_{i}"] = column.cat.codes.to_numpy()
+            arrays[f"categories_{i}"] = _string_array(column.cat.categories)
+        else:
+            columns.append([col_name, "str"])
+            arrays[f"values_{i}"] = _string_array(column)
+    for i, (col_name, orcid_column) in enumerate(orcids.items()):
+        arrays[f"orcid_index_{i}"] = orcid_column.index.to_numpy(dtype=np.int64)
+        arrays[f"orcid_values_{i}"] = _string_array(orcid_column)
+    arrays["tag"] = np.array(
+        json.dumps(
+            {**tag, "columns": columns, "orcids": list(orcids), "rows": len(df)},
+            ensure_ascii=False,
+        )
+    )
+    tmp_snapshot_path = snapshot_path.with_name(
+        snapshot_path.name + f".{os.getpid()}.tmp"
+    )
+    with open(tmp_snapshot_path, "wb") as fp:
+        np.savez(fp, **arrays)
+    os.replace(tmp_snapshot_path, snapshot_path)
+
+
+def read_snapshot_tag(snapshot):
+    return json.loads(snapshot["tag"].item())
+
+
+def read_snapshot(snapshot, tag):
+    """
+    The roadmap dataframe and its exploded ORCID columns from the opened snapshot
+    (numpy.load of the .npz file) with the given tag.
+    """
+    import pandas as pd
+
+    columns = {}
+    for i, (col_name, col_type) in enumerate(tag["columns"]):
+        if col_type == "category":
+            columns[col_name] = pd.Categorical.from_codes(
+                snapshot[f"codes_{i}"],
+                categories=pd.Index(
+                    _object_values(snapshot[f"categories_{i}"]), dtype=object
+                ),
+            )
+        else:
+            columns[col_name] = _object_values(snapshot[f"values_{i}"])
+    df = pd.DataFrame(columns, index=pd.RangeIndex(tag["rows"]))
+    orcids = {
+        col_name: pd.Series(
+            _object_values(snapshot[f"orcid_values_{i}"]),
+            index=snapshot[f"orcid_index_{i}"],
+            name=col_name,
+            dtype=object,
+        )
+        for i, col_name in enumerate(tag["orcids"])
+    }
+    return df, orcids
+
+
+def load_roadmap(csv_file, schema=None, cache_dir=None):
+    """
+    Load the roadmap from the csv file or its snapshot in the cache_dir. If the
+    cache_dir is None, the csv file is always parsed and no snapshot is written.
+    Returns the roadmap dataframe and the exploded ORCID columns (see
+    kb_schema.roadmap_orcids).
+    """
+    import numpy as np
+
+    if schema is None:
+        schema = load_schema()
+    if cache_dir is None:
+        df = read_roadmap(csv_file, schema)
+        return df, roadmap_orcids(df)
+
+    snapshot_path = snapshot_file_path(csv_file, cache_dir)
+    stat = os.stat(csv_file)
+    csv_stat = [stat.st_mtime_ns, stat.st_size]
+    csv_hash = None
+    try:
+        # allow_pickle=False, object arrays are rejected and nothing is unpickled
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            tag = read_snapshot_tag(snapshot)
+            if (
+                tag["version"] == SNAPSHOT_FORMAT_VERSION
+                and tag["schema"] == schema.fingerprint
+            ):
+                # Only hash the csv file if its modification time or size changed
+                if tag["csv_stat"] != csv_stat:
+                    csv_hash = hash_file(csv_file)
+                if tag["csv_stat"] == csv_stat or tag["csv_hash"] == csv_hash:
+                    return read_snapshot(snapshot, tag)
+    except Exception:
+        # missing, outdated or corrupt snapshot, rebuild it
+        pass
+
+    df = read_roadmap(csv_file, schema)
+    orcids = roadmap_orcids(df)
+    try:
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        write_snapshot(
+            snapshot_path,
+            {
+                "version": SNAPSHOT_FORMAT_VERSION,
+                "schema": schema.fingerprint,
+                "csv_stat": csv_stat,
+                "csv_hash": csv_hash if csv_hash else hash_file(csv_file),
+            },
+            df,
+            orcids,
+        )
+    except OSError:
+        # the snapshot is an optimization, failing to write it is not an error
+        pass
+    return df, orcids
@@ -0,0 +1,386 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import argparse
+import collections
+import contextlib
+import csv
+import io
+import json
+import pathlib
+import random
+import sys
+from argparse_types import positive_int
+from kb_schema import DEFAULT_CONFIG_FILE, load_schema
+from csv_2_supporting import csv_2_supporting
+import kb_profile
+from ibex_kb import (
+    BIBLIOGRAPHY_FILE_NAME,
+    ROADMAP_FILE_NAME,
+    SUPPORTING_MATERIAL_DIR,
+    ZENODO_FILE_NAME,
+)
+
+"""
+This utility script creates a synthetic knowledge-base, used to measure how the scripts scale
+(see kb_benchmark.py). The knowledge-base has the repository layout (see ibex_kb.py) and is
+valid, it passes validate_data.py:
+1. roadmap.csv - each target has the given number of conjugates and each target_conjugate
+   pair has the given number of configurations (rows), all endorsed by a single contributor.
+2. .zenodo.json - the contributors, the given number of ORCIDs.
+3. docs/supporting_material - one file per target_conjugate pair, created from the roadmap
+   with csv_2_supporting.py.
+4. publications.bib - the given number of journal articles.
+5. roadmap_multi.csv - the roadmap with all the configurations of a target_conjugate pair in
+   a single row, the input of csv_multi_2_csv_single.py which converts it to roadmap.csv.
+
+The data is created using a pseudo-random generator with the given seed, the same arguments
+always create the same files. The column values are taken from the expected values listed in
+the JSON configuration file (see kb_schema). Scale 1, the default, is roughly the size of the
+knowledge-base at the time of writing (193 rows, 111 supporting material files, 8 publications),
+the number of targets, ORCIDs and publications is multiplied by the scale.
+"""
+
+SyntheticSize = collections.namedtuple(
+    "SyntheticSize",
+    ["targets", "conjugates", "orcids", "configurations", "publications"],
+)
+
+MULTI_ENTRY_ROADMAP_FILE_NAME = "roadmap_multi.csv"
+SHARED_REASONING = "Synthetic configurations, created by kb_synthetic.py.\n"
+
+# Columns of the roadmap.csv, in order
+ROADMAP_COLUMN_NAMES = [
+    "UniProt Accession Number",
+    "Target Name / Protein Biomarker",
+    "Antibody Name",
+    "Host Organism and Isotype",
+    "Clonality",
+    "Vendor",
+    "Catalog Number",
+    "Conjugate",
+    "RRID",
+    "Application",
+    "Method",
+    "Tissue Preservation",
+    "Tissue",
+    "Detergent",
+    "Antigen Retrieval Conditions",
+    "Dye Inactivation Conditions",
+    "Result",
+    "Agree",
+    "Disagree",
+]
+CONJUGATES = [
+    "AF488",
+    "AF532",
+    "AF555",
+    "AF594",
+    "AF647",
+    "AF700",
+    "BV421",
+    "eF450",
+    "eF570",
+    "eF660",
+    "FITC",
+    "PE",
+]
+TISSUES = [
+    "Human lymph node",
+    "Human jejunum",
+    "Human spleen",
+    "Human thymus",
+    "Human tonsil",
+    "Mouse lymph node",
+    "Mouse spleen",
+    "Mouse liver",
+]
+# Tissue preservation used with each application
+TISSUE_PRESERVATION = {"IHC-Fr": "1% PFA Fixed Frozen", "IHC-P": "FFPE"}
+SURNAMES = ["Smith", "Garcia", "Chen", "Kumar", "Okafor", "Novak", "Haddad", "Sato"]
+GIVEN_NAMES = ["Alex", "Dana", "Jordan", "Robin", "Sam", "Taylor", "Noa", "Kim"]
+
+
+def size_at_scale(scale):
+    """
+    Size of the synthetic knowledge-base at the given scale, scale 1 is roughly the size
+    of the knowledge-base at the time of writing.
+    """
+    return SyntheticSize(
+        targets=56 * scale,
+        conjugates=2,
+        orcids=4 * scale,
+        configurations=2,
+        publications=8 * scale,
+    )
+
+
+def orcid_check_digit(digits):
+    """
+    ISO 7064 11,2 check digit of the first 15 digits of an ORCID identifier.
+    """
+    total = 0
+    for digit in digits:
+        total = (total + int(digit)) * 2
+    check = (12 - total % 11) % 11
+    return "X" if check == 10 else str(check)
+
+
+def synthetic_orcid(number):
+    """
+    ORCID identifier with a valid check digit, in the 0000-0001 block.
+    """
+    digits = f"{10**7 + number:015d}"
+    identifier = digits + orcid_check_digit(digits)
+    return "-".join(identifier[i : i + 4] for i in range(0, 16, 4))  # noqa E203
+
+
+def synthetic_creators(orcid_count, rng):
+    return [
+        {
+            "affiliation": "Synthetic Institute",
+            "name": f"{rng.choice(SURNAMES)}{i + 1}, {rng.choice(GIVEN_NAMES)}",
+            "orcid": synthetic_orcid(i),
+            "email": f"contributor{i + 1}@example.org",
+        }
+        for i in range(orcid_count)
+    ]
+
+
+def synthetic_configurations(size, schema, creators, rng):
+    """
+    The rows of the roadmap, grouped by target_conjugate pair. The configurations of a pair
+    differ in the multiple entry columns, the other columns have the same value.
+    """
+    expected_values = schema.expected_values
+    conjugate_names = CONJUGATES + [
+        f"Dye{i + 1}" for i in range(max(0, size.conjugates - len(CONJUGATES)))
+    ]
+    applications = expected_values["Application"]
+    methods = expected_values["Method"]
+    pairs = []
+    for target_number in range(size.targets):
+        target = f"SYN{target_number + 1}"
+        uniprot = f"Q{target_number:05d}"
+        for conjugate in rng.sample(conjugate_names, size.conjugates):
+            pair = {
+                "UniProt Accession Number": uniprot,
+                "Target Name / Protein Biomarker": target,
+                "Antibody Name": f"{conjugate} anti-human {target} Antibody",
+                "Host Organism and Isotype": rng.choice(
+                    expected_values["Host Organism and Isotype"]
+                ),
+                "Clonality": f"C{rng.randrange(1, 1000)}",
+                "Vendor": rng.choice(expected_values["Vendor"]),
+                "Catalog Number": f"{rng.randrange(100000, 1000000)}",
+                "Conjugate": conjugate,
+                "RRID": f"AB_{rng.randrange(1000000, 10000000)}",
+                "Detergent": rng.choice(expected_values["Detergent"]),
+                "Result": "Success" if rng.random() < 0.9 else "Failure",
+                "Agree": rng.choice(creators)["orcid"],
+                "Disagree": "",
+            }
+            configurations = []
+            for i in range(size.configurations):
+                # the application, method and dye inactivation conditions are unique
+                # for each configuration
+                application = applications[i % len(applications)]
+                configurations.append(
+                    {
+                        "Application": application,
+                        "Method": methods[(i // len(applications)) % len(methods)],
+                        "Tissue Preservation": TISSUE_PRESERVATION[application],
+                        "Tissue": rng.choice(TISSUES),
+                        "Antigen Retrieval Conditions": "",
+                        "Dye Inactivation Conditions": f"{i // (len(applications) * len(methods)) + 1} mg/ml LiBH4 15 minutes",  # noqa E501
+                    }
+                )
+            pairs.append((pair, configurations))
+    return pairs
+
+
+def synthetic_bibliography(publication_count, rng):
+    entries = []
+    for i in range(publication_count):
+        year = 2015 + rng.randrange(10)
+        authors = " and ".join(
+            f"{rng.choice(SURNAMES)}, {rng.choice(GIVEN_NAMES)}"
+            for _ in range(rng.randrange(1, 6))
+        )
+        first_page = rng.randrange(1, 900)
+        entries.append(
+            f"@article{{synthetic{i + 1},\n"
+            + f"  title = {{Synthetic Study {i + 1} of Multiplexed Imaging}},\n"
+            + f"  author = {{{authors}}},\n"
+            + "  journal = {Journal of Synthetic Imaging},\n"
+            + f"  year = {{{year}}},\n"
+            + f"  volume = {{{rng.randrange(1, 40)}}},\n"
+            + f"  number = {{{rng.randrange(1, 13)}}},\n"
+            + f"  pages = {{{first_page}--{first_page + rng.randrange(5, 20)}}},\n"
+            + f"  doi = {{10.5555/synthetic.{i + 1}}},\n"
+            + "}\n"
+        )
+    return "\n".join(entries)
+
+
+def write_csv(file_path, column_names, rows):
+    with open(file_path, "w", newline="") as fp:
+        writer = csv.writer(fp, lineterminator="\n")
+        writer.writerow(column_names)
+        writer.writerows(rows)
+
+
+def synthetic_knowledge_base(
+    root_dir,
+    size=size_at_scale(1),
+    seed=0,
+    supporting_template_file=pathlib.Path(__file__).parent / "supporting_template.md",
+    json_config_file=DEFAULT_CONFIG_FILE,
+):
+    """
+    Create a synthetic knowledge-base with the given size in the root_dir, which is created
+    if it does not exist. Returns the number of roadmap rows.
+    """
+    schema = load_schema(json_config_file)
+    rng = random.Random(seed)
+    root_dir.mkdir(parents=True, exist_ok=True)
+
+    with kb_profile.phase("zenodo"):
+        creators = synthetic_creators(size.orcids, rng)
+        with open(root_dir / ZENODO_FILE_NAME, "w") as fp:
+            json.dump(
+                {
+                    "title": "Synthetic IBEX Knowledge-Base",
+                    "upload_type": "dataset",
+                    "creators": creators,
+                },
+                fp,
+                indent=4,
+            )
+            fp.write("\n")
+
+    with kb_profile.phase("roadmap"):
+        pairs = synthetic_configurations(size, schema, creators, rng)
+        write_csv(
+            root_dir / ROADMAP_FILE_NAME,
+            ROADMAP_COLUMN_NAMES,
+            (
+                [
+                    {**pair, **configuration}[col_name]
+                    for col_name in ROADMAP_COLUMN_NAMES
+                ]
+                for pair, configurations in pairs
+                for configuration in configurations
+            ),
+        )
+        write_csv(
+            root_dir / MULTI_ENTRY_ROADMAP_FILE_NAME,
+            ROADMAP_COLUMN_NAMES,
+            (
+                [
+                    "; ".join(
+                        configuration[col_name] for configuration in configurations
+                    ).strip("; ")
+                    if col_name in schema.multi_entry_column_names
+                    else pair[col_name]
+                    for col_name in ROADMAP_COLUMN_NAMES
+                ]
+                for pair, configurations in pairs
+            ),
+        )
+
+    with kb_profile.phase("supporting material"):
+        supporting_material_root_dir = root_dir / SUPPORTING_MATERIAL_DIR
+        supporting_material_root_dir.mkdir(parents=True, exist_ok=True)
+        shared_reasoning_file = root_dir / "shared_reasoning.md"
+        shared_reasoning_file.write_text(SHARED_REASONING)
+        with contextlib.redirect_stdout(io.StringIO()):
+            csv_2_supporting(
+                root_dir / ROADMAP_FILE_NAME,
+                supporting_material_root_dir,
+                supporting_template_file,
+                shared_reasoning_file,
+            )
+        shared_reasoning_file.unlink()
+
+    with kb_profile.phase("bibliography"):
+        with open(root_dir / BIBLIOGRAPHY_FILE_NAME, "w") as fp:
+            fp.write(synthetic_bibliography(size.publications, rng))
+    return len(pairs) * size.configurations
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Create a synthetic knowledge-base for benchmarking."
+    )
+    parser.add_argument(
+        "root_dir",
+        type=pathlib.Path,
+        help="knowledge-base root directory, created if it does not exist",
+    )
+    parser.add_argument(
+        "--scale",
+        type=positive_int,
+        default=1,
+        help="size relative to the knowledge-base at the time of writing, sets the default targets, orcids and publications",  # noqa E501
+    )
+    parser.add_argument("--targets", type=positive_int, help="number of targets")
+    parser.add_argument(
+        "--conjugates", type=positive_int, help="number of conjugates per target"
+    )
+    parser.add_argument(
+        "--orcids", type=positive_int, help="number of contributor ORCIDs"
+    )
+    parser.add_argument(
+        "--configurations",
+        type=positive_int,
+        help="number of configurations per supporting material file",
+    )
+    parser.add_argument(
+        "--publications", type=positive_int, help="number of publications"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the pseudo-random generator"
+    )
+    kb_profile.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    size = size_at_scale(args.scale)
+    size = size._replace(
+        **{
+            field: getattr(args, field)
+            for field in size._fields
+            if getattr(args, field) is not None
+        }
+    )
+    try:
+        with kb_profile.profiling(args, "kb_synthetic"):
+            row_count = synthetic_knowledge_base(args.root_dir, size, args.seed)
+    except Exception as e:
+        print(f"{e}", file=sys.stderr)
+        return 1
+    print(
+        f"Synthetic knowledge-base: {row_count} roadmap rows, {size.targets * size.conjugates} supporting material files, {size.publications} publications."  # noqa E501
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
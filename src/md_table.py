@@ -0,0 +1,248 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import io
+import math
+import functools
+
+try:
+    import wcwidth  # optional wide-character support, same as tabulate
+except ImportError:
+    wcwidth = None
+
+"""
+Markdown pipe table writer used by the scripts that generate markdown files from the roadmap.
+
+Two modes are supported:
+1. padded - columns are padded to a fixed width and aligned, the output is identical to
+   pandas.DataFrame.to_markdown(index=False) (tabulate's pipe format), except for cells that
+   contain pipe characters, see below. The widths depend on all the cells so the table is
+   formatted once all the rows were read.
+2. unpadded - cells are separated by pipes without padding, a valid GitHub/Jekyll markdown table
+   which is smaller and written row by row as the rows are read.
+
+In both modes pipe characters in cells are escaped, "\\|", so that they do not split the cell.
+tabulate does not escape them, a cell "x|y" is written as "x\\|y" and its column may be wider
+than in the to_markdown output.
+In unpadded mode line breaks in cells are replaced by "<br>". In padded mode tables with line
+breaks or terminal escape codes in their cells are formatted using tabulate.
+"""
+
+
+def _width(s):
+    """
+    Number of terminal columns used to display the string, same as tabulate.
+    """
+    if wcwidth is None or (s.isascii() and s.isprintable()):
+        return len(s)
+    return wcwidth.wcswidth(s)
+
+
+# Column types, ordered from least to most generic as in tabulate
+_TYPE_ORDER = {type(None): 0, bool: 1, int: 2, float: 3, str: 5}
+
+
+def _convertible(conv, value):
+    try:
+        conv(value)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def _string_type(value):
+    if value in ("True", "False"):
+        return bool
+    if _convertible(int, value):
+        return int
+    if _convertible(float, value):
+        number = float(value)
+        if math.isinf(number) or math.isnan(number):
+            return float if value.lower() in ["inf", "-inf", "nan"] else str
+        return float
+    return str
+
+
+def _value_type(value):
+    """
+    Least generic type of a cell value, strings containing numbers are numbers.
+    """
+    if value is None:
+        return type(None)
+    if isinstance(value, str):
+        return _string_type(value)
+    if hasattr(value, "isoformat"):
+        return str
+    if type(value) is bool:
+        return bool
+    if type(value) is int:
+        return int
+    if _convertible(float, value):
+        return float
+    return str
+
+
+def _afterpoint(string):
+    """
+    Number of characters after the decimal point (or exponent) of a number, -1 if the
+    string is not a number or has no decimal point.
+    """
+    if _value_type(string) is not float:
+        return -1
+    pos = string.rfind(".")
+    pos = string.lower().rfind("e") if pos < 0 else pos
+    return len(string) - pos - 1 if pos >= 0 else -1
+
+
+def _format_column(values):
+    """
+    Format the column values as strings according to the column type. Returns the strings
+    and the column alignment.
+    """
+    column_type = bool
+    for value in values:
+        value_type = _value_type(value)
+        if _TYPE_ORDER.get(value_type, 5) > _TYPE_ORDER[column_type]:
+            column_type = value_type
+            if column_type is str:
+                break
+    if column_type is float:
+        strings = ["" if v is None else format(float(v), "g") for v in values]
+    else:
+        strings = ["" if v is None else f"{v}" for v in values]
+    if column_type not in [int, float]:
+        return [s.strip() for s in strings], "left"
+    # align numbers on the decimal point
+    decimals = [_afterpoint(s) for s in strings]
+    max_decimals = max(decimals, default=-1)
+    return [s + (max_decimals - d) * " " for s, d in zip(strings, decimals)], "right"
+
+
+def _escape(value):
+    if isinstance(value, str) and "|" in value:
+        return value.replace("|", "\\|")
+    return value
+
+
+def _needs_tabulate(header, columns):
+    text = "".join(header) + "".join(
+        s for column in columns for s in column if isinstance(s, str)
+    )
+    return "\n" in text or "\r" in text or "\x1b" in text
+
+
+def _write_padded(fp, header, rows):
+    header = [str(h) for h in header]
+    rows = [[_escape(value) for value in row] for row in rows]
+    columns = [list(column) for column in zip(*rows)] if rows else []
+    if _needs_tabulate(header, columns):
+        import tabulate
+
+        fp.write(tabulate.tabulate(rows, header, tablefmt="pipe"))
+        return
+
+    widths = [_width(h) + 2 for h in header]
+    if columns:
+        formatted = [_format_column(column) for column in columns]
+        columns = [strings for strings, _ in formatted]
+        aligns = [align for _, align in formatted]
+        cell_widths = [[_width(s) for s in column] for column in columns]
+        widths = [max(w, max(cw)) for w, cw in zip(widths, cell_widths)]
+    else:
+        aligns = ["left"] * len(header)
+        cell_widths = []
+
+    def pad(s, s_width, width, align):
+        padding = " " * (width - s_width)
+        return padding + s if align == "right" else s + padding
+
+    def row_line(cells):
+        return ("| " + " | ".join(cells) + " |").rstrip()
+
+    fp.write(
+        row_line([pad(h, _width(h), w, a) for h, w, a in zip(header, widths, aligns)])
+    )
+    if columns:
+        segments = [
+            ("-" * (w + 1) + ":") if a == "right" else (":" + "-" * (w + 1))
+            for w, a in zip(widths, aligns)
+        ]
+    else:  # empty table, no alignment
+        segments = ["-" * (w + 2) for w in widths]
+    fp.write("\n|" + "|".join(segments) + "|")
+    padded_columns = [
+        [pad(s, s_width, w, a) for s, s_width in zip(column, column_widths)]
+        for column, column_widths, w, a in zip(columns, cell_widths, widths, aligns)
+    ]
+    for cells in zip(*padded_columns):
+        fp.write("\n" + row_line(cells))
+
+
+def _unpadded_cell(value):
+    if value is None:
+        return ""
+    value = f"{value}".strip()
+    if "\n" in value or "\r" in value:
+        value = "<br>".join(value.splitlines())
+    return _escape(value)
+
+
+def write_markdown_table(fp, header, rows, padded=True):
+    """
+    Write a markdown pipe table to the text file object, the header is a sequence of column
+    names and the rows an iterable of sequences of cell values. In unpadded mode the rows are
+    written as they are read from the iterable. The table does not end with a newline.
+    """
+    if padded:
+        _write_padded(fp, header, rows)
+        return
+    fp.write("| " + " | ".join(_unpadded_cell(h) for h in header) + " |\n")
+    fp.write("|" + "|".join("---" for _ in header) + "|")
+    for row in rows:
+        fp.write("\n| " + " | ".join(_unpadded_cell(value) for value in row) + " |")
+
+
+def markdown_table(header, rows, padded=True):
+    """
+    Markdown pipe table as a string (see write_markdown_table).
+    """
+    fp = io.StringIO()
+    write_markdown_table(fp, header, rows, padded)
+    return fp.getvalue()
+
+
+def write_dataframe(fp, df, padded=True):
+    """
+    Write the dataframe, without its index, as a markdown pipe table (see
+    write_markdown_table).
+    """
+    write_markdown_table(
+        fp, list(df.columns), df.itertuples(index=False, name=None), padded
+    )
+
+
+def dataframe_to_markdown(df, padded=True):
+    """
+    Dataframe, without its index, as a markdown pipe table. In padded mode the result is
+    the same as df.to_markdown(index=False), except that pipe characters in cells are
+    escaped.
+    """
+    fp = io.StringIO()
+    write_dataframe(fp, df, padded)
+    return fp.getvalue()
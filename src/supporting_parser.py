@@ -0,0 +1,266 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import collections
+import re
+import pathlib
+import argparse
+import sys
+import kb_profile
+
+"""
+Parser for the supporting material markdown files (supporting_material/target_conjugate/orcid.md).
+The files follow the structure defined by the supporting_template.md file:
+
+# Configurations
+
+| column name | column name | ... |
+|:------------|:------------|:----|
+| value       | value       | ... |
+
+# Reasoning
+
+<a name="reason1"></a>
+...
+
+# Additional Notes
+
+# Contributor ORCID
+
+orcid
+
+The file is scanned once, line by line, and the result is a lightweight SupportingMaterial
+record, the configurations table column names and rows are tuples of strings. Table cells may
+contain a pipe character if it is escaped, "\\|". Format errors are reported using a
+SupportingFormatError which includes the line and column (both one based) of the problem.
+
+The script can also be used to check the format of supporting material files, given files
+or directories (searched recursively for markdown files).
+"""
+
+SupportingMaterial = collections.namedtuple(
+    "SupportingMaterial",
+    ["columns", "rows", "reasoning_anchors", "contributor_orcid"],
+)
+
+CONFIGURATIONS_HEADING = "# Configurations"
+REASONING_HEADING = "# Reasoning"
+CONTRIBUTOR_ORCID_HEADING = "# Contributor ORCID"
+
+_UNESCAPED_PIPE = re.compile(r"(?<!\\)\|")
+_SEPARATOR_CELL = re.compile(r"^:?-+:?$")
+_ANCHOR = re.compile(r"""<a\s+name\s*=\s*["']([^"']*)["']""")
+
+
+class SupportingFormatError(ValueError):
+    def __init__(self, message, line, column=1, file_path=None):
+        self.message = message
+        self.line = line
+        self.column = column
+        self.file_path = file_path
+        super().__init__(str(self))
+
+    def __str__(self):
+        location = f"line {self.line}, column {self.column}"
+        if self.file_path is not None:
+            location = f"{self.file_path}, {location}"
+        return f"{location}: {self.message}"
+
+
+def split_table_row(line, line_number):
+    """
+    Split a markdown table row into its cells. The leading and trailing pipes are
+    optional and escaped pipes are part of the cell content. Returns a list of
+    (cell, column) tuples, where the cell is stripped of whitespace and the column
+    is the one based position of the cell's first character in the line.
+    """
+    if "\\|" in line:
+        boundaries = [m.start() for m in _UNESCAPED_PIPE.finditer(line)]
+    else:
+        boundaries = [i for i, c in enumerate(line) if c == "|"]
+    if not boundaries:
+        raise SupportingFormatError(
+            "expected a table row, no column separator '|' found",
+            line_number,
+            len(line) - len(line.lstrip()) + 1,
+        )
+    starts = [-1] + boundaries
+    ends = boundaries + [len(line)]
+    cells = []
+    for start, end in zip(starts, ends):
+        start += 1
+        cell = line[start:end]
+        stripped = cell.strip()
+        # column of the first non whitespace character, or of the cell if it is empty
+        column = start + 1 + (len(cell) - len(cell.lstrip()) if stripped else 0)
+        cells.append((stripped.replace("\\|", "|"), column))
+    # the leading and trailing pipes are optional, the text before the first and
+    # after the last pipe is only a cell if it isn't empty
+    if not cells[0][0]:
+        cells = cells[1:]
+    if cells and not cells[-1][0]:
+        cells = cells[:-1]
+    return cells
+
+
+def parse_supporting_text(text, file_path=None):
+    """
+    Parse the content of a supporting material file. Returns a SupportingMaterial,
+    raises a SupportingFormatError if the content does not match the expected format.
+    """
+    columns = None
+    rows = []
+    reasoning_anchors = []
+    contributor_orcid = None
+    # sections: None (before configurations, content is ignored), "header",
+    # "separator", "rows", "reasoning", "other", "orcid"
+    section = None
+    line_number = 0
+    try:
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped[0] == "#" and stripped[:2] == "# ":
+                if stripped == CONFIGURATIONS_HEADING:
+                    if section is not None:
+                        raise SupportingFormatError(
+                            f"repeated '{CONFIGURATIONS_HEADING}' section", line_number
+                        )
+                    section = "header"
+                    continue
+                if section is None:
+                    continue
+                if stripped == REASONING_HEADING:
+                    if section not in ["rows", "separator", "header"]:
+                        raise SupportingFormatError(
+                            f"repeated '{REASONING_HEADING}' section", line_number
+                        )
+                    if section != "rows":
+                        raise SupportingFormatError(
+                            "configurations table is missing or incomplete",
+                            line_number,
+                        )
+                    section = "reasoning"
+                    continue
+                if section in ["header", "separator"]:
+                    raise SupportingFormatError(
+                        "configurations table is missing or incomplete", line_number
+                    )
+                if section == "rows":
+                    raise SupportingFormatError(
+                        f"expected '{REASONING_HEADING}' section after the configurations table",
+                        line_number,
+                    )
+                section = "orcid" if stripped == CONTRIBUTOR_ORCID_HEADING else "other"
+                continue
+
+            if section == "header":
+                cells = split_table_row(line, line_number)
+                for cell, column in cells:
+                    if not cell:
+                        raise SupportingFormatError(
+                            "empty column name in table header", line_number, column
+                        )
+                columns = tuple(cell for cell, _ in cells)
+                section = "separator"
+            elif section == "separator":
+                cells = split_table_row(line, line_number)
+                if len(cells) != len(columns):
+                    raise SupportingFormatError(
+                        f"table delimiter row has {len(cells)} columns, header has {len(columns)}",
+                        line_number,
+                    )
+                for cell, column in cells:
+                    if not _SEPARATOR_CELL.match(cell):
+                        raise SupportingFormatError(
+                            f"invalid table delimiter row cell '{cell}'",
+                            line_number,
+                            column,
+                        )
+                section = "rows"
+            elif section == "rows":
+                cells = split_table_row(line, line_number)
+                if len(cells) != len(columns):
+                    raise SupportingFormatError(
+                        f"table row has {len(cells)} columns, header has {len(columns)}",
+                        line_number,
+                        # a row without cells, e.g. "|", is reported at its start
+                        cells[min(len(cells), len(columns)) - 1][1] if cells else 1,
+                    )
+                rows.append(tuple(cell for cell, _ in cells))
+            elif section == "reasoning":
+                if "<a" in line:
+                    reasoning_anchors.extend(_ANCHOR.findall(line))
+            elif section == "orcid":
+                if contributor_orcid is None:
+                    contributor_orcid = stripped
+        if section in [None, "header", "separator", "rows"]:
+            raise SupportingFormatError(
+                f"missing '{REASONING_HEADING}' section"
+                if section == "rows"
+                else f"missing '{CONFIGURATIONS_HEADING}' section or table",
+                line_number + 1,
+            )
+    except SupportingFormatError as e:
+        e.file_path = file_path
+        raise
+    return SupportingMaterial(columns, rows, reasoning_anchors, contributor_orcid)
+
+
+def parse_supporting_file(file_path):
+    """
+    Read and parse a supporting material file (see parse_supporting_text).
+    """
+    with open(file_path, "r", encoding="utf-8") as fp:
+        text = fp.read()
+    return parse_supporting_text(text, file_path)
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Check the format of supporting material markdown files."
+    )
+    parser.add_argument(
+        "paths",
+        type=pathlib.Path,
+        nargs="+",
+        help="supporting material files or directories",
+    )
+    kb_profile.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    res = 0
+    with kb_profile.profiling(args, "supporting_parser"):
+        for path in args.paths:
+            with kb_profile.phase("find files"):
+                md_file_paths = sorted(path.rglob("*.md")) if path.is_dir() else [path]
+            for md_file_path in md_file_paths:
+                try:
+                    with kb_profile.phase("parse supporting file"):
+                        parse_supporting_file(md_file_path)
+                except (OSError, UnicodeDecodeError, SupportingFormatError) as e:
+                    print(f"{e}", file=sys.stderr)
+                    res = 1
+    return res
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,60 @@
 import pytest
+import pandas as pd
+import numpy as np
 import pathlib
+import bibtexparser
 import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import threading
+import validate_data as validate_data_module
 from validate_data import validate_data
-from csv_roadmap_2_md_url import csv_2_md_with_url
+from csv_roadmap_2_md_url import csv_2_md_with_url, add_supporting_material_links
 from csv_2_supporting import csv_2_supporting
-from csv_multi_2_csv_single import csv_multi_2_csv_single
+from csv_multi_2_csv_single import (
+    csv_multi_2_csv_single,
+    csv_multi_2_csv_single_stream,
+)
+import bib2md
 from bib2md import bibfile2md
+import bib_parser
+from bib_parser import (
+    BibFormatError,
+    BibliographyError,
+    load_bibliography,
+    parse_bib_text,
+    sort_bibliography,
+)
+from bib_render import (
+    format_names,
+    parse_latex,
+    plain_text,
+    sentence_case,
+    to_markdown,
+    wrap,
+)
+from kb_schema import read_roadmap
+from md_table import dataframe_to_markdown, markdown_table
+from kb_snapshot import load_roadmap, snapshot_file_path
+import kb_snapshot
+import ibex_kb
+from ibex_kb import build
+from kb_synthetic import (
+    SyntheticSize,
+    orcid_check_digit,
+    synthetic_knowledge_base,
+    synthetic_orcid,
+)
+import kb_benchmark
+import kb_profile
+import validate_server
+from supporting_parser import (
+    parse_supporting_file,
+    parse_supporting_text,
+    SupportingFormatError,
+)
 
 
 class BaseTest:
@@ -78,6 +127,13 @@ class TestValidation(BaseTest):
                 "zenodo.json",
                 1,
             ),
+            (
+                "validate_data_config.json",
+                "multiple_errors.csv",
+                "supporting_material",
+                "zenodo.json",
+                1,
+            ),
         ],
     )
     def test_validate_data(
@@ -96,24 +152,447 @@ class TestValidation(BaseTest):
         )
         assert res == result
 
+    def test_validate_data_reports_all_problems(self, capsys):
+        res = validate_data(
+            "validate_data_config.json",
+            self.data_path / "multiple_errors.csv",
+            self.data_path / "supporting_material",
+            self.data_path / "zenodo.json",
+        )
+        assert res == 1
+        err = capsys.readouterr().err
+        assert "found 8 problem(s)" in err
+        assert (
+            "line 2: entry in column 6 (Vendor) contains preceding or trailing whitespace"
+            in err
+        )
+        assert "line 4: unexpected value in column titled Result" in err
+        assert "line 5: repeated row, same as line 3" in err
+
+    @pytest.mark.parametrize("csv_file_name", ["multiple_errors.csv", "roadmap.csv"])
+    def test_validate_data_chunks(self, csv_file_name, capsys):
+        # Reading the roadmap in chunks yields the same result as reading it at once
+        validate_args = [
+            "validate_data_config.json",
+            self.data_path / csv_file_name,
+            self.data_path / "supporting_material",
+            self.data_path / "zenodo.json",
+        ]
+        res = validate_data(*validate_args)
+        output = capsys.readouterr()
+        for chunk_size in [1, 2]:
+            assert validate_data(*validate_args, chunk_size=chunk_size) == res
+            assert capsys.readouterr() == output
+
+    @pytest.mark.parametrize(
+        "csv_file_name",
+        [
+            "roadmap.csv",
+            "contradictory_endorsement.csv",
+            "missing_required_data.csv",
+            "orcid_not_in_zenodo.csv",
+            "repeated_column_entry.csv",
+            "repeated_target_conjugate_row.csv",
+            "unexpected_value.csv",
+            "multiple_errors.csv",
+        ],
+    )
+    def test_validate_data_stdlib(self, csv_file_name, capsys):
+        # The stdlib engine reports the same problems as the pandas engine
+        validate_args = [
+            "validate_data_config.json",
+            self.data_path / csv_file_name,
+            self.data_path / "supporting_material",
+            self.data_path / "zenodo.json",
+        ]
+        res = validate_data(*validate_args)
+        output = capsys.readouterr()
+        assert validate_data(*validate_args, engine="stdlib") == res
+        assert capsys.readouterr() == output
+
+    @pytest.mark.parametrize(
+        "long_line, chunk_size",
+        [(2, None), (2, 1), (2, 2), (4, None), (4, 1), (4, 2), (4, 3)],
+    )
+    def test_validate_data_long_row(self, long_line, chunk_size, capsys, tmp_path):
+        # A row with an extra entry is reported with its line number, also when it is
+        # the first data row which pandas would otherwise use as the index and when it
+        # is the first row of a chunk
+        lines = (
+            (self.data_path / "multiple_errors.csv")
+            .read_text(encoding="utf-8-sig")
+            .splitlines()
+        )
+        lines[long_line - 1] += ",extra"
+        roadmap_csv = tmp_path / "roadmap.csv"
+        roadmap_csv.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        validate_args = [
+            "validate_data_config.json",
+            roadmap_csv,
+            self.data_path / "supporting_material",
+            self.data_path / "zenodo.json",
+        ]
+        assert validate_data(*validate_args, chunk_size=chunk_size) == 1
+        output = capsys.readouterr()
+        assert f"Expected 19 fields in line {long_line}, saw 20" in output.err
+        assert validate_data(*validate_args, engine="stdlib") == 1
+        assert capsys.readouterr() == output
+
+    def test_validate_data_stdlib_no_pandas(self):
+        # Neither --help nor the stdlib engine import pandas
+        script = (
+            "import sys, validate_data\n"
+            "res = validate_data.main(sys.argv[1:])\n"
+            "assert 'pandas' not in sys.modules\n"
+            "sys.exit(res)\n"
+        )
+        for args in [
+            ["--help"],
+            [
+                "validate_data_config.json",
+                str(self.data_path / "roadmap.csv"),
+                str(self.data_path / "supporting_material"),
+                str(self.data_path / "zenodo.json"),
+                "--no_cache",
+                "--engine",
+                "stdlib",
+            ],
+        ]:
+            result = subprocess.run(
+                [sys.executable, "-c", script] + args,
+                cwd=pathlib.Path(validate_data_module.__file__).parent,
+                capture_output=True,
+                text=True,
+            )
+            assert result.returncode == 0, result.stderr
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_validate_supporting_material_reports_all_problems(
+        self, jobs, capsys, tmp_path
+    ):
+        supporting_material_root_dir = tmp_path / "supporting_material"
+        shutil.copytree(
+            self.data_path / "supporting_material", supporting_material_root_dir
+        )
+        cd20_dir = supporting_material_root_dir / "CD20_AF488"
+        (cd20_dir / "0000-0003-0315-7727.md").unlink()
+        md_file_path = cd20_dir / "0000-0003-1495-9143.md"
+        md_file_path.write_text(
+            md_file_path.read_text().replace("IBEX2D Manual", "IBEX2D Automated")
+        )
+        res = validate_data(
+            "validate_data_config.json",
+            self.data_path / "roadmap.csv",
+            supporting_material_root_dir,
+            self.data_path / "zenodo.json",
+            jobs,
+        )
+        assert res == 1
+        err = capsys.readouterr().err
+        assert "found 2 problem(s)" in err
+        assert (
+            f"Missing expected supporting file {cd20_dir / '0000-0003-0315-7727.md'}"
+            in err
+        )
+        assert (
+            f"Supporting file {md_file_path} configurations table contains duplicate entry"
+            in err
+        )
+
+    def test_validate_data_cache(self, tmp_path, monkeypatch):
+        supporting_material_root_dir = tmp_path / "supporting_material"
+        shutil.copytree(
+            self.data_path / "supporting_material", supporting_material_root_dir
+        )
+        validate_args = [
+            "validate_data_config.json",
+            self.data_path / "roadmap.csv",
+            supporting_material_root_dir,
+            self.data_path / "zenodo.json",
+            1,
+            tmp_path / "cache",
+        ]
+        assert validate_data(*validate_args) == 0
+        assert (tmp_path / "cache" / "validate_data.json").is_file()
+
+        # Nothing changed, the supporting material files are not read again
+        def fail_read(md_file_path):
+            raise AssertionError(f"unexpected read of {md_file_path}")
+
+        monkeypatch.setattr(validate_data_module, "parse_supporting_file", fail_read)
+        assert validate_data(*validate_args) == 0
+        monkeypatch.undo()
+
+        # Modified file is validated again
+        md_file_path = (
+            supporting_material_root_dir / "CD20_AF488" / "0000-0003-1495-9143.md"
+        )
+        md_file_path.write_text(
+            md_file_path.read_text().replace("IBEX2D Manual", "IBEX2D Automated")
+        )
+        assert validate_data(*validate_args) == 1
+
+    @pytest.mark.parametrize("engine", ["pandas", "stdlib"])
+    def test_validate_data_since(self, engine, tmp_path):
+        def git(*args):
+            subprocess.run(
+                ["git", "-c", "user.name=test", "-c", "user.email=test@test"]
+                + list(args),
+                cwd=tmp_path,
+                check=True,
+                capture_output=True,
+            )
+
+        supporting_material_root_dir = tmp_path / "supporting_material"
+        shutil.copytree(
+            self.data_path / "supporting_material", supporting_material_root_dir
+        )
+        roadmap_csv = tmp_path / "roadmap.csv"
+        shutil.copy(self.data_path / "roadmap.csv", roadmap_csv)
+        # Commit an invalid supporting file, it isn't affected by later changes
+        md_file_path = (
+            supporting_material_root_dir / "CD20_AF488" / "0000-0003-1495-9143.md"
+        )
+        md_file_path.write_text(
+            md_file_path.read_text().replace("IBEX2D Manual", "IBEX2D Automated")
+        )
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "initial")
+        validate_args = [
+            "validate_data_config.json",
+            roadmap_csv,
+            supporting_material_root_dir,
+            self.data_path / "zenodo.json",
+        ]
+        assert validate_data(*validate_args, engine=engine) == 1
+        assert validate_data(*validate_args, since="HEAD", engine=engine) == 0
+        # Changing a roadmap row validates the supporting material of its target_conjugate
+        roadmap_csv.write_text(
+            roadmap_csv.read_text().replace("Human lymph node", "Human tonsil", 1)
+        )
+        assert validate_data(*validate_args, since="HEAD", engine=engine) == 1
+        assert validate_data(*validate_args, since="no_such_ref", engine=engine) == 1
+
+
+class PickleMarker:
+    """
+    Creates the marker file when it is unpickled.
+    """
+
+    def __init__(self, marker_path):
+        self.marker_path = marker_path
+
+    def __reduce__(self):
+        return (pathlib.Path.touch, (self.marker_path,))
+
+
+class TestSnapshot(BaseTest):
+    def test_load_roadmap(self, tmp_path, monkeypatch):
+        csv_file_path = tmp_path / "roadmap.csv"
+        shutil.copy(self.data_path / "roadmap.csv", csv_file_path)
+        cache_dir = tmp_path / "cache"
+        df, orcids = load_roadmap(csv_file_path, cache_dir=cache_dir)
+        assert snapshot_file_path(csv_file_path, cache_dir).is_file()
+
+        # Snapshot is current, the csv file is not parsed
+        def fail_read(*args, **kwargs):
+            raise AssertionError("unexpected csv parse")
+
+        monkeypatch.setattr(kb_snapshot, "read_roadmap", fail_read)
+        snapshot_df, snapshot_orcids = load_roadmap(csv_file_path, cache_dir=cache_dir)
+        assert snapshot_df.equals(df)
+        assert snapshot_df.dtypes.equals(df.dtypes)
+        for col_name in orcids:
+            assert snapshot_orcids[col_name].equals(orcids[col_name])
+        monkeypatch.undo()
+
+        # Modified csv file, snapshot is rebuilt
+        csv_file_path.write_text(
+            csv_file_path.read_text().replace("Human lymph node", "Human tonsil")
+        )
+        df, _ = load_roadmap(csv_file_path, cache_dir=cache_dir)
+        assert (df["Tissue"] == "Human tonsil").all()
+        assert load_roadmap(csv_file_path, cache_dir=cache_dir)[0].equals(df)
+
+    def test_load_roadmap_no_pickle(self, tmp_path):
+        # A snapshot containing pickled objects is not unpickled, the csv file is
+        # parsed and the snapshot is rebuilt
+        csv_file_path = tmp_path / "roadmap.csv"
+        shutil.copy(self.data_path / "roadmap.csv", csv_file_path)
+        cache_dir = tmp_path / "cache"
+        df, _ = load_roadmap(csv_file_path, cache_dir=cache_dir)
+        snapshot_path = snapshot_file_path(csv_file_path, cache_dir)
+        marker_path = tmp_path / "unpickled"
+        with np.load(snapshot_path) as snapshot:
+            arrays = dict(snapshot)
+        arrays["tag"] = np.array(
+            [PickleMarker(marker_path), arrays["tag"].item()], dtype=object
+        )
+        with open(snapshot_path, "wb") as fp:
+            np.savez(fp, **arrays)
+        assert load_roadmap(csv_file_path, cache_dir=cache_dir)[0].equals(df)
+        assert not marker_path.exists()
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            assert snapshot["tag"].dtype.kind == "U"
+
+
+class TestSupportingParser(BaseTest):
+    def test_parse_supporting_file(self):
+        record = parse_supporting_file(
+            self.data_path
+            / "supporting_material"
+            / "SPARC_AF532 (Custom-Thermo A20182)"
+            / "0000-0003-0315-7727.md"
+        )
+        assert len(record.columns) == 19
+        assert record.columns[-2:] == ("Agree", "Disagree")
+        assert len(record.rows) == 1
+        assert record.rows[0][1] == "SPARC"
+        assert record.rows[0][14] == ""
+        assert record.rows[0][17] == "[+](#reason1)"
+        assert record.reasoning_anchors == ["reason1"]
+        assert record.contributor_orcid == "0000-0003-0315-7727"
+
+    def test_escaped_pipe(self):
+        record = parse_supporting_text(
+            "# Configurations\n\n| a | b |\n|:--|:--|\n| x \\| y | z |\n\n# Reasoning\n"
+        )
+        assert record.columns == ("a", "b")
+        assert record.rows == [("x | y", "z")]
+        assert record.contributor_orcid is None
+
+    @pytest.mark.parametrize(
+        "text, line, column",
+        [
+            ("# Reasoning\n", 2, 1),
+            ("# Configurations\n\n| a | b |\n|:--|:--|\n| x |\n# Reasoning\n", 5, 3),
+            ("# Configurations\n\n| a | b |\n|:--|:--|\n|\n# Reasoning\n", 5, 1),
+            (
+                "# Configurations\n\n| a | b |\n|:--|:-x|\n| x | y |\n# Reasoning\n",
+                4,
+                6,
+            ),
+            ("# Configurations\n\n| a |  |\n", 3, 6),
+            ("# Configurations\n\n| a | b |\n|:--|:--|\n| x | y |\n# Notes\n", 6, 1),
+        ],
+    )
+    def test_format_errors(self, text, line, column):
+        with pytest.raises(SupportingFormatError) as e:
+            parse_supporting_text(text, "test.md")
+        assert (e.value.line, e.value.column) == (line, column)
+        assert str(e.value).startswith(f"test.md, line {line}, column {column}: ")
+
 
 class TestCSV2MD(BaseTest):
     @pytest.mark.parametrize(
         "csv_file_name, supporting_material_root_dir, result_md5hash",
-        [("roadmap.csv", "supporting_material", "1c640aeba06dc5a58790396fdbf5aa54")],
+        [("roadmap.csv", "supporting_material", "a4f94c60055b1294e5d8e1f42085a28c")],
     )
     def test_csv_2_md_with_url(
         self, csv_file_name, supporting_material_root_dir, result_md5hash
     ):
+        # links relative to the roadmap, the output does not depend on the data location
         csv_2_md_with_url(
             self.data_path / csv_file_name,
             self.data_path / supporting_material_root_dir,
+            link_root_dir=pathlib.Path(supporting_material_root_dir),
         )
         assert (
             self.files_md5([(self.data_path / csv_file_name).with_suffix(".md")])
             == result_md5hash
         )
 
+    def test_add_supporting_material_links(self):
+        df = pd.DataFrame(
+            {
+                "Target Name / Protein Biomarker": ["Rabbit IgG (H+L)", "β-3 Tubulin"],
+                "Conjugate": ["AF488", "AF 488"],
+                "Agree": ["0000-0001; 0000-0002 ;", " "],
+                "Disagree": ["", "0000-0003"],
+            }
+        )
+        df = add_supporting_material_links(df, "supporting material")
+        assert df["Agree"].tolist() == [
+            "[0000-0001](supporting%20material/Rabbit%20IgG%20%28H%2BL%29_AF488/0000-0001.md), "  # noqa E501
+            "[0000-0002](supporting%20material/Rabbit%20IgG%20%28H%2BL%29_AF488/0000-0002.md)",  # noqa E501
+            "",
+        ]
+        assert df["Disagree"].tolist() == [
+            "",
+            "[0000-0003](supporting%20material/%CE%B2-3%20Tubulin_AF%20488/0000-0003.md)",
+        ]
+
+    def test_csv_2_md_shards(self, tmp_path, capsys):
+        csv_file_path = tmp_path / "roadmap.csv"
+        shutil.copy(self.data_path / "roadmap.csv", csv_file_path)
+        supporting_material_root_dir = tmp_path / "supporting_material"
+        supporting_material_root_dir.mkdir()
+        md_args = [
+            csv_file_path,
+            supporting_material_root_dir,
+            tmp_path / "cache",
+            "Target Name / Protein Biomarker",
+        ]
+        csv_2_md_with_url(*md_args)
+        assert "3 created, 0 updated, 0 unchanged" in capsys.readouterr().out
+        index = (tmp_path / "roadmap.md").read_text()
+        assert "[CD20](roadmap/CD20.md)" in index
+        shard = (tmp_path / "roadmap" / "CD20.md").read_text()
+        assert "# CD20" in shard
+        assert "](../supporting_material/CD20_AF488/" in shard
+
+        csv_2_md_with_url(*md_args)
+        assert "0 created, 0 updated, 3 unchanged" in capsys.readouterr().out
+        # Only the page of the modified row is regenerated
+        csv_file_path.write_text(
+            csv_file_path.read_text().replace("IBEX2D Manual", "IBEX2D Automated")
+        )
+        csv_2_md_with_url(*md_args)
+        assert "0 created, 1 updated, 2 unchanged" in capsys.readouterr().out
+        # Pages of values that are no longer in the roadmap are removed
+        csv_2_md_with_url(*md_args[:-1], "Conjugate")
+        assert "2 removed" in capsys.readouterr().out
+
+
+class TestMarkdownTable(BaseTest):
+    @pytest.mark.parametrize(
+        "csv_file_name", ["roadmap.csv", "roadmap_multi.csv", "batch_supporting.csv"]
+    )
+    def test_padded_same_as_to_markdown(self, csv_file_name):
+        df = read_roadmap(self.data_path / csv_file_name)
+        assert dataframe_to_markdown(df) == df.to_markdown(index=False)
+
+    @pytest.mark.parametrize(
+        "header, rows",
+        [
+            (["a", "b"], [[1, 2.5], [10, 3]]),
+            (["a", "b"], [["1", "x"], ["2.25", "β-3 Tubulin"]]),
+            (["a", "b"], [[None, "True"], [3, "False"]]),
+            (["a", "b"], []),
+        ],
+    )
+    def test_padded_same_as_tabulate(self, header, rows):
+        tabulate = pytest.importorskip("tabulate")
+        assert markdown_table(header, rows) == tabulate.tabulate(
+            rows, header, tablefmt="pipe"
+        )
+
+    def test_padded_escapes_pipes(self):
+        # Unlike to_markdown (tabulate), pipe characters in cells are escaped
+        df = pd.DataFrame({"a": ["x|y", "1"], "b": ["z", "w"]})
+        assert dataframe_to_markdown(df) == (
+            "| a    | b   |\n|:-----|:----|\n| x\\|y | z   |\n| 1    | w   |"
+        )
+        assert df.to_markdown(index=False) == (
+            "| a   | b   |\n|:----|:----|\n| x|y | z   |\n| 1   | w   |"
+        )
+
+    def test_unpadded(self):
+        assert markdown_table(["a", "b"], [["x|y", " z "], ["1\n2", None]], False) == (
+            "| a | b |\n|---|---|\n| x\\|y | z |\n| 1<br>2 |  |"
+        )
+
 
 class TestCSV2Supporting(BaseTest):
     @pytest.mark.parametrize(
@@ -127,12 +606,14 @@ class TestCSV2Supporting(BaseTest):
             )
         ],
     )
+    @pytest.mark.parametrize("jobs", [1, 2])
     def test_csv_2_supporting(
         self,
         csv_file_name,
         supporting_template_file,
         shared_reasoning_file,
         result_md5hash,
+        jobs,
         tmp_path,
     ):
         # Write the output using the tmp_path fixture
@@ -141,9 +622,43 @@ class TestCSV2Supporting(BaseTest):
             tmp_path,
             self.data_path / supporting_template_file,
             self.data_path / shared_reasoning_file,
+            jobs,
         )
         assert self.files_md5(file_names) == result_md5hash
 
+    def test_csv_2_supporting_unchanged(self, tmp_path, capsys):
+        supporting_args = [
+            self.data_path / "batch_supporting.csv",
+            tmp_path / "supporting_material",
+            self.data_path / "supporting_template.md",
+            self.data_path / "shared_reasoning.md",
+            1,
+            tmp_path / "cache",
+        ]
+        # Dry run does not write any files
+        file_names = csv_2_supporting(*supporting_args, dry_run=True)
+        out = capsys.readouterr().out
+        assert f"create {file_names.iloc[0]}" in out
+        assert "2 created, 0 updated, 0 unchanged (dry run" in out
+        assert not (tmp_path / "supporting_material").exists()
+
+        file_names = csv_2_supporting(*supporting_args)
+        assert "2 created, 0 updated, 0 unchanged." in capsys.readouterr().out
+        mtimes = [file_name.stat().st_mtime_ns for file_name in file_names]
+
+        # Nothing changed, the files are not rewritten
+        csv_2_supporting(*supporting_args)
+        assert "0 created, 0 updated, 2 unchanged." in capsys.readouterr().out
+        assert [file_name.stat().st_mtime_ns for file_name in file_names] == mtimes
+
+        # Modified file is restored, with and without the manifest
+        file_names.iloc[0].write_text("modified")
+        csv_2_supporting(*supporting_args)
+        assert "0 created, 1 updated, 1 unchanged." in capsys.readouterr().out
+        file_names.iloc[0].write_text("modified")
+        csv_2_supporting(*supporting_args[:-1])
+        assert "0 created, 1 updated, 1 unchanged." in capsys.readouterr().out
+
 
 class TestCSVMulti2CSVSingle(BaseTest):
     @pytest.mark.parametrize(
@@ -167,6 +682,133 @@ class TestCSVMulti2CSVSingle(BaseTest):
         single_df.to_csv(output_file_path, index=False)
         assert self.files_md5([output_file_path]) == result_md5hash
 
+    def test_separators_only_entry(self, tmp_path):
+        csv_file_path = tmp_path / "roadmap_multi.csv"
+        csv_file_path.write_text(
+            (self.data_path / "roadmap_multi.csv")
+            .read_text()
+            .replace("Human jejunum; Human lymph node", " ; ", 1)
+        )
+        with pytest.raises(ValueError, match="only contain separators") as e:
+            csv_multi_2_csv_single(csv_file_path)
+        assert "2, Tissue" in str(e.value)
+
+    def test_csv_multi_2_csv_single_stream(self, tmp_path):
+        single_df = csv_multi_2_csv_single(self.data_path / "roadmap_multi.csv")
+        single_df.to_csv(tmp_path / "roadmap_single.csv", index=False)
+        csv_multi_2_csv_single_stream(
+            self.data_path / "roadmap_multi.csv", tmp_path / "roadmap_single_stream.csv"
+        )
+        assert self.files_md5([tmp_path / "roadmap_single.csv"]) == self.files_md5(
+            [tmp_path / "roadmap_single_stream.csv"]
+        )
+
+    def test_stream_error_line(self, tmp_path):
+        # The first row spans two lines, the error is in the second row
+        header, row = (self.data_path / "roadmap_multi.csv").read_text().splitlines()
+        lines = [
+            header,
+            row.replace("PE anti-human CD106 Antibody", '"PE\nanti-human CD106"', 1),
+            row.replace("Human jejunum; Human lymph node", ";", 1),
+        ]
+        csv_file_path = tmp_path / "roadmap_multi.csv"
+        csv_file_path.write_text("\n".join(lines) + "\n")
+        output_file_path = tmp_path / "roadmap_single.csv"
+        with pytest.raises(
+            ValueError,
+            match=r"line 4: entries only contain separators in column\(s\) Tissue$",
+        ):
+            csv_multi_2_csv_single_stream(csv_file_path, output_file_path)
+        assert not output_file_path.exists()
+
+
+class TestBibParser(BaseTest):
+    def test_parse_bib_text(self):
+        bib_file_path = self.data_path / "publications.bib"
+        parser = bibtexparser.bparser.BibTexParser(ignore_nonstandard_types=False)
+        with open(bib_file_path) as fp:
+            expected = bibtexparser.load(fp, parser).entries
+        entries = parse_bib_text(bib_file_path.read_text())
+        # same content and field order as bibtexparser
+        assert [list(entry.items()) for entry in entries] == [
+            list(entry.items()) for entry in expected
+        ]
+
+    def test_strings(self):
+        entries = parse_bib_text(
+            '@string{pn = "Proc. Natl."}\n'
+            '@Article{k1, Title = "A {B}" # { and } # pn, month = jan, year = 2020,}\n'
+            "@comment{not an entry}\n@online(k2, note = {two\n    lines})"
+        )
+        assert entries == [
+            {
+                "year": "2020",
+                "month": "January",
+                "title": "A {B} and Proc. Natl.",
+                "ENTRYTYPE": "article",
+                "ID": "k1",
+            },
+            {"note": "two\nlines", "ENTRYTYPE": "online", "ID": "k2"},
+        ]
+
+    @pytest.mark.parametrize(
+        "text, line",
+        [
+            ("@article{k1, title={x}}\n\n@article{k2, title={x}\n", 3),
+            ("\n@article{k 1, title={x}}", 2),
+            ("@article{k1, title=undefined}", 1),
+            ("@article{k1, title={x} year={2020}}", 1),
+        ],
+    )
+    def test_format_errors(self, text, line):
+        with pytest.raises(BibFormatError) as e:
+            parse_bib_text(text, "test.bib")
+        assert e.value.line == line
+        assert str(e.value).startswith(f"test.bib, line {line}: ")
+
+    def test_sort_bibliography(self, capsys):
+        entries = parse_bib_text(
+            "@article{a, author={B}, year={2020}, doi={10.1/X}}\n"
+            "@article{b, author={A}, year={2020}}\n"
+            "@misc{c, author={C}, year={2022}, doi={https://doi.org/10.1/x}}"
+        )
+        assert [entry["ID"] for entry in sort_bibliography(entries)] == ["c", "b", "a"]
+        assert "'c' has the same DOI as entry 'a'" in capsys.readouterr().err
+        with pytest.raises(BibliographyError) as e:
+            sort_bibliography(
+                parse_bib_text(
+                    "@article{a, author={A}}\n@article{b, year={2020}}\n"
+                    "@article{a, author={A}, year={n.d.}}"
+                )
+            )
+        assert e.value.problems == [
+            "entry 'a': missing year",
+            "entry 'b': missing author",
+            "duplicate citation key 'a'",
+            "entry 'a': year 'n.d.' is not a number",
+        ]
+
+    def test_load_bibliography_cache(self, tmp_path, monkeypatch):
+        bib_file_path = tmp_path / "publications.bib"
+        shutil.copy(self.data_path / "publications.bib", bib_file_path)
+        cache_dir = tmp_path / "cache"
+        entries = load_bibliography(bib_file_path, cache_dir)
+        parsed = []
+        parse_bib_record = bib_parser.parse_bib_record
+
+        def parse_bib_record_spy(record, strings):
+            parsed.append(record.key)
+            return parse_bib_record(record, strings)
+
+        monkeypatch.setattr(bib_parser, "parse_bib_record", parse_bib_record_spy)
+        assert load_bibliography(bib_file_path, cache_dir) == entries
+        assert parsed == []
+        # only the new entry is parsed
+        with open(bib_file_path, "a") as fp:
+            fp.write("\n@Article{new2023, author = {A. Author}, year = {2023}}\n")
+        assert load_bibliography(bib_file_path, cache_dir)[:-1] == entries
+        assert parsed == ["new2023"]
+
 
 class TestBib2MD(BaseTest):
     @pytest.mark.parametrize(
@@ -182,3 +824,438 @@ class TestBib2MD(BaseTest):
             output_file_path,
         )
         assert self.files_md5([output_file_path]) == result_md5hash
+
+    def mock_reference(self, citation_number, entry):
+        return f"\\[{citation_number}\\] {entry['ID']}, {plain_text(parse_latex(entry['title']))}, {entry['year']}"  # noqa E501
+
+    def mock_publications(self, entries):
+        """
+        The publications page rendered by the mock pandoc (see mock_pandoc).
+        """
+        references = [
+            self.mock_reference(i, entry) for i, entry in enumerate(entries, start=1)
+        ]
+        return "\n\n".join(["# Publications"] + references) + "\n"
+
+    def mock_pandoc(self, monkeypatch, reverse=False):
+        """
+        Replace pandoc with a function rendering the entry IDs, titles and years,
+        returns the list of pandoc calls, each call is the list of rendered entry IDs.
+        If reverse, the references are listed in reverse order, as a csl file which
+        sorts the bibliography would.
+        """
+        calls = []
+
+        def pandoc_render(entries, citation_style_language_file):
+            calls.append([entry["ID"] for entry in entries])
+            return self.mock_publications(entries[::-1] if reverse else entries)
+
+        monkeypatch.setattr(bib2md, "pandoc_render", pandoc_render)
+        monkeypatch.setattr(bib2md, "pandoc_version", lambda: "pandoc 0")
+        return calls
+
+    def bibliography(self, bib_file_path, *entry_ids):
+        entries = {entry["ID"]: entry for entry in load_bibliography(bib_file_path)}
+        return [entries[entry_id] for entry_id in entry_ids]
+
+    def test_bib_2_md_jobs(self, tmp_path, monkeypatch):
+        calls = self.mock_pandoc(monkeypatch)
+        output_file_path = tmp_path / "publications.md"
+        bibfile2md(
+            self.data_path / "publications.bib",
+            self.data_path / "ieee.csl",
+            output_file_path,
+            jobs=2,
+        )
+        assert sorted(calls) == [["radtke2020"], ["radtke2022"]]
+        assert output_file_path.read_text() == self.mock_publications(
+            self.bibliography(
+                self.data_path / "publications.bib", "radtke2022", "radtke2020"
+            )
+        )
+
+    def test_bib_2_md_cache(self, tmp_path, monkeypatch):
+        calls = self.mock_pandoc(monkeypatch)
+        bib_file_path = tmp_path / "publications.bib"
+        shutil.copy(self.data_path / "publications.bib", bib_file_path)
+        output_file_path = tmp_path / "publications.md"
+        args = [
+            bib_file_path,
+            self.data_path / "ieee.csl",
+            output_file_path,
+            tmp_path / "cache",
+        ]
+        bibfile2md(*args)
+        assert calls == [["radtke2022", "radtke2020"]]
+        expected = self.mock_publications(
+            self.bibliography(bib_file_path, "radtke2022", "radtke2020")
+        )
+        assert output_file_path.read_text() == expected
+        # Nothing is rendered when the bibliography did not change
+        calls.clear()
+        bibfile2md(*args)
+        assert calls == []
+        assert output_file_path.read_text() == expected
+        # Only the new entry is rendered, the cached entries are renumbered
+        with open(bib_file_path, "a") as fp:
+            fp.write(
+                "\n@Article{new2023, author = {A. Author}, title = {T}, year = {2023}}\n"
+            )
+        bibfile2md(*args)
+        assert calls == [["new2023"]]
+        assert output_file_path.read_text() == self.mock_publications(
+            self.bibliography(bib_file_path, "new2023", "radtke2022", "radtke2020")
+        )
+
+    def test_bib_2_md_cache_sorting_csl(self, tmp_path, monkeypatch):
+        # The references are not in the order of the entries, they are not cached and
+        # the whole bibliography is rendered
+        calls = self.mock_pandoc(monkeypatch, reverse=True)
+        output_file_path = tmp_path / "publications.md"
+        args = [
+            self.data_path / "publications.bib",
+            self.data_path / "ieee.csl",
+            output_file_path,
+            tmp_path / "cache",
+        ]
+        expected = self.mock_publications(
+            self.bibliography(
+                self.data_path / "publications.bib", "radtke2020", "radtke2022"
+            )
+        )
+        bibfile2md(*args)
+        assert calls == [["radtke2022", "radtke2020"], ["radtke2022", "radtke2020"]]
+        assert output_file_path.read_text() == expected
+        calls.clear()
+        bibfile2md(*args)
+        assert len(calls) == 2
+        assert output_file_path.read_text() == expected
+
+    def test_bib_2_md_python_engine(self, tmp_path, monkeypatch):
+        calls = self.mock_pandoc(monkeypatch)
+        output_file_path = tmp_path / "publications.md"
+        bibfile2md(
+            self.data_path / "publications.bib",
+            self.data_path / "ieee.csl",
+            output_file_path,
+            engine="python",
+        )
+        assert calls == []
+        assert self.files_md5([output_file_path]) == "e870495322178490d51a33661ea47b7e"
+
+    @pytest.mark.parametrize(
+        "authors, result",
+        [
+            ("Smith, John and Doe, Jane", "J. Smith and J. Doe"),
+            (
+                "van Doremalen, Neeltje and Jean-Pierre Dupont and Smith, Jr., John",
+                "N. van Doremalen, J.-P. Dupont, and J. Smith Jr.",
+            ),
+            (
+                "{World Health Organization} and P{\\'{e}}rez, Luis",
+                "World Health Organization and L. Pérez",
+            ),
+        ],
+    )
+    def test_format_names(self, authors, result):
+        assert format_names(authors) == result
+
+    @pytest.mark.parametrize(
+        "title, result",
+        [
+            (
+                "Spatial Mapping of Protein Composition",
+                "Spatial mapping of protein composition",
+            ),
+            (
+                "{IBEX}: A Versatile Approach for {McDonald} DNA",
+                "IBEX: A versatile approach for McDonald DNA",
+            ),
+            (
+                "Age-Related Differences in SARS-CoV-2",
+                "Age-related differences in SARS-CoV-2",
+            ),
+            ("\\emph{In Situ} Imaging of a_b", "*In situ* imaging of a\\_b"),
+        ],
+    )
+    def test_sentence_case(self, title, result):
+        assert to_markdown(sentence_case(parse_latex(title))) == result
+
+    def test_wrap(self):
+        assert wrap("a " * 40 + "b\nc", width=10) == ("a a a a a\n" * 8 + "b  \nc")
+
+
+class TestIbexKB(BaseTest):
+    def knowledge_base(self, root_dir, roadmap_csv="roadmap.csv"):
+        """
+        Create a knowledge-base with the repository layout from the test data.
+        """
+        (root_dir / "docs").mkdir()
+        shutil.copytree(
+            self.data_path / "supporting_material",
+            root_dir / "docs" / "supporting_material",
+        )
+        shutil.copy(self.data_path / roadmap_csv, root_dir / "roadmap.csv")
+        shutil.copy(self.data_path / "zenodo.json", root_dir / ".zenodo.json")
+        shutil.copy(self.data_path / "publications.bib", root_dir / "publications.bib")
+        return root_dir
+
+    def test_build(self, tmp_path, monkeypatch):
+        root_dir = self.knowledge_base(tmp_path)
+        read_count = []
+        read_roadmap = kb_snapshot.read_roadmap
+
+        def read_roadmap_spy(*args, **kwargs):
+            read_count.append(1)
+            return read_roadmap(*args, **kwargs)
+
+        monkeypatch.setattr(kb_snapshot, "read_roadmap", read_roadmap_spy)
+        assert build(root_dir, engine="python") == 0
+        # the roadmap is read once and shared by the stages
+        assert len(read_count) == 1
+        # same result as the scripts
+        roadmap_md = (root_dir / "docs" / "roadmap.md").read_text()
+        publications_md = (root_dir / "docs" / "publications.md").read_text()
+        monkeypatch.chdir(root_dir)
+        csv_2_md_with_url(
+            pathlib.Path("roadmap.csv"), pathlib.Path("docs/supporting_material")
+        )
+        assert (root_dir / "docs" / "roadmap.md").read_text() == roadmap_md
+        bibfile2md(
+            root_dir / "publications.bib",
+            ibex_kb.CSL_FILE,
+            tmp_path / "publications.md",
+            engine="python",
+        )
+        assert (tmp_path / "publications.md").read_text() == publications_md
+
+    def test_build_stages(self, tmp_path, capsys):
+        root_dir = self.knowledge_base(tmp_path, "contradictory_endorsement.csv")
+        assert build(root_dir, engine="python") == 1
+        assert capsys.readouterr().out.splitlines() == [
+            "validate: failed",
+            "roadmap: skipped",
+            "publications: ok",
+        ]
+        assert not (root_dir / "docs" / "roadmap.md").exists()
+        assert build(root_dir, ["roadmap"]) == 0
+        assert (root_dir / "docs" / "roadmap.md").exists()
+
+
+class TestKBSynthetic(BaseTest):
+    def test_synthetic_knowledge_base(self, tmp_path):
+        # more configurations than unique application and method combinations
+        size = SyntheticSize(
+            targets=3, conjugates=2, orcids=2, configurations=7, publications=3
+        )
+        root_dir = tmp_path / "kb"
+        assert synthetic_knowledge_base(root_dir, size, seed=1) == 42
+        assert build(root_dir, engine="python") == 0
+        assert (
+            len(list((root_dir / "docs" / "supporting_material").glob("*/*.md"))) == 6
+        )
+        # the multiple entries per row roadmap is converted to the roadmap
+        csv_multi_2_csv_single(root_dir / "roadmap_multi.csv").to_csv(
+            tmp_path / "roadmap_single.csv", index=False
+        )
+        assert self.files_md5([tmp_path / "roadmap_single.csv"]) == self.files_md5(
+            [root_dir / "roadmap.csv"]
+        )
+        # same seed, same files
+        synthetic_knowledge_base(tmp_path / "kb2", size, seed=1)
+        file_paths = [
+            file_path
+            for file_path in (tmp_path / "kb2").rglob("*")
+            if file_path.is_file()
+        ]
+        assert len(file_paths) == 10
+        for file_path in file_paths:
+            assert (
+                file_path.read_bytes()
+                == (root_dir / file_path.relative_to(tmp_path / "kb2")).read_bytes()
+            )
+
+    def test_synthetic_orcid(self):
+        # ORCID documentation example, 0000-0002-1825-0097
+        assert orcid_check_digit("000000021825009") == "7"
+        assert synthetic_orcid(0) == "0000-0001-0000-0009"
+
+
+class TestKBBenchmark(BaseTest):
+    def test_benchmark(self, tmp_path, capsys):
+        report_file = tmp_path / "benchmark.json"
+        argv = [str(report_file), "--scales", "1", "--no_memory"]
+        assert kb_benchmark.main(argv) == 0
+        with open(report_file) as fp:
+            report = json.load(fp)
+        assert [entry["scale"] for entry in report["scales"]] == [1]
+        results = report["scales"][0]["results"]
+        assert list(results) == kb_benchmark.BENCHMARKS
+        assert all(
+            result["succeeded"] and result["peak_bytes"] is None
+            for result in results.values()
+        )
+        # compare to itself
+        assert kb_benchmark.main(argv + ["--baseline", str(report_file)]) == 0
+        assert "1x bibfile2md: time x" in capsys.readouterr().out
+
+    def test_compare_reports(self):
+        def report(seconds, peak_bytes):
+            return {
+                "scales": [
+                    {
+                        "scale": 10,
+                        "results": {
+                            "validate_data": {
+                                "seconds": seconds,
+                                "peak_bytes": peak_bytes,
+                            }
+                        },
+                    }
+                ]
+            }
+
+        assert kb_benchmark.compare_reports(report(3.0, 100), report(2.0, 200)) == [
+            (10, "validate_data", 1.5, 0.5)
+        ]
+        assert kb_benchmark.compare_reports(report(3.0, None), report(2.0, 200)) == [
+            (10, "validate_data", 1.5, None)
+        ]
+
+
+class TestKBProfile(BaseTest):
+    def validate_argv(self, *profile_args):
+        return [
+            str(pathlib.Path(__file__).parent.parent / "validate_data_config.json"),
+            str(self.data_path / "roadmap.csv"),
+            str(self.data_path / "supporting_material"),
+            str(self.data_path / "zenodo.json"),
+            "--no_cache",
+        ] + list(profile_args)
+
+    def test_profile_json(self, tmp_path, capsys):
+        profile_file = tmp_path / "profile.json"
+        assert (
+            validate_data_module.main(
+                self.validate_argv("--profile_output", str(profile_file))
+            )
+            == 0
+        )
+        # summary table
+        assert "| validate_data/whitespace check " in capsys.readouterr().err
+        with open(profile_file) as fp:
+            profile = json.load(fp)
+        phases = {phase["path"]: phase for phase in profile["phases"]}
+        assert profile["script"] == "validate_data"
+        assert list(phases)[0] == "validate_data"
+        for path in [
+            "validate_data/read roadmap",
+            "validate_data/ORCID checks",
+            "validate_data/orphan scan",
+        ]:
+            assert phases[path]["calls"] == 1
+        # each supporting material file is parsed
+        assert (
+            phases["validate_data/supporting material/parse supporting file"]["calls"]
+            == 4
+        )
+        # a phase's peak memory includes that of the phases it contains
+        assert phases["validate_data"]["peak_bytes"] == max(
+            phase["peak_bytes"] for phase in profile["phases"]
+        )
+
+    def test_profile_trace(self, tmp_path, capsys):
+        profile_file = tmp_path / "profile.json"
+        argv = self.validate_argv(
+            "--profile_output", str(profile_file), "--profile_format", "trace"
+        )
+        assert validate_data_module.main(argv) == 0
+        with open(profile_file) as fp:
+            events = json.load(fp)["traceEvents"]
+        assert events[0]["name"] == "validate_data"
+        assert all(event["ph"] == "X" for event in events)
+        # the phases are contained in the script's event
+        assert all(
+            events[0]["ts"] <= event["ts"]
+            and event["ts"] + event["dur"] <= events[0]["ts"] + events[0]["dur"]
+            for event in events[1:]
+        )
+
+    def test_no_profile(self, capsys):
+        assert validate_data_module.main(self.validate_argv()) == 0
+        assert capsys.readouterr().err == ""
+        # phases do nothing when profiling is not enabled
+        with kb_profile.phase("phase"):
+            pass
+        assert kb_profile._profiler is None
+
+
+class TestValidateServer(BaseTest):
+    def test_validate_server(self, tmp_path, capsys, monkeypatch):
+        supporting_material_root_dir = tmp_path / "supporting_material"
+        shutil.copytree(
+            self.data_path / "supporting_material", supporting_material_root_dir
+        )
+        roadmap_csv = tmp_path / "roadmap.csv"
+        shutil.copy(self.data_path / "roadmap.csv", roadmap_csv)
+        socket_path = tmp_path / "validate.sock"
+        validate_argv = [
+            "validate",
+            "--socket",
+            str(socket_path),
+            "validate_data_config.json",
+            str(roadmap_csv),
+            str(supporting_material_root_dir),
+            str(self.data_path / "zenodo.json"),
+            "--no_cache",
+        ]
+        server = validate_server.create_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            # The server returns the same exit code and output as validate_data
+            for csv_file_name in ["roadmap.csv", "multiple_errors.csv"]:
+                argv = (
+                    validate_argv[:4]
+                    + [str(self.data_path / csv_file_name)]
+                    + validate_argv[5:]
+                )
+                res = validate_data_module.main(argv[3:])
+                output = capsys.readouterr()
+                assert validate_server.main(argv) == res
+                assert capsys.readouterr() == output
+
+            assert validate_server.main(validate_argv) == 0
+
+            # Nothing changed, the supporting material files are not read again
+            def fail_read(md_file_path):
+                raise AssertionError(f"unexpected read of {md_file_path}")
+
+            monkeypatch.setattr(
+                validate_data_module, "parse_supporting_file", fail_read
+            )
+            assert validate_server.main(validate_argv) == 0
+            monkeypatch.undo()
+
+            # Modified files are read again
+            md_file_path = (
+                supporting_material_root_dir / "CD20_AF488" / "0000-0003-1495-9143.md"
+            )
+            text = md_file_path.read_text()
+            md_file_path.write_text(text.replace("IBEX2D Manual", "IBEX2D Automated"))
+            assert validate_server.main(validate_argv) == 1
+            md_file_path.write_text(text)
+            assert validate_server.main(validate_argv) == 0
+            roadmap_csv.write_text(
+                roadmap_csv.read_text().replace("Human lymph node", "Human tonsil", 1)
+            )
+            assert validate_server.main(validate_argv) == 1
+        finally:
+            assert validate_server.main(["stop", "--socket", str(socket_path)]) == 0
+            thread.join()
+            server.server_close()
+        capsys.readouterr()
+
+        # Without the server the client validates the knowledge-base itself
+        assert validate_server.main(validate_argv) == 1
+        assert "Warning: validation server is not running" in capsys.readouterr().err
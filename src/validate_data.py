@@ -16,13 +16,21 @@
 #
 # =========================================================================
 
-import pandas as pd
-import numpy as np
 import sys
 import pathlib
 import json
+import io
+import hashlib
+import subprocess
 import argparse
-from argparse_types import file_path, dir_path
+import itertools
+from argparse_types import file_path, dir_path, positive_int
+from kb_schema import load_schema, read_roadmap, roadmap_orcids
+from kb_snapshot import load_roadmap
+from kb_cache import ValidationCache, CACHE_DIR_NAME, default_cache_dir, hash_file
+from supporting_parser import parse_supporting_file, SupportingFormatError
+from kb_parallel import process_map
+import kb_profile
 
 """
 This script validates the IBEX knowledge-base comma-separated-value roadmap file based on the
@@ -44,43 +52,50 @@ Additional checks include:
  3. The same ORCID does not appear multiple times in the same column (one person, one vote).
  4. The content of the supporting material files is consistent with the roadmap.
  5. No superfluous markdown files found in the supporting material directories, nothing additional to the roadmap.
+
+The roadmap checks are performed on whole columns and do not stop at the first problem. All
+problems are reported together, each one with the line number of the offending row in the csv file.
+
+Two engines perform the roadmap checks (--engine):
+1. pandas - column operations on the roadmap dataframe, supports reading the roadmap in chunks
+   and the roadmap snapshot (see kb_snapshot).
+2. stdlib - the roadmap is streamed with the csv module and checked row by row (see
+   validate_stdlib.py). Both engines report the same problems, the stdlib engine does not import
+   pandas which makes it faster for small roadmaps and incremental (--since) validation.
+pandas is only imported when it is used, so that --help, argument errors and the stdlib engine
+do not pay for importing it.
 """
 
 
 def validate_data(
-    json_config_file, roadmap_csv, supporting_material_root_dir, zenodo_json
+    json_config_file,
+    roadmap_csv,
+    supporting_material_root_dir,
+    zenodo_json,
+    jobs=1,
+    cache_dir=None,
+    since=None,
+    chunk_size=None,
+    roadmap=None,
+    engine="pandas",
+    cache=None,
 ):
-
-    with open(json_config_file) as fp:
-        try:
-            # The configuration dictionary contains the list of columns that must contain
-            # data and those that may not contain data. All other elements in the dictionary
-            # correspond to column names and expected/valid data entry values for those columns.
-            configuration_dict = json.load(fp)
-            required_column_names = set(
-                configuration_dict["data_required_column_names"]
-            )
-            optional_column_names = set(
-                configuration_dict["data_optional_column_names"]
-            )
-            if required_column_names.intersection(optional_column_names):
-                raise ValueError(
-                    "Problem with JSON configuration file ({json_config_file}), {required_column_names} appear in both required and optional data columns."  # noqa E501
-                )
-            expected_values = {}
-            for k, val in configuration_dict.items():
-                if k not in [
-                    "data_required_column_names",
-                    "data_optional_column_names",
-                ]:
-                    expected_values[k] = set(val)
-        except Exception as e:
-            print(
-                f"Problem reading JSON configuration file ({json_config_file}): {e}.",
-                file=sys.stderr,
-            )
-            return 1
-    with open(zenodo_json) as fp:
+    """
+    Validate the knowledge-base, the problems found are printed. Returns 0 if the
+    knowledge-base is valid, otherwise 1. The validation cache is loaded from and saved to
+    the cache_dir. A long running caller keeps the cache in memory and gives it as the
+    cache (see validate_server.py), it is used instead of the cache_dir and is not saved.
+    """
+    try:
+        with kb_profile.phase("read configuration"):
+            schema = load_schema(json_config_file)
+    except Exception as e:
+        print(
+            f"Problem reading JSON configuration file ({json_config_file}): {e}.",
+            file=sys.stderr,
+        )
+        return 1
+    with open(zenodo_json) as fp, kb_profile.phase("read zenodo"):
         try:
             zenodo_dict = json.load(fp)
             # Get list of ORCIDs
@@ -103,21 +118,46 @@ def validate_data(
             )
             return 1
 
-    try:
-        supporting_md_files = read_and_validate_csv(
-            file_path=roadmap_csv,
-            data_required_column_names=required_column_names,
-            data_optional_column_names=optional_column_names,
-            expected_values=expected_values,
-            creator_orcids=creator_orcids,
-            material_root_dir=supporting_material_root_dir,
+    save_cache = cache is None and cache_dir
+    if save_cache:
+        cache = ValidationCache(
+            cache_dir, validation_cache_salt(json_config_file, zenodo_json)
         )
-        all_files_in_supporting_material = [
-            p
-            for p in supporting_material_root_dir.rglob("*")
-            if p.is_file() and p.suffix == ".md"
-        ]
-        diff_set = set(all_files_in_supporting_material).difference(supporting_md_files)
+    try:
+        if engine == "stdlib":
+            # imported here, validate_stdlib uses the functions defined in this module
+            from validate_stdlib import read_and_validate_csv_stdlib
+
+            supporting_md_files = read_and_validate_csv_stdlib(
+                file_path=roadmap_csv,
+                schema=schema,
+                creator_orcids=creator_orcids,
+                material_root_dir=supporting_material_root_dir,
+                jobs=jobs,
+                cache=cache,
+                since=since,
+            )
+        else:
+            supporting_md_files = read_and_validate_csv(
+                file_path=roadmap_csv,
+                schema=schema,
+                creator_orcids=creator_orcids,
+                material_root_dir=supporting_material_root_dir,
+                jobs=jobs,
+                cache=cache,
+                since=since,
+                chunk_size=chunk_size,
+                roadmap=roadmap,
+            )
+        with kb_profile.phase("orphan scan"):
+            all_files_in_supporting_material = [
+                p
+                for p in supporting_material_root_dir.rglob("*")
+                if p.is_file() and p.suffix == ".md"
+            ]
+            diff_set = set(all_files_in_supporting_material).difference(
+                supporting_md_files
+            )
         if diff_set != set():
             print(
                 f"The following markdown files were found in the supporting material directory but were not referenced in the roadmap csv file: {diff_set}"  # noqa E501
@@ -128,244 +168,702 @@ def validate_data(
             file=sys.stderr,
         )
         return 1
+    finally:
+        if save_cache:
+            try:
+                with kb_profile.phase("save cache"):
+                    cache.save()
+            except OSError as e:
+                print(f"Failed to save validation cache: {e}.", file=sys.stderr)
     return 0
 
 
-def entry2set(entry):
+def validation_cache_salt(json_config_file, zenodo_json):
     """
-    Replace a string entry with a set and check that there are
-    no duplicate entries in the entry. If the entry is
-    nan or a null string it is replaced by the empty set.
-    Otherwise, the string is split using the semicolon as
-    the separator character, leading and trailing whitespace is
-    removed from the substrings and the results are added to the
-    set.
+    Salt of the validation cache, changes to the configuration or the list of creators
+    invalidate the cache.
     """
-    if pd.isna(entry) or entry.strip() == "":
-        return set()
-    else:
-        res_list = [v.strip() for v in entry.split(";") if v.strip() != ""]
-        res = set(res_list)
-        if len(res_list) != len(res):
-            raise ValueError(f"entry with duplicate values - {entry}")
-        return res
+    return [hash_file(json_config_file), hash_file(zenodo_json)]
+
+
+def csv_line_numbers(index):
+    """
+    Convert dataframe row indexes (zero based, header excluded) to the line numbers
+    of the corresponding rows in the csv file (one based, header is line 1).
+    """
+    return [i + 2 for i in index]
+
+
+def whitespace_violations(df):
+    violations = []
+    for col_index, col_name in enumerate(df.columns):
+        column = df[col_name].dropna()
+        bad_entries = column[column != column.str.strip()]
+        violations.extend(
+            (
+                line,
+                f"entry in column {col_index+1} ({col_name}) contains preceding or trailing whitespace, please remove: {val}",  # noqa E501
+            )
+            for line, val in zip(csv_line_numbers(bad_entries.index), bad_entries)
+        )
+    return violations
+
+
+def missing_required_value_violations(df, data_required_column_names):
+    # Entries are read as strings without NA conversion, so a missing value is either
+    # nan or the empty string.
+    violations = []
+    for col_name in sorted(data_required_column_names):
+        missing = df[col_name].isna() | (df[col_name].str.strip() == "")
+        violations.extend(
+            (
+                line,
+                f"missing value in column ({col_name}) that is required to contain data",
+            )
+            for line in csv_line_numbers(df.index[missing])
+        )
+    return violations
+
+
+def repeated_row_violations(df, ignored_column_names, row_first_lines):
+    """
+    Check for repeated rows, ignoring the columns associated with contributor's details.
+    Rows are compared using a 64 bit hash, the row_first_lines dictionary maps the hash
+    of every row seen so far to the line number of its first occurrence. It is updated
+    so that repeated rows are found across all the chunks of the roadmap.
+    """
+    import pandas as pd
+
+    row_hashes = pd.util.hash_pandas_object(
+        df.drop(ignored_column_names, axis=1), index=False
+    )
+    violations = []
+    for line, row_hash in zip(csv_line_numbers(df.index), row_hashes.tolist()):
+        first_line = row_first_lines.setdefault(row_hash, line)
+        if first_line != line:
+            violations.append((line, f"repeated row, same as line {first_line}"))
+    return violations
+
+
+def orcid_violations(orcids, creator_orcids):
+    """
+    Check the exploded ORCID columns (see kb_schema.explode_orcids). The orcids argument is
+    a dictionary whose keys are the column names and values are the exploded columns.
+    """
+    import pandas as pd
+
+    violations = []
+    # orcid/vote cannot appear more than once in the same column for a specific configuration
+    for col_name, col_orcids in orcids.items():
+        repeated = pd.MultiIndex.from_arrays(
+            [col_orcids.index, col_orcids]
+        ).duplicated()
+        violations.extend(
+            (line, f"entry in the {col_name} column with duplicate values - {orcid}")
+            for line, orcid in zip(
+                csv_line_numbers(col_orcids.index[repeated]), col_orcids[repeated]
+            )
+        )
+    # The same ORCID cannot appear in the agree and disagree columns of the same row
+    agree, disagree = orcids["Agree"], orcids["Disagree"]
+    contradicting = pd.MultiIndex.from_arrays([agree.index, agree]).isin(
+        pd.MultiIndex.from_arrays([disagree.index, disagree])
+    )
+    violations.extend(
+        (
+            line,
+            f"contradictory recommendation, ORCID {orcid} appears in agree and disagree columns",
+        )
+        for line, orcid in zip(
+            csv_line_numbers(agree.index[contradicting]), agree[contradicting]
+        )
+    )
+    # All ORCIDs need to be in the creator_orcids set
+    for col_name, col_orcids in orcids.items():
+        unknown = ~col_orcids.isin(creator_orcids)
+        violations.extend(
+            (
+                line,
+                f"ORCID in the {col_name} column which is not in the creators list in the zenodo JSON - {orcid}",
+            )
+            for line, orcid in zip(
+                csv_line_numbers(col_orcids.index[unknown]), col_orcids[unknown]
+            )
+        )
+    return violations
+
+
+def unexpected_value_violations(df, schema):
+    # Converting an enumerated column to the categorical dtype whose categories are the
+    # valid values maps the unexpected values to nan.
+    violations = []
+    for col_name, dtype in schema.categorical_dtypes.items():
+        unexpected = df[col_name][df[col_name].astype(dtype).isna()]
+        violations.extend(
+            (
+                line,
+                f"unexpected value in column titled {col_name} (see configuration file for valid values) - {v}",
+            )
+            for line, v in zip(csv_line_numbers(unexpected.index), unexpected)
+        )
+    return violations
 
 
 def read_and_validate_csv(
     file_path,
-    data_required_column_names,
-    data_optional_column_names,
-    expected_values,
+    schema,
     creator_orcids,
     material_root_dir,
+    jobs=1,
+    cache=None,
+    since=None,
+    chunk_size=None,
+    roadmap=None,
 ):
+    """
+    Validate the roadmap csv file and the supporting material it references, the
+    expected columns and values are given by the schema (see kb_schema). All
+    the row level checks are performed as column operations and all violations
+    are collected, sorted by csv line number and reported together in a single
+    ValueError. The supporting material files are validated using jobs processes
+    and the optional ValidationCache (see validate_supporting_material).
+    If since, a git reference, is given, only the supporting material of the
+    target_conjugate combinations affected by the changes since that reference is
+    validated (see changed_target_conjugate_dirs). The roadmap checks always cover
+    all rows.
+    If a chunk_size is given, the roadmap is read and checked chunk_size rows at a
+    time. The checks that span rows only retain hashes of the rows, so memory usage
+    does not depend on the size of the roadmap file. Otherwise, if a cache is given,
+    the roadmap is loaded from its snapshot (see kb_snapshot). If the roadmap was
+    already loaded, the roadmap dataframe and its exploded ORCID columns are given as
+    the roadmap tuple (see kb_snapshot.load_roadmap) and the file is not read.
+    Returns the set of supporting material file paths referenced by the roadmap.
+    """
     orcid_column_names = ["Agree", "Disagree"]
-    # Read the dataframe and keep entries that are "NA", don't convert to nan
-    df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
-    if (
-        df.empty
-    ):  # return the empty data frame and empty list of supporting material files, nothing to check
-        return df, set()
-
-    # Check that dataframe does not contain preceding or trailing whitespace in entries
-    df_stripped_whitespace = df.applymap(lambda x: x.strip(), na_action="ignore")
-    diff_entries = np.where(
-        (df != df_stripped_whitespace)
-        & ~(df.isnull() & df_stripped_whitespace.isnull())
-    )
-    if diff_entries[0].size > 0:
-        raise ValueError(
-            "Dataframe entries contain preceding or trailing whitespace, please remove [row, col, value]:\n"
-            + "\n".join(
-                [
-                    f"{row+2},{col+1}: {val}"
-                    for row, col, val in zip(
-                        diff_entries[0], diff_entries[1], df.values[diff_entries]
-                    )
-                ]
-            )
+    # Read the dataframe and keep entries that are "NA", don't convert to nan. When
+    # reading the whole file, use the roadmap snapshot if it is up to date.
+    if chunk_size:
+        chunks = kb_profile.phases(
+            "read roadmap",
+            (
+                (df, roadmap_orcids(df))
+                for df in read_roadmap(file_path, schema, chunksize=chunk_size)
+            ),
         )
+    elif roadmap is not None:
+        chunks = [roadmap]
+    else:
+        with kb_profile.phase("read roadmap"):
+            chunks = [
+                load_roadmap(file_path, schema, cache.cache_dir if cache else None)
+            ]
 
-    # Check that the roadmap/overview dataframe columns match the combined
-    # set of columns which are required to contain data or may optionally contain data.
-    if not data_required_column_names.union(data_optional_column_names) == set(
-        df.columns
-    ):
-        raise ValueError(
-            f"{file_path} - expected column names do not match those found in the csv file"
+    violations = []
+    row_first_lines = {}
+    supporting_index = {}
+    row_target_conjugate_dirs = {}
+    configuration_column_names = None
+    for df, orcids in chunks:
+        if df.empty:
+            continue
+        if configuration_column_names is None:
+            # Check that the roadmap/overview dataframe columns match the combined
+            # set of columns which are required to contain data or may optionally contain
+            # data. All other checks depend on the columns so we cannot continue if they
+            # do not match.
+            if not schema.column_names == set(df.columns):
+                raise ValueError(
+                    f"{file_path} - expected column names do not match those found in the csv file"
+                )
+            configuration_column_names = [
+                col_name
+                for col_name in df.columns
+                if col_name not in orcid_column_names
+            ]
+
+        with kb_profile.phase("whitespace check"):
+            violations.extend(whitespace_violations(df))
+        with kb_profile.phase("required values check"):
+            violations.extend(
+                missing_required_value_violations(df, schema.required_column_names)
+            )
+        with kb_profile.phase("repeated rows check"):
+            violations.extend(
+                repeated_row_violations(df, orcid_column_names, row_first_lines)
+            )
+        with kb_profile.phase("ORCID checks"):
+            violations.extend(orcid_violations(orcids, creator_orcids))
+        with kb_profile.phase("expected values check"):
+            violations.extend(unexpected_value_violations(df, schema))
+        with kb_profile.phase("supporting material index"):
+            for key, digests in supporting_material_index(
+                df, orcids, configuration_column_names
+            ).items():
+                supporting_index.setdefault(key, []).extend(digests)
+            if since:
+                row_target_conjugate_dirs.update(roadmap_row_target_conjugate_dirs(df))
+
+    if configuration_column_names is None:
+        # return empty set of supporting material files, nothing to check
+        return set()
+
+    target_conjugate_dirs = None
+    if since:
+        with kb_profile.phase("changed files"):
+            target_conjugate_dirs = changed_target_conjugate_dirs(
+                row_target_conjugate_dirs,
+                file_path,
+                material_root_dir,
+                since,
+                chunk_size,
+            )
+    return validate_roadmap_supporting_material(
+        file_path,
+        violations,
+        supporting_index,
+        configuration_column_names,
+        material_root_dir,
+        jobs,
+        cache,
+        target_conjugate_dirs,
+    )
+
+
+def validate_roadmap_supporting_material(
+    file_path,
+    violations,
+    supporting_index,
+    configuration_column_names,
+    material_root_dir,
+    jobs=1,
+    cache=None,
+    target_conjugate_dirs=None,
+):
+    """
+    Validate the supporting material referenced by the roadmap (see
+    validate_supporting_material) and report its problems together with the roadmap
+    violations, a list of (line, description) tuples. All the problems are reported in
+    a single ValueError. Returns the set of supporting material file paths referenced
+    by the roadmap.
+    """
+    # stable sort, violations in the same line retain the order of the checks
+    violations.sort(key=lambda v: v[0])
+    problems = [f"line {line}: {description}" for line, description in violations]
+
+    # Validate the supporting material, markdown files with unique names relative to the csv
+    # file location: "supporting_material"/target_conjugate/orcid.md
+    with kb_profile.phase("supporting material"):
+        supporting_files, supporting_problems = validate_supporting_material(
+            supporting_index,
+            configuration_column_names,
+            material_root_dir,
+            jobs,
+            cache,
+            target_conjugate_dirs,
         )
-    # Check that the columns which are required to have data do not contain nan
-    columns_expected_no_na = df[list(data_required_column_names)]
-    columns_with_na = columns_expected_no_na.columns[
-        columns_expected_no_na.isna().any()
-    ].tolist()
-    if columns_with_na:
+    problems.extend(supporting_problems)
+    if problems:
         raise ValueError(
-            f"{file_path} - found missing value in column(s) that are required to contain data: {columns_with_na}"
+            f"{file_path} - found {len(problems)} problem(s):\n" + "\n".join(problems)
         )
 
-    # Check for repeated rows (ignore the columns associated with contributor's details)
-    raw_df = df.drop(orcid_column_names, axis=1)
-    row_counts = raw_df.astype(str).value_counts().reset_index(name="count")
-    if any(row_counts["count"] > 1):
-        raise ValueError(  # Print the first couple of columns of the repeated rows
-            f"{file_path} - found repeated row(s), starting with:\n"
-            + row_counts.iloc[:, 0:3][row_counts["count"] > 1].to_string(index=False)
-            + "\n"  # noqa E501
-        )
+    # Return set containing all referenced markdown file paths
+    return set(supporting_files)
+
+
+def roadmap_row_target_conjugate_dirs(df):
+    """
+    Map the 64 bit hash of each roadmap row to the name of the supporting material
+    directory of the row, target_conjugate.
+    """
+    import pandas as pd
 
-    # Convert columns agreeing/disagreeing with the specific configuration to sets. orcid/vote cannot appear more
-    # than once in the same column for a specific configuration.
-    for col_name in orcid_column_names:
-        df[col_name] = df[col_name].apply(entry2set)
-    # Check that the same ORCID does not appear in the agree and disagree columns, we already know it does not
-    # appear more than once in the same column because of the entry2set apply to the dataframe above
-    rows_with_contradicting_orcid = df[orcid_column_names].apply(
-        lambda x: len(x[0]) + len(x[1]) != len(x[0].union(x[1])), axis=1
+    return dict(
+        zip(
+            pd.util.hash_pandas_object(df, index=False).tolist(),
+            (df["Target Name / Protein Biomarker"] + "_" + df["Conjugate"]).tolist(),
+        )
     )
-    if any(rows_with_contradicting_orcid):
+
+
+def git_output(args, cwd):
+    try:
+        return subprocess.run(
+            ["git"] + args, cwd=cwd, capture_output=True, check=True
+        ).stdout
+    except subprocess.CalledProcessError as e:
         raise ValueError(
-            f"{file_path} - found contradictory recommendation in the following rows (same ORCID appears in agree and disagree columns of same row, zero based numbering): {list(rows_with_contradicting_orcid[rows_with_contradicting_orcid == True].index)}"  # noqa E501
+            f"git {' '.join(args)} failed: {e.stderr.decode('utf-8', 'replace').strip()}"
         )
-    # Check that all ORCIDs are in the creator_orcids set
-    for col_name in orcid_column_names:
-        rows_not_in_creator_set = df[col_name].apply(
-            lambda x: not x.issubset(creator_orcids)
+    except OSError as e:
+        raise ValueError(f"failed running git: {e}")
+
+
+def previous_row_target_conjugate_dirs(previous_csv, roadmap_csv, chunk_size=None):
+    """
+    Map the hash of each row of a previous version of the roadmap, the previous_csv file
+    content, to its target_conjugate (see roadmap_row_target_conjugate_dirs). If the
+    columns of the current roadmap_csv file are different, all the rows are considered
+    modified and the dictionary is empty. Raises a ValueError if the content is empty.
+    """
+    import pandas as pd
+
+    chunks = pd.read_csv(
+        io.BytesIO(previous_csv),
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size,
+    )
+    if not chunk_size:
+        chunks = [chunks]
+    current_columns = pd.read_csv(roadmap_csv, dtype=str, nrows=0).columns
+    row_target_conjugate_dirs = {}
+    for previous_df in chunks:
+        if list(previous_df.columns) != list(current_columns):
+            # roadmap columns changed, all rows are considered modified
+            return {}
+        row_target_conjugate_dirs.update(roadmap_row_target_conjugate_dirs(previous_df))
+    return row_target_conjugate_dirs
+
+
+def changed_target_conjugate_dirs(
+    row_target_conjugate_dirs,
+    roadmap_csv,
+    supporting_material_root_dir,
+    since,
+    chunk_size=None,
+    read_previous_rows=previous_row_target_conjugate_dirs,
+):
+    """
+    Get the names of the supporting material directories, target_conjugate, affected
+    by the changes made since the given git reference. These include the
+    target_conjugate combinations of roadmap rows that were added, removed or modified
+    and the directories of supporting material files that were added, removed or
+    modified, committed or not. The current roadmap rows are given as a dictionary
+    mapping row hashes to target_conjugate (see roadmap_row_target_conjugate_dirs), the
+    rows of the previous roadmap are hashed in the same way by read_previous_rows (see
+    previous_row_target_conjugate_dirs).
+    """
+    roadmap_dir = pathlib.Path(roadmap_csv).parent
+    git_output(["rev-parse", "--verify", f"{since}^{{commit}}"], roadmap_dir)
+    previous_row_target_conjugate_dirs = {}
+    try:
+        previous_row_target_conjugate_dirs = read_previous_rows(
+            git_output(
+                ["show", f"{since}:./{pathlib.Path(roadmap_csv).name}"],
+                roadmap_dir,
+            ),
+            roadmap_csv,
+            chunk_size,
         )
-        if any(rows_not_in_creator_set):
-            raise ValueError(
-                f"{file_path} - found ORCID in the {col_name} column which is not in the creators list in the zenodo JSON, (zero based numbering) rows: {list(rows_not_in_creator_set[rows_not_in_creator_set==True].index)}"  # noqa E501
-            )
-    # Check that the column content for the given set of columns (see configuration file) is in
-    # the expected set of values
-    for k, val in expected_values.items():
-        rows_with_unexpected_values = df[k].apply(lambda x: x not in val)
-        if any(rows_with_unexpected_values):
-            raise ValueError(
-                f"{file_path} - found unexpected value in column titled {k}, rows (zero based numbering, see configuration file for valid values): {list(rows_with_unexpected_values[rows_with_unexpected_values == True].index)}"  # noqa E501
-            )
-    # Validate the supporting material, markdown files with unique names relative to the csv
-    # file location: "supporting_material"/target_conjugate/orcid.md
-    unique_target_conjugate = df[
-        ["Target Name / Protein Biomarker", "Conjugate"]
-    ].drop_duplicates()
-    supporting_files = unique_target_conjugate.apply(
-        lambda target_conjugate: validate_supporting_material(
-            target_conjugate, df, material_root_dir
-        ),
-        axis=1,
+    except ValueError:  # roadmap file did not exist or was empty
+        pass
+
+    # Rows are compared using their hash, a modified row appears as removed
+    # from the previous roadmap and added to the current one.
+    target_conjugate_dirs = {
+        target_conjugate
+        for row_hash, target_conjugate in row_target_conjugate_dirs.items()
+        if row_hash not in previous_row_target_conjugate_dirs
+    }
+    target_conjugate_dirs.update(
+        target_conjugate
+        for row_hash, target_conjugate in previous_row_target_conjugate_dirs.items()
+        if row_hash not in row_target_conjugate_dirs
+    )
+
+    # Modified, removed and untracked supporting material files, paths are relative to
+    # the supporting material root directory.
+    for args in [
+        ["diff", "--name-only", "--no-renames", "--relative", "-z", since, "--", "."],
+        ["ls-files", "--others", "--exclude-standard", "-z", "--", "."],
+    ]:
+        for changed_file in (
+            git_output(args, supporting_material_root_dir).decode("utf-8").split("\0")
+        ):
+            path_parts = pathlib.PurePosixPath(changed_file).parts
+            if len(path_parts) > 1:
+                target_conjugate_dirs.add(path_parts[0])
+    return target_conjugate_dirs
+
+
+def configuration_digest(configuration):
+    """
+    64 bit digest of a configuration, a sequence of strings (row without the
+    Agree/Disagree columns). Digests are compact and stable across processes and runs,
+    so configurations from the roadmap and the supporting material files are compared
+    using their digests.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(
+            "\x1f".join(configuration).encode("utf-8"), digest_size=8
+        ).digest(),
+        "little",
     )
 
-    # Return set containing all validated markdown file paths
-    return set([itm for row_list in supporting_files.tolist() for itm in row_list])
+
+def supporting_material_index(df, orcids, configuration_column_names):
+    """
+    Index the roadmap by supporting material file. A single grouping of all the
+    ORCIDs, exploded from the Agree and Disagree columns (see kb_schema.roadmap_orcids),
+    by target, conjugate and ORCID. Returns a dictionary whose keys are
+    (target, conjugate, orcid) tuples and values are lists with the digests of the
+    configurations the ORCID agrees or disagrees with (see configuration_digest).
+    """
+    import pandas as pd
+
+    digests = [
+        configuration_digest(configuration)
+        for configuration in df[configuration_column_names].itertuples(
+            index=False, name=None
+        )
+    ]
+    endorsements = pd.concat(list(orcids.values()))
+    rows = df.index.get_indexer(endorsements.index)
+    keys = pd.DataFrame(
+        {
+            "target": df["Target Name / Protein Biomarker"].to_numpy()[rows],
+            "conjugate": df["Conjugate"].to_numpy()[rows],
+            "orcid": endorsements.to_numpy(),
+            "row": rows,
+        }
+    ).drop_duplicates()
+    row_indexes = keys["row"].to_numpy()
+    return {
+        key: [digests[i] for i in row_indexes[positions]]
+        for key, positions in keys.groupby(
+            ["target", "conjugate", "orcid"], sort=False
+        ).indices.items()
+    }
 
 
 def validate_supporting_material(
-    target_conjugate, all_df, supporting_material_root_dir
+    supporting_index,
+    configuration_column_names,
+    supporting_material_root_dir,
+    jobs=1,
+    cache=None,
+    target_conjugate_dirs=None,
 ):
     """
-    Given a specific pair of target-conjugate and the complete knowledge-base dataframe, go
-    over the supporting material files for all orcids listed in the dataframe and validate that
-    the contents of the configurations listed in the supporting material files match the contents
-    of the roadmap file.
+    Go over the supporting material files for all target-conjugate-orcid combinations
+    listed in the knowledge-base and validate that the contents of the configurations
+    listed in the supporting material files match the contents of the roadmap file.
+    The roadmap is indexed once (see supporting_material_index) and each file is
+    compared to its slice of the roadmap, given by the configuration digests. When jobs is larger than one,
+    the files are parsed and compared using a pool of jobs processes. When a
+    ValidationCache is given, files whose content and roadmap slice did not change
+    since they were cached are not validated again and unchanged files are not parsed.
+    When a set of target_conjugate_dirs is given, only the files in these directories
+    are validated.
+    Returns the list of referenced file paths which were validated or skipped and the
+    list of problems found, both are sorted so that the results do not depend on the
+    number of jobs.
     """
-    tc_rows = all_df[
-        (all_df[target_conjugate.index[0]] == target_conjugate[0])
-        & (all_df[target_conjugate.index[1]] == target_conjugate[1])
-    ]
-    orcids = set().union(*(pd.concat([tc_rows["Agree"], tc_rows["Disagree"]])))
-    data_path = supporting_material_root_dir / pathlib.Path(
-        target_conjugate[0] + "_" + target_conjugate[1]
-    )
-    validated_files = []
-    for orcid in orcids:
-        md_file_path = data_path / pathlib.Path(orcid + ".md")
-        if not md_file_path.is_file():
-            raise ValueError(f"Missing expected supporting file {md_file_path}")
-        orcid_configurations = tc_rows[
-            tc_rows["Agree"].apply(lambda x: orcid in x)
-            | tc_rows["Disagree"].apply(lambda x: orcid in x)
-        ]
-        # drop the 'Agree'/'Disagree' columns they are not part of the configuration
-        orcid_configurations = orcid_configurations.loc[
-            :, ~orcid_configurations.columns.isin(["Agree", "Disagree"])
-        ]
-        try:
-            # read file content remove all rows that are only whitespace and
-            # remove leading or trailing whitespace from all other rows
-            with open(md_file_path, "r", encoding="utf-8") as f:
-                content = f.read().split("\n")
-            content = [c.strip() for c in content if c.strip()]
-            # Get configurations table, this needs to match the information in the csv file
-            config_start_section = content.index("# Configurations") + 1
-            config_end_section = content.index("# Reasoning")
-            columns = [
-                column.strip()
-                for column in content[config_start_section].split("|")
-                if column.strip()
-            ]
-            table_content = []
-            for r_index in range(config_start_section + 2, config_end_section):
-                # split the table columns and get rid of the preceding and trailing strings that correspond to table
-                # borders '|'
-                table_content.append(
-                    [rc.strip() for rc in content[r_index].split("|")][1:-1]
+    md_file_paths = []
+    results = []
+    pending = []
+    skipped_files = []
+    for (target, conjugate, orcid), expected_configurations in supporting_index.items():
+        md_file_path = (
+            supporting_material_root_dir
+            / pathlib.Path(target + "_" + conjugate)
+            / pathlib.Path(orcid + ".md")
+        )
+        if (
+            target_conjugate_dirs is not None
+            and target + "_" + conjugate not in target_conjugate_dirs
+        ):
+            skipped_files.append(md_file_path)
+            continue
+        md_file_paths.append(md_file_path)
+        results.append(None)
+        file_hash = group_key = table = None
+        if cache:
+            file_hash = cache.file_hash(md_file_path)
+            if file_hash:
+                group_key = cache.group_key(
+                    md_file_path,
+                    file_hash,
+                    configuration_column_names,
+                    sorted(expected_configurations),
                 )
-            supporting_orcid_configurations = pd.DataFrame(
-                data=table_content, columns=columns
+                if cache.has_group(group_key):
+                    results[-1] = cache.get_group(group_key)
+                    continue
+                table = cache.get_table(file_hash)
+        pending.append(
+            (
+                len(results) - 1,
+                file_hash,
+                group_key,
+                md_file_path,
+                expected_configurations,
+                table,
             )
-            supporting_orcid_configurations = supporting_orcid_configurations.loc[
-                :, ~supporting_orcid_configurations.columns.isin(["Agree", "Disagree"])
-            ]
-            unique_supporting_orcid_configurations = (
-                supporting_orcid_configurations.drop_duplicates()
-            )
-            if len(supporting_orcid_configurations) != len(
-                unique_supporting_orcid_configurations
-            ):
-                raise ValueError(
-                    f"Supporting file {md_file_path} configurations table contains duplicate entry."
-                )
-            # Compare the configuration data from the supporting material to that from the roadmap file.
-            # We don't use DataFrame.equal because that assumes the order of the columns and indexes is the same,
-            # which is a harder constraint than needed.
-            if (
-                len(unique_supporting_orcid_configurations) != len(orcid_configurations)
-            ) or (
-                len(
-                    pd.concat(
-                        [unique_supporting_orcid_configurations, orcid_configurations]
-                    ).drop_duplicates()
-                )
-                != len(unique_supporting_orcid_configurations)
-            ):
-                raise ValueError(
-                    f"Supporting file {md_file_path} configurations table does not match content of roadmap file"
-                )
+        )
+
+    task_args = (
+        [task[3] for task in pending],
+        itertools.repeat(configuration_column_names),
+        [task[4] for task in pending],
+        [task[5] for task in pending],
+    )
+    task_results = process_map(validate_supporting_file, len(pending), jobs, *task_args)
+
+    for (result_index, file_hash, group_key, *_), (problem, table) in zip(
+        pending, task_results
+    ):
+        results[result_index] = problem
+        if cache and group_key:
+            cache.set_group(group_key, problem)
+            if table is not None:
+                cache.set_table(file_hash, table)
+
+    validated_files = skipped_files
+    problems = []
+    for md_file_path, problem in zip(md_file_paths, results):
+        if problem:
+            problems.append(problem)
+        else:
             validated_files.append(md_file_path)
-        except Exception:
-            raise ValueError(
-                f"Supporting file {md_file_path} format does not match expected format"
-            )
-    return validated_files
+    return sorted(validated_files), sorted(problems)
 
 
-def main(argv=None):
-    if argv is None:  # script was invoked from commandline
-        argv = sys.argv[1:]
-    parser = argparse.ArgumentParser(description="Validate knowledge base.")
+def validate_supporting_file(
+    md_file_path, configuration_column_names, expected_configurations, table=None
+):
+    """
+    Validate a single supporting material file, its configurations table needs to match
+    the expected configurations, a list of configuration digests computed from values
+    ordered according to the configuration_column_names. The order of the columns and rows in the
+    supporting file does not matter. If the file's configurations table was already
+    parsed (see supporting_parser.parse_supporting_file) it is given as the table, and the
+    file is not read again.
+    Returns a tuple, the first entry is None if the file is valid, otherwise a
+    description of the problem. The second entry is the configurations table or None
+    if the file could not be read.
+    """
+    try:
+        if table is None:
+            if not md_file_path.is_file():
+                return f"Missing expected supporting file {md_file_path}", None
+            with kb_profile.phase("parse supporting file"):
+                table = parse_supporting_file(md_file_path)
+        columns, table_content = table[0], table[1]
+        # drop the 'Agree'/'Disagree' columns they are not part of the configuration
+        column_indexes = {
+            col_name: i
+            for i, col_name in enumerate(columns)
+            if col_name not in ["Agree", "Disagree"]
+        }
+    except SupportingFormatError as e:
+        return (
+            f"Supporting file {md_file_path} format does not match expected format, line {e.line}, column {e.column}: {e.message}",  # noqa E501
+            None,
+        )
+    except Exception:
+        return (
+            f"Supporting file {md_file_path} format does not match expected format",
+            None,
+        )
+    if set(column_indexes.keys()) != set(configuration_column_names) or len(
+        column_indexes
+    ) != len([c for c in columns if c not in ["Agree", "Disagree"]]):
+        return (
+            f"Supporting file {md_file_path} configurations table does not match content of roadmap file",
+            table,
+        )
+    supporting_configurations = [
+        configuration_digest(
+            [row[column_indexes[col_name]] for col_name in configuration_column_names]
+        )
+        for row in table_content
+    ]
+    unique_supporting_configurations = set(supporting_configurations)
+    if len(supporting_configurations) != len(unique_supporting_configurations):
+        return (
+            f"Supporting file {md_file_path} configurations table contains duplicate entry.",
+            table,
+        )
+    # Compare the configuration data from the supporting material to that from the roadmap file.
+    if len(unique_supporting_configurations) != len(
+        expected_configurations
+    ) or unique_supporting_configurations != set(expected_configurations):
+        return (
+            f"Supporting file {md_file_path} configurations table does not match content of roadmap file",
+            table,
+        )
+    return None, table
+
+
+def add_validate_data_arguments(parser):
+    """
+    Add the validate_data.py arguments to an argparse parser, shared with the
+    validation server client (see validate_server.py).
+    """
     parser.add_argument("json_config_file", type=file_path)
     parser.add_argument("roadmap_csv", type=file_path)
     parser.add_argument("supporting_material_root_dir", type=dir_path)
     parser.add_argument("zenodo_json", type=file_path)
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help="number of processes used to validate the supporting material files",
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        help="git reference (e.g. origin/main), only validate the supporting material affected by changes since then",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=positive_int,
+        help="read and check the roadmap in chunks of this many rows, bounds memory usage for large files (pandas engine only)",  # noqa E501
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pandas", "stdlib"],
+        default="pandas",
+        help="check the roadmap using pandas or only the standard library, the stdlib engine streams the roadmap row by row (default: pandas)",  # noqa E501
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help=f"do not use or update the validation cache ({CACHE_DIR_NAME} directory next to the roadmap_csv)",
+    )
+    kb_profile.add_profile_arguments(parser)
 
+
+def validate_arguments(args, cache=None, roadmap=None):
+    """
+    Validate the knowledge-base given by the parsed command line arguments (see
+    add_validate_data_arguments), the cache and roadmap are passed to validate_data.
+    """
+    with kb_profile.profiling(args, "validate_data"):
+        return validate_data(
+            args.json_config_file,
+            args.roadmap_csv,
+            args.supporting_material_root_dir,
+            args.zenodo_json,
+            args.jobs,
+            None if args.no_cache else default_cache_dir(args.roadmap_csv),
+            args.since,
+            args.chunk_size,
+            roadmap,
+            args.engine,
+            cache,
+        )
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Validate knowledge base.")
+    add_validate_data_arguments(parser)
     args = parser.parse_args(argv)
-    return validate_data(
-        args.json_config_file,
-        args.roadmap_csv,
-        args.supporting_material_root_dir,
-        args.zenodo_json,
-    )
+    return validate_arguments(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,368 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from kb_cache import CACHE_DIR_NAME, ValidationCache, default_cache_dir
+from kb_schema import load_schema
+from kb_snapshot import load_roadmap
+from validate_data import (
+    add_validate_data_arguments,
+    validate_arguments,
+    validation_cache_salt,
+)
+
+"""
+Long running validation server, keeps the knowledge-base in memory so that repeated validations,
+e.g. by an editor or a pre-commit hook, do not pay for starting the interpreter, importing pandas
+and parsing the roadmap and supporting material files each time.
+
+The server listens on a local Unix socket and validates the knowledge-base given by each request,
+with the validate_data.py arguments. For each knowledge-base it keeps in memory:
+1. The roadmap dataframe and its exploded ORCID columns (see kb_snapshot.load_roadmap).
+2. The validation cache, the supporting material file hashes, their parsed configurations tables
+   and validation results (see kb_cache.ValidationCache).
+Before each validation the modification time and size of the files are checked, and only the
+files that changed are read again. Changes to the JSON configuration or .zenodo.json files
+discard the cached data, as with the validation cache on disk. The validation cache is saved to
+the cache directory when the server stops and not after each validation (never with --no_cache).
+
+The client, the validate command, takes the same arguments as validate_data.py and returns the
+same exit code and output. If the server is not running, the client validates the knowledge-base
+itself. Requests are handled one at a time, in the client's working directory.
+
+Start the server, validate and stop the server:
+
+python validate_server.py serve &
+python validate_server.py validate validate_data_config.json ../roadmap.csv ../docs/supporting_material ../.zenodo.json
+python validate_server.py stop
+
+Notes:
+1. Unix sockets are not available on Windows.
+2. The socket path length is limited (about 100 characters), use --socket if the default path,
+   in the repository's cache directory, is too long.
+"""  # noqa E501
+
+DEFAULT_SOCKET = (
+    pathlib.Path(__file__).absolute().parent.parent / CACHE_DIR_NAME / "validate.sock"
+)
+
+
+def file_stat(path):
+    """
+    Modification time and size of the file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class KnowledgeBaseState:
+    """
+    The in-memory data of a knowledge-base, each entry is tagged with the modification
+    times and sizes of the files it was derived from.
+    """
+
+    def __init__(self):
+        self.cache = None
+        self.cache_key = None
+        self.roadmap = None
+        self.roadmap_key = None
+
+
+class ValidationServer:
+    """
+    Validates knowledge-bases using the data kept in memory, the knowledge-bases are
+    identified by the absolute path of their roadmap file.
+    """
+
+    def __init__(self):
+        self.knowledge_bases = {}
+
+    def validation_cache(self, kb, args):
+        """
+        The validation cache of the knowledge-base, loaded from the cache directory
+        unless --no_cache is given. The cache is replaced when the JSON configuration or
+        .zenodo.json files change, otherwise the entries used by the previous validation
+        are kept (see kb_cache.ValidationCache.renew).
+        """
+        cache_dir = (
+            None
+            if args.no_cache
+            else default_cache_dir(args.roadmap_csv.absolute()).resolve()
+        )
+        key = (file_stat(args.json_config_file), file_stat(args.zenodo_json), cache_dir)
+        if kb.cache is not None and kb.cache_key == key:
+            kb.cache.renew()
+            return kb.cache
+        self.save_cache(kb)
+        kb.cache = kb.cache_key = None
+        try:
+            salt = validation_cache_salt(args.json_config_file, args.zenodo_json)
+        except OSError:
+            # a file is missing, validate_data reports it
+            return None
+        kb.cache = ValidationCache(cache_dir, salt)
+        kb.cache_key = key
+        return kb.cache
+
+    def loaded_roadmap(self, kb, args):
+        """
+        The roadmap dataframe and its exploded ORCID columns, None if the roadmap is not
+        kept in memory for the requested engine or could not be loaded.
+        """
+        if args.engine != "pandas" or args.chunk_size:
+            return None
+        key = (file_stat(args.json_config_file), file_stat(args.roadmap_csv))
+        if kb.roadmap is None or kb.roadmap_key != key:
+            kb.roadmap = kb.roadmap_key = None
+            try:
+                kb.roadmap = load_roadmap(
+                    args.roadmap_csv,
+                    load_schema(args.json_config_file),
+                    None if args.no_cache else default_cache_dir(args.roadmap_csv),
+                )
+                kb.roadmap_key = key
+            except Exception:
+                # validate_data reads the roadmap again and reports the problem
+                return None
+        return kb.roadmap
+
+    def validate(self, args):
+        """
+        Validate the knowledge-base given by the parsed validate_data.py arguments, the
+        problems are printed. Returns the validate_data exit code.
+        """
+        kb = self.knowledge_bases.setdefault(
+            args.roadmap_csv.resolve(), KnowledgeBaseState()
+        )
+        return validate_arguments(
+            args, self.validation_cache(kb, args), self.loaded_roadmap(kb, args)
+        )
+
+    def save_cache(self, kb):
+        if kb.cache is None:
+            return
+        try:
+            kb.cache.save()
+        except OSError as e:
+            print(f"Failed to save validation cache: {e}.", file=sys.stderr)
+
+    def save(self):
+        for kb in self.knowledge_bases.values():
+            self.save_cache(kb)
+
+
+def validate_data_parser():
+    parser = argparse.ArgumentParser(
+        prog="validate_data.py", description="Validate knowledge base."
+    )
+    add_validate_data_arguments(parser)
+    return parser
+
+
+def handle_validate(validation_server, cwd, argv):
+    """
+    Validate the knowledge-base given by the validate_data.py command line arguments,
+    relative to the client's working directory, cwd. Returns the exit code and the
+    standard output and error of the validation.
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    previous_cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                returncode = validation_server.validate(
+                    validate_data_parser().parse_args(argv)
+                )
+            except SystemExit as e:  # invalid arguments
+                returncode = e.code
+            except Exception as e:
+                print(f"{e}", file=sys.stderr)
+                returncode = 1
+    finally:
+        os.chdir(previous_cwd)
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single request, a JSON object on one line. The validate command response
+    is a JSON object with the exit code and the output of the validation.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request["command"]
+        except (ValueError, KeyError, TypeError):
+            return
+        if command == "validate":
+            returncode, stdout, stderr = handle_validate(
+                self.server.validation_server, request["cwd"], request["argv"]
+            )
+            response = {"returncode": returncode, "stdout": stdout, "stderr": stderr}
+        elif command == "stop":
+            # shutdown waits for the request loop to exit, it cannot run in this thread
+            threading.Thread(target=self.server.shutdown).start()
+            response = {"returncode": 0, "stdout": "", "stderr": ""}
+        else:
+            return
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+def send_request(socket_path, request):
+    """
+    Send the request to the server listening on the socket_path and return its
+    response. Raises an OSError if the server is not running.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with client.makefile("rb") as fp:
+            response = fp.readline()
+    if not response:
+        raise OSError("no response from the validation server")
+    return json.loads(response)
+
+
+def create_server(socket_path):
+    """
+    Create the server listening on the socket_path, requests are handled by calling
+    its serve_forever method. A socket file left by a server which is no longer
+    running is removed, if a server is running a ValueError is raised.
+    """
+    socket_path = pathlib.Path(socket_path)
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()
+        else:
+            raise ValueError(f"validation server already running ({socket_path})")
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    server = socketserver.UnixStreamServer(str(socket_path), RequestHandler)
+    # only the user can connect to the server
+    os.chmod(socket_path, 0o600)
+    server.validation_server = ValidationServer()
+    return server
+
+
+def serve(socket_path):
+    """
+    Handle requests until the server is stopped, by a stop request, SIGTERM or
+    Ctrl-C. The validation caches are saved and the socket file is removed.
+    """
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    server = create_server(socket_path)
+    signal.signal(signal.SIGTERM, terminate)
+    print(f"Validation server listening on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pathlib.Path(socket_path).unlink(missing_ok=True)
+        server.validation_server.save()
+    return 0
+
+
+def validate(socket_path, argv):
+    """
+    Validate using the server listening on the socket_path, or in this process if the
+    server is not running. Prints the validation output and returns its exit code.
+    """
+    try:
+        response = send_request(
+            socket_path, {"command": "validate", "cwd": os.getcwd(), "argv": argv}
+        )
+    except OSError:
+        print(
+            f"Warning: validation server is not running ({socket_path}), validating in this process.",
+            file=sys.stderr,
+        )
+        return validate_arguments(validate_data_parser().parse_args(argv))
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["returncode"]
+
+
+def main(argv=None):
+    if argv is None:  # script was invoked from commandline
+        argv = sys.argv[1:]
+    socket_parser = argparse.ArgumentParser(add_help=False)
+    socket_parser.add_argument(
+        "--socket",
+        type=pathlib.Path,
+        default=DEFAULT_SOCKET,
+        help=f"path of the server's Unix socket (default: {DEFAULT_SOCKET})",
+    )
+    parser = argparse.ArgumentParser(
+        description="Validation server, keeps the knowledge-base in memory between validations."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "serve", parents=[socket_parser], help="start the validation server"
+    )
+    validate_parser = subparsers.add_parser(
+        "validate",
+        parents=[socket_parser],
+        help="validate the knowledge-base using the server, takes the validate_data.py arguments",
+    )
+    add_validate_data_arguments(validate_parser)
+    subparsers.add_parser(
+        "stop", parents=[socket_parser], help="stop the validation server"
+    )
+    args = parser.parse_args(argv)
+    if not hasattr(socket, "AF_UNIX"):
+        print("Unix sockets are not supported on this platform.", file=sys.stderr)
+        return 1
+
+    try:
+        if args.command == "serve":
+            return serve(args.socket)
+        if args.command == "validate":
+            # the validate_data.py arguments, without the --socket option
+            return validate(args.socket, socket_parser.parse_known_args(argv[1:])[1])
+        send_request(args.socket, {"command": "stop"})
+        return 0
+    except Exception as e:
+        print(f"{e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+# =========================================================================
+#
+#  Copyright Ziv Yaniv
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0.txt
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+# =========================================================================
+
+import csv
+import io
+from kb_schema import ORCID_COLUMN_NAMES
+from validate_data import (
+    changed_target_conjugate_dirs,
+    configuration_digest,
+    validate_roadmap_supporting_material,
+)
+import kb_profile
+
+"""
+Validation of the roadmap csv file using only the standard library, the stdlib engine of
+validate_data.py (--engine=stdlib). The roadmap is read with the csv module one row at a time and
+each row is checked as it is read, the checks that span rows (repeated rows, supporting material
+index) retain hashes of the rows and not the rows themselves.
+
+The checks, the problem descriptions and their order are the same as those of the pandas engine
+(see validate_data.read_and_validate_csv), so both engines report the same problems. The csv file
+is interpreted as pandas interprets it: blank lines are skipped, missing trailing entries are
+empty, repeated column names are renamed "name.1", "name.2"... and line numbers count the data
+rows after the header line. The csv module is stricter about quoting, a quoted entry must be
+followed by a comma, and quotes that are not closed are reported as problems.
+
+Without pandas, validating a roadmap does not pay for importing it, which is most of the run time
+when only a few supporting material files are validated, e.g. in a pre-commit hook:
+
+python validate_data.py validate_data_config.json ../roadmap.csv ../docs/supporting_material ../.zenodo.json --engine=stdlib --since HEAD
+"""  # noqa E501
+
+
+def read_csv_header(rows):
+    """
+    Read the header row from the csv rows iterator, repeated column names are renamed
+    as pandas does, "name", "name.1", "name.2"... Raises a ValueError if there is no
+    header.
+    """
+    for header in rows:
+        if header:
+            break
+    else:
+        raise ValueError("No columns to parse from file")
+    column_names = []
+    seen = set()
+    for col_name in header:
+        name = col_name
+        counter = 0
+        while name in seen:
+            counter += 1
+            name = f"{col_name}.{counter}"
+        seen.add(name)
+        column_names.append(name)
+    return column_names
+
+
+def read_csv_rows(rows, column_count):
+    """
+    Iterate over the data rows from the csv.reader rows, yielding (line, row) tuples
+    where line is the csv line number as reported by the pandas engine (see
+    validate_data.csv_line_numbers). Blank rows are skipped, short rows are padded with
+    empty entries and long rows raise a ValueError, as in pandas.read_csv.
+    """
+    line = 1
+    while True:
+        try:
+            row = next(rows, None)
+        except csv.Error as e:
+            raise ValueError(
+                f"Error tokenizing data, line {rows.line_num}: {e}"
+            ) from None
+        if row is None:
+            return
+        if not row:
+            continue
+        line += 1
+        if len(row) > column_count:
+            raise ValueError(
+                f"Error tokenizing data. C error: Expected {column_count} fields in line {rows.line_num}, saw {len(row)}\n"  # noqa E501
+            )
+        if len(row) < column_count:
+            row = row + [""] * (column_count - len(row))
+        yield line, row
+
+
+def split_orcids(entry):
+    """
+    Split a semicolon separated ORCIDs entry into a list of ORCIDs, leading and trailing
+    whitespace is removed and empty entries are dropped (see kb_schema.explode_orcids).
+    """
+    return [orcid for orcid in (o.strip() for o in entry.split(";")) if orcid]
+
+
+def row_violations(
+    line,
+    row,
+    column_names,
+    required_column_indexes,
+    repeated_row_indexes,
+    orcid_column_indexes,
+    expected_values,
+    creator_orcids,
+    row_first_lines,
+):
+    """
+    Check a single roadmap row, returns the list of (line, description) violations in
+    the order in which the pandas engine reports them for the row.
+    """
+    violations = []
+    for col_index, (col_name, val) in enumerate(zip(column_names, row)):
+        if val != val.strip():
+            violations.append(
+                (
+                    line,
+                    f"entry in column {col_index+1} ({col_name}) contains preceding or trailing whitespace, please remove: {val}",  # noqa E501
+                )
+            )
+    for col_name, col_index in required_column_indexes:
+        if row[col_index].strip() == "":
+            violations.append(
+                (
+                    line,
+                    f"missing value in column ({col_name}) that is required to contain data",
+                )
+            )
+    first_line = row_first_lines.setdefault(
+        hash(tuple(row[i] for i in repeated_row_indexes)), line
+    )
+    if first_line != line:
+        violations.append((line, f"repeated row, same as line {first_line}"))
+
+    orcids = {
+        col_name: split_orcids(row[col_index])
+        for col_name, col_index in orcid_column_indexes
+    }
+    for col_name, col_orcids in orcids.items():
+        seen = set()
+        for orcid in col_orcids:
+            if orcid in seen:
+                violations.append(
+                    (
+                        line,
+                        f"entry in the {col_name} column with duplicate values - {orcid}",
+                    )
+                )
+            seen.add(orcid)
+    disagree = set(orcids["Disagree"])
+    violations.extend(
+        (
+            line,
+            f"contradictory recommendation, ORCID {orcid} appears in agree and disagree columns",
+        )
+        for orcid in orcids["Agree"]
+        if orcid in disagree
+    )
+    for col_name, col_orcids in orcids.items():
+        violations.extend(
+            (
+                line,
+                f"ORCID in the {col_name} column which is not in the creators list in the zenodo JSON - {orcid}",
+            )
+            for orcid in col_orcids
+            if orcid not in creator_orcids
+        )
+
+    for col_name, col_index, values in expected_values:
+        if row[col_index] not in values:
+            violations.append(
+                (
+                    line,
+                    f"unexpected value in column titled {col_name} (see configuration file for valid values) - {row[col_index]}",  # noqa E501
+                )
+            )
+    return violations
+
+
+def row_target_conjugate_dir(row, target_index, conjugate_index):
+    return row[target_index] + "_" + row[conjugate_index]
+
+
+def previous_row_target_conjugate_dirs(previous_csv, roadmap_csv, chunk_size=None):
+    """
+    Map the digest of each row of a previous version of the roadmap, the previous_csv
+    file content, to its target_conjugate (see validate_data.changed_target_conjugate_dirs).
+    Rows are identified by the configuration_digest of all their entries. If the columns
+    of the current roadmap_csv file are different, all the rows are considered modified
+    and the dictionary is empty. Raises a ValueError if the content is empty. The
+    chunk_size is ignored, the rows are always read one at a time.
+    """
+    rows = csv.reader(
+        io.StringIO(previous_csv.decode("utf-8-sig"), newline=""), strict=True
+    )
+    column_names = read_csv_header(rows)
+    with open(roadmap_csv, encoding="utf-8-sig", newline="") as fp:
+        if read_csv_header(csv.reader(fp)) != column_names:
+            # roadmap columns changed, all rows are considered modified
+            return {}
+    target_index = column_names.index("Target Name / Protein Biomarker")
+    conjugate_index = column_names.index("Conjugate")
+    return {
+        configuration_digest(row): row_target_conjugate_dir(
+            row, target_index, conjugate_index
+        )
+        for _, row in read_csv_rows(rows, len(column_names))
+    }
+
+
+def read_and_validate_csv_stdlib(
+    file_path,
+    schema,
+    creator_orcids,
+    material_root_dir,
+    jobs=1,
+    cache=None,
+    since=None,
+):
+    """
+    Validate the roadmap csv file and the supporting material it references, the same
+    checks as validate_data.read_and_validate_csv using the csv module instead of pandas.
+    The roadmap is streamed, each row is checked when it is read. All violations are
+    collected, sorted by csv line number and reported together in a single ValueError.
+    Returns the set of supporting material file paths referenced by the roadmap.
+    """
+    violations = []
+    row_first_lines = {}
+    supporting_index = {}
+    row_target_conjugate_dirs = {}
+    configuration_column_names = None
+    with open(file_path, encoding="utf-8-sig", newline="") as fp, kb_profile.phase(
+        "roadmap checks"
+    ):
+        rows = csv.reader(fp, strict=True)
+        column_names = read_csv_header(rows)
+        for line, row in read_csv_rows(rows, len(column_names)):
+            if configuration_column_names is None:
+                # Check that the roadmap columns match the combined set of columns which
+                # are required to contain data or may optionally contain data. All other
+                # checks depend on the columns so we cannot continue if they do not match.
+                if not schema.column_names == set(column_names):
+                    raise ValueError(
+                        f"{file_path} - expected column names do not match those found in the csv file"
+                    )
+                column_indexes = {
+                    col_name: i for i, col_name in enumerate(column_names)
+                }
+                configuration_column_names = [
+                    col_name
+                    for col_name in column_names
+                    if col_name not in ORCID_COLUMN_NAMES
+                ]
+                configuration_indexes = [
+                    column_indexes[col_name] for col_name in configuration_column_names
+                ]
+                required_column_indexes = [
+                    (col_name, column_indexes[col_name])
+                    for col_name in sorted(schema.required_column_names)
+                ]
+                orcid_column_indexes = [
+                    (col_name, column_indexes[col_name])
+                    for col_name in ORCID_COLUMN_NAMES
+                ]
+                expected_values = [
+                    (col_name, column_indexes[col_name], frozenset(values))
+                    for col_name, values in schema.expected_values.items()
+                ]
+                target_index = column_indexes["Target Name / Protein Biomarker"]
+                conjugate_index = column_indexes["Conjugate"]
+
+            violations.extend(
+                row_violations(
+                    line,
+                    row,
+                    column_names,
+                    required_column_indexes,
+                    configuration_indexes,
+                    orcid_column_indexes,
+                    expected_values,
+                    creator_orcids,
+                    row_first_lines,
+                )
+            )
+            digest = configuration_digest([row[i] for i in configuration_indexes])
+            target = row[target_index]
+            conjugate = row[conjugate_index]
+            for orcid in dict.fromkeys(
+                split_orcids(row[column_indexes["Agree"]])
+                + split_orcids(row[column_indexes["Disagree"]])
+            ):
+                supporting_index.setdefault((target, conjugate, orcid), []).append(
+                    digest
+                )
+            if since:
+                row_target_conjugate_dirs[
+                    configuration_digest(row)
+                ] = row_target_conjugate_dir(row, target_index, conjugate_index)
+
+    if configuration_column_names is None:
+        # return empty set of supporting material files, nothing to check
+        return set()
+
+    target_conjugate_dirs = None
+    if since:
+        with kb_profile.phase("changed files"):
+            target_conjugate_dirs = changed_target_conjugate_dirs(
+                row_target_conjugate_dirs,
+                file_path,
+                material_root_dir,
+                since,
+                read_previous_rows=previous_row_target_conjugate_dirs,
+            )
+    return validate_roadmap_supporting_material(
+        file_path,
+        violations,
+        supporting_index,
+        configuration_column_names,
+        material_root_dir,
+        jobs,
+        cache,
+        target_conjugate_dirs,
+    )